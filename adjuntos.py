@@ -0,0 +1,214 @@
+import hashlib
+import os
+import queue
+import tempfile
+import threading
+
+try:
+    from PIL import Image as ImagenPIL
+except ImportError:
+    ImagenPIL = None
+
+# Fotos de los aparatos: los archivos quedan fuera de SQLite, en un
+# directorio direccionado por contenido (el nombre es el SHA-256 de los
+# bytes), así la misma foto cargada dos veces ocupa lugar una sola vez. La
+# base solo guarda qué foto es de qué aparato (ver create_attachments).
+# Las miniaturas se generan en un hilo aparte y quedan en disco: la interfaz
+# nunca decodifica una foto de tamaño completo. Con Pillow se reducen en ese
+# hilo; sin Pillow el hilo decodifica y la GPU reduce en el de la interfaz.
+
+DIRECTORIO_ADJUNTOS_POR_DEFECTO = 'adjuntos'
+EXTENSIONES_IMAGEN = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')
+LADO_MINIATURA = 160   # px, la tira de fotos de las pantallas
+LADO_VISTA = 1024      # px, una foto abierta
+BLOQUE_LECTURA = 1024 * 1024
+
+
+def reducir_con_pil(ruta, lado, destino):
+    # Pillow reduce al decodificar (draft: los JPEG se leen ya a 1/2, 1/4 u
+    # 1/8) y termina con su remuestreo en C; todo en el hilo de miniaturas
+    with ImagenPIL.open(ruta) as imagen:
+        imagen.draft('RGB', (lado, lado))
+        imagen.thumbnail((lado, lado))
+        imagen = imagen.convert('RGBA' if 'A' in imagen.getbands() else 'RGB')
+        imagen.save(destino, 'PNG')
+
+
+def decodificar(ruta):
+    # Con los cargadores de Kivy (SDL2): decodifica al crear la imagen; la
+    # textura se crea recién al pedirla, en el hilo de la interfaz
+    from kivy.core.image import Image as CoreImage
+    return CoreImage(ruta, nocache=True)
+
+
+def reducir(imagen, lado, destino):
+    # En el hilo de la interfaz: la GPU dibuja la textura en un Fbo del
+    # tamaño de la miniatura, como el logo en main.py
+    from kivy.graphics import Fbo, ClearColor, ClearBuffers, Rectangle
+    original = imagen.texture
+    escala = min(lado / original.width, lado / original.height, 1)
+    tamano = (max(1, round(original.width * escala)), max(1, round(original.height * escala)))
+    fbo = Fbo(size=tamano)
+    with fbo:
+        ClearColor(0, 0, 0, 0)
+        ClearBuffers()
+        Rectangle(texture=original, size=tamano)
+    fbo.draw()
+    fbo.texture.save(destino, fmt='png')
+
+
+class DirectorioAdjuntos:
+    # Archivos por hash: ab/cdef... (las dos primeras cifras como carpeta
+    # para que ninguna quede con demasiados archivos) y sus miniaturas en
+    # miniaturas/<lado>/ab/cdef....png
+    def __init__(self, directorio=None):
+        if directorio is None:
+            directorio = os.environ.get('REPARACIONES_ADJUNTOS', DIRECTORIO_ADJUNTOS_POR_DEFECTO)
+        self.directorio = directorio
+
+    def ruta(self, hash_archivo):
+        return os.path.join(self.directorio, hash_archivo[:2], hash_archivo[2:])
+
+    def ruta_miniatura(self, hash_archivo, lado):
+        return os.path.join(self.directorio, 'miniaturas', str(lado), hash_archivo[:2], hash_archivo[2:] + '.png')
+
+    def guardar(self, origen):
+        # Copia y calcula el hash en una sola lectura. Devuelve (hash,
+        # tamaño, nuevo); si ya estaba, la copia se descarta.
+        os.makedirs(self.directorio, exist_ok=True)
+        resumen = hashlib.sha256()
+        tamano = 0
+        descriptor, temporal = tempfile.mkstemp(dir=self.directorio, suffix='.tmp')
+        try:
+            with open(origen, 'rb') as entrada, os.fdopen(descriptor, 'wb') as salida:
+                while True:
+                    bloque = entrada.read(BLOQUE_LECTURA)
+                    if not bloque:
+                        break
+                    resumen.update(bloque)
+                    salida.write(bloque)
+                    tamano += len(bloque)
+            hash_archivo = resumen.hexdigest()
+            destino = self.ruta(hash_archivo)
+            if os.path.exists(destino):
+                os.remove(temporal)
+                return hash_archivo, tamano, False
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            os.replace(temporal, destino)
+            return hash_archivo, tamano, True
+        except BaseException:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+
+    def borrar(self, hash_archivo):
+        # La foto y todas sus miniaturas; solo cuando ningún adjunto la usa
+        rutas = [self.ruta(hash_archivo)]
+        carpeta_miniaturas = os.path.join(self.directorio, 'miniaturas')
+        if os.path.isdir(carpeta_miniaturas):
+            rutas += [self.ruta_miniatura(hash_archivo, lado) for lado in os.listdir(carpeta_miniaturas)]
+        for ruta in rutas:
+            if os.path.exists(ruta):
+                os.remove(ruta)
+
+    def generar_miniatura(self, hash_archivo, lado, en_la_interfaz=None):
+        # en_la_interfaz(funcion) la corre en el hilo de Kivy y espera; sin
+        # él, quien llama ya está en ese hilo (solo hace falta sin Pillow)
+        ruta = self.ruta(hash_archivo)
+        destino = self.ruta_miniatura(hash_archivo, lado)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        # Escribir aparte y renombrar: nadie lee una miniatura a medias
+        temporal = '%s.%d.tmp' % (destino, threading.get_ident())
+        try:
+            if ImagenPIL is not None:
+                reducir_con_pil(ruta, lado, temporal)
+            else:
+                imagen = decodificar(ruta)
+                tarea = lambda: reducir(imagen, lado, temporal)
+                if en_la_interfaz is None:
+                    tarea()
+                else:
+                    en_la_interfaz(tarea)
+            os.replace(temporal, destino)
+        except BaseException:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+        return destino
+
+
+class ColaMiniaturas:
+    # pedir() devuelve la ruta si la miniatura ya está en disco; si no, la
+    # encarga a un hilo y al_terminar(ruta, error) se llama desde ese hilo.
+    # Se atiende primero lo último pedido (lo que está en pantalla al
+    # desplazarse) y los pedidos repetidos se juntan en uno.
+    def __init__(self, adjuntos):
+        self.adjuntos = adjuntos
+        self.pedidos = queue.LifoQueue()
+        self.pendientes = {}  # (hash, lado) -> avisos esperando
+        self.cerrojo = threading.Lock()
+        self.cerrando = threading.Event()
+        self.hilo = threading.Thread(target=self.trabajar, name='miniaturas', daemon=True)
+        self.hilo.start()
+
+    def pedir(self, hash_archivo, lado, al_terminar=None):
+        ruta = self.adjuntos.ruta_miniatura(hash_archivo, lado)
+        if os.path.exists(ruta):
+            return ruta
+        with self.cerrojo:
+            avisos = self.pendientes.get((hash_archivo, lado))
+            if avisos is None:
+                self.pendientes[(hash_archivo, lado)] = avisos = []
+                self.pedidos.put((hash_archivo, lado))
+            if al_terminar is not None:
+                avisos.append(al_terminar)
+        return None
+
+    def trabajar(self):
+        while True:
+            pedido = self.pedidos.get()
+            if pedido is None:
+                self.pedidos.task_done()
+                break
+            ruta = error = None
+            try:
+                ruta = self.adjuntos.generar_miniatura(*pedido, en_la_interfaz=self.en_la_interfaz)
+            except Exception as e:
+                error = e
+                print(f"No se pudo generar la miniatura de {pedido[0]}: {e}")
+            with self.cerrojo:
+                avisos = self.pendientes.pop(pedido, [])
+            for al_terminar in avisos:
+                al_terminar(ruta, error)
+            self.pedidos.task_done()
+
+    def en_la_interfaz(self, funcion):
+        # Texturas y Fbo solo se crean en el hilo de Kivy: se encarga con el
+        # reloj y se espera. Al cerrar se deja de esperar, la interfaz ya no
+        # atiende el reloj.
+        from kivy.clock import Clock
+        listo = threading.Event()
+        errores = []
+
+        def correr(dt):
+            try:
+                if not self.cerrando.is_set():
+                    funcion()
+            except Exception as e:
+                errores.append(e)
+            listo.set()
+
+        Clock.schedule_once(correr)
+        while not listo.wait(0.1):
+            if self.cerrando.is_set():
+                raise RuntimeError('La cola de miniaturas se cerró')
+        if errores:
+            raise errores[0]
+
+    def esperar(self):
+        self.pedidos.join()
+
+    def cerrar(self):
+        self.cerrando.set()
+        self.pedidos.put(None)
+        self.hilo.join()
@@ -0,0 +1,68 @@
+from kivy.event import EventDispatcher
+from kivy.properties import NumericProperty, ObjectProperty
+
+# Estado compartido de la interfaz: el aparato seleccionado y las filas que
+# muestra la tabla del menú. DatabaseManager avisa después de cada commit qué
+# aparatos cambiaron; el almacén relee solo esos y reparte el resultado:
+#   seleccionado   DetalleAparato del aparato abierto (una consulta para
+#                  todas las pantallas del flujo)
+#   on_filas       (cambiadas, borradas): filas de la tabla que cambiaron de
+#                  verdad, incluidas las nuevas, e ids que ya no existen
+#   on_recargar    cambió demasiado (o no se sabe qué): volver a cargar
+
+MAXIMO_DIFERENCIAS = 1000
+
+
+class AlmacenAparatos(EventDispatcher):
+    aparato_id = NumericProperty(0)                      # 0: ninguno
+    seleccionado = ObjectProperty(None, allownone=True)
+
+    __events__ = ('on_filas', 'on_recargar')
+
+    def __init__(self, db, **kwargs):
+        super().__init__(**kwargs)
+        self.db = db
+        # id -> (id, tipo, marca) de las filas que muestra la tabla
+        self.filas = {}
+        db.oyentes.append(self.recibir_cambios)
+
+    def seleccionar(self, aparato_id):
+        detalle = self.db.get_aparato_detalle(aparato_id)
+        self.aparato_id = detalle.id if detalle is not None else 0
+        if detalle == self.seleccionado:
+            # Mismo contenido: las pantallas igual vuelven a mostrarlo
+            self.property('seleccionado').dispatch(self)
+        else:
+            self.seleccionado = detalle
+        return detalle
+
+    def mostrar(self, filas, agregar=False):
+        # La tabla informa lo que tiene en pantalla
+        if not agregar:
+            self.filas.clear()
+        self.filas.update((fila[0], tuple(fila)) for fila in filas)
+
+    def recibir_cambios(self, ids):
+        if ids is None or len(ids) > MAXIMO_DIFERENCIAS:
+            self.dispatch('on_recargar')
+        else:
+            actuales = {fila[0]: tuple(fila) for fila in self.db.get_aparatos_filas(ids)}
+            cambiadas = [fila for aparato_id, fila in sorted(actuales.items()) if self.filas.get(aparato_id) != fila]
+            borradas = [aparato_id for aparato_id in ids if aparato_id in self.filas and aparato_id not in actuales]
+            for fila in cambiadas:
+                if fila[0] in self.filas:
+                    self.filas[fila[0]] = fila
+            for aparato_id in borradas:
+                del self.filas[aparato_id]
+            if cambiadas or borradas:
+                self.dispatch('on_filas', cambiadas, borradas)
+        if self.aparato_id and (ids is None or self.aparato_id in ids):
+            detalle = self.db.get_aparato_detalle(self.aparato_id)
+            self.aparato_id = detalle.id if detalle is not None else 0
+            self.seleccionado = detalle
+
+    def on_filas(self, cambiadas, borradas):
+        pass
+
+    def on_recargar(self):
+        pass
@@ -0,0 +1,405 @@
+import argparse
+import asyncio
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from avisos import ColaAvisos
+from database import DatabaseManager
+from servicio import (ServicioReparaciones, AparatoNoEncontrado, ClienteNoEncontrado, FotoNoEncontrada, ErrorServicio,
+                      DIAS_ATRASO, ESTADO_ENTREGADO)
+
+# API HTTP/JSON local para que varios mostradores y la tableta del taller
+# trabajen contra la misma base. Conexiones keep-alive y lotes de
+# operaciones en POST /lote. Uso: python api.py [--host H] [--port P] [--db RUTA]
+
+MAX_CUERPO = 1024 * 1024
+ESPERA_INACTIVA = 60  # segundos que se mantiene abierta una conexión sin pedidos
+
+RAZONES = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class ErrorHTTP(Exception):
+    def __init__(self, estado, mensaje):
+        super().__init__(mensaje)
+        self.estado = estado
+
+
+def leer_entero(consulta, nombre, defecto, minimo=0, maximo=None):
+    # Ningún parámetro entero admite negativos; limit pide minimo=1
+    # (LIMIT negativo en SQLite es sin límite)
+    try:
+        valor = int(consulta.get(nombre, defecto))
+    except ValueError:
+        raise ErrorHTTP(400, f"Parámetro {nombre} inválido")
+    if valor < minimo:
+        raise ErrorHTTP(400, f"Parámetro {nombre} debe ser al menos {minimo}")
+    return valor if maximo is None else min(valor, maximo)
+
+
+def linea_de(cuerpo):
+    # Una línea como objeto {"tipo", "descripcion", "cantidad", "precio"}
+    if not isinstance(cuerpo, dict):
+        raise ErrorHTTP(400, "Cada línea debe ser un objeto")
+    return (cuerpo.get('tipo', ''), cuerpo.get('descripcion', ''), cuerpo.get('cantidad', 1), cuerpo.get('precio', ''))
+
+
+def aparato_a_dict(fila):
+    return {'id': fila[0], 'tipo': fila[1], 'marca': fila[2]}
+
+
+def estimacion_de(estimacion):
+    if estimacion is None:
+        return None
+    datos = estimacion._asdict()
+    datos['diagnosticos'] = [{'diagnostico': d, 'cantidad': n} for d, n in estimacion.diagnosticos]
+    return datos
+
+
+class Rutas:
+    # Traduce (método, ruta) a llamadas del servicio. Se ejecuta siempre en el
+    # mismo hilo, dueño de la conexión de escritura de SQLite.
+    def __init__(self, servicio):
+        self.servicio = servicio
+        self.tabla = [
+            ('GET', re.compile(r'^/aparatos$'), self.listar),
+            ('POST', re.compile(r'^/aparatos$'), self.registrar),
+            ('GET', re.compile(r'^/aparatos/(\d+)$'), self.consultar),
+            ('POST', re.compile(r'^/aparatos/(\d+)/diagnosticos$'), self.diagnosticar),
+            ('POST', re.compile(r'^/aparatos/(\d+)/lineas$'), self.agregar_linea),
+            ('POST', re.compile(r'^/aparatos/(\d+)/estado$'), self.cambiar_estado),
+            ('POST', re.compile(r'^/aparatos/(\d+)/listo$'), self.marcar_listo),
+            ('POST', re.compile(r'^/aparatos/(\d+)/observaciones$'), self.observaciones),
+            ('POST', re.compile(r'^/aparatos/(\d+)/entregar$'), self.entregar),
+            ('GET', re.compile(r'^/aparatos/(\d+)/factura$'), self.facturar),
+            ('GET', re.compile(r'^/aparatos/(\d+)/historial$'), self.historial),
+            ('GET', re.compile(r'^/aparatos/(\d+)/avisos$'), self.avisos),
+            ('GET', re.compile(r'^/aparatos/(\d+)/precio$'), self.precio_aparato),
+            ('GET', re.compile(r'^/aparatos/(\d+)/fotos$'), self.fotos),
+            ('POST', re.compile(r'^/fotos/(\d+)/quitar$'), self.quitar_foto),
+            ('GET', re.compile(r'^/precios$'), self.estimar_precio),
+            ('GET', re.compile(r'^/buscar$'), self.buscar),
+            ('GET', re.compile(r'^/clientes$'), self.buscar_clientes),
+            ('GET', re.compile(r'^/clientes/(\d+)/aparatos$'), self.aparatos_de_cliente),
+            ('POST', re.compile(r'^/clientes/(\d+)/prioridad$'), self.prioridad_cliente),
+            ('GET', re.compile(r'^/trabajos$'), self.cola_trabajos),
+            ('POST', re.compile(r'^/trabajos/siguiente$'), self.tomar_siguiente),
+            ('GET', re.compile(r'^/trabajos/tecnico$'), self.trabajos_de),
+            ('POST', re.compile(r'^/trabajos/politica$'), self.cambiar_politica),
+            ('GET', re.compile(r'^/estadisticas/estados$'), self.estadisticas_estados),
+            ('GET', re.compile(r'^/tablero$'), self.tablero),
+        ]
+
+    def atender(self, metodo, ruta, cuerpo):
+        # Devuelve (estado, respuesta) sin lanzar excepciones
+        try:
+            if metodo == 'POST' and urlsplit(ruta).path == '/lote':
+                return 200, self.lote(cuerpo)
+            return self.despachar(metodo, ruta, cuerpo)
+        except ErrorHTTP as e:
+            return e.estado, {'error': str(e)}
+        except (AparatoNoEncontrado, ClienteNoEncontrado, FotoNoEncontrada) as e:
+            return 404, {'error': str(e)}
+        except ErrorServicio as e:
+            return 400, {'error': str(e)}
+        except Exception as e:
+            return 500, {'error': f"{type(e).__name__}: {e}"}
+
+    def despachar(self, metodo, ruta, cuerpo):
+        if cuerpo is not None and not isinstance(cuerpo, dict):
+            raise ErrorHTTP(400, "El cuerpo debe ser un objeto JSON")
+        partes = urlsplit(ruta)
+        consulta = {k: v[-1] for k, v in parse_qs(partes.query).items()}
+        ruta_encontrada = False
+        for metodo_ruta, patron, funcion in self.tabla:
+            coincidencia = patron.match(partes.path)
+            if not coincidencia:
+                continue
+            ruta_encontrada = True
+            if metodo_ruta == metodo:
+                return funcion(*coincidencia.groups(), consulta=consulta, cuerpo=cuerpo or {})
+        if ruta_encontrada:
+            raise ErrorHTTP(405, f"Método {metodo} no permitido en {partes.path}")
+        raise ErrorHTTP(404, f"Ruta desconocida: {partes.path}")
+
+    def lote(self, operaciones):
+        # Varias operaciones en un solo pedido; cada una responde por separado
+        if not isinstance(operaciones, list):
+            raise ErrorHTTP(400, "El lote debe ser una lista de operaciones")
+        respuestas = []
+        for operacion in operaciones:
+            if not isinstance(operacion, dict):
+                respuestas.append({'estado': 400, 'cuerpo': {'error': "Operación inválida"}})
+                continue
+            ruta = operacion.get('ruta', '')
+            # Un lote dentro de otro se llamaría a sí mismo sin límite
+            if isinstance(ruta, str) and urlsplit(ruta).path == '/lote':
+                respuestas.append({'estado': 400, 'cuerpo': {'error': "Un lote no puede incluir /lote"}})
+                continue
+            estado, cuerpo = self.atender(operacion.get('metodo', 'GET').upper(), ruta, operacion.get('cuerpo'))
+            respuestas.append({'estado': estado, 'cuerpo': cuerpo})
+        return respuestas
+
+    def listar(self, consulta, cuerpo):
+        after_id = leer_entero(consulta, 'after_id', 0)
+        limit = leer_entero(consulta, 'limit', 100, minimo=1, maximo=1000)
+        return 200, [aparato_a_dict(a) for a in self.servicio.listar(after_id, limit)]
+
+    def buscar(self, consulta, cuerpo):
+        limit = leer_entero(consulta, 'limit', 100, minimo=1, maximo=1000)
+        return 200, [aparato_a_dict(a) for a in self.servicio.buscar(consulta.get('q', ''), limit)]
+
+    def buscar_clientes(self, consulta, cuerpo):
+        limit = leer_entero(consulta, 'limit', 10, minimo=1, maximo=100)
+        campos = ('id', 'nombre', 'telefono', 'aparatos')
+        return 200, [dict(zip(campos, fila)) for fila in self.servicio.buscar_clientes(consulta.get('q', ''), limit)]
+
+    def aparatos_de_cliente(self, cliente_id, consulta, cuerpo):
+        limit = leer_entero(consulta, 'limit', 100, minimo=1, maximo=1000)
+        cliente, aparatos = self.servicio.aparatos_de_cliente(cliente_id, limit)
+        campos = ('id', 'tipo', 'marca', 'modelo', 'estado')
+        return 200, {'id': cliente[0], 'nombre': cliente[1], 'telefono': cliente[2],
+                     'aparatos': [dict(zip(campos, fila)) for fila in aparatos]}
+
+    def prioridad_cliente(self, cliente_id, consulta, cuerpo):
+        self.servicio.prioridad_cliente(cliente_id, cuerpo.get('prioridad', ''))
+        return 200, {'id': int(cliente_id), 'prioridad': cuerpo.get('prioridad')}
+
+    def cola_trabajos(self, consulta, cuerpo):
+        limit = leer_entero(consulta, 'limit', 50, minimo=1, maximo=1000)
+        campos = ('id', 'tipo', 'marca', 'prioridad', 'fecha_prometida', 'esfuerzo')
+        return 200, [dict(zip(campos, fila)) for fila in self.servicio.cola_trabajos(limit)]
+
+    def tomar_siguiente(self, consulta, cuerpo):
+        # {"tecnico": nombre}; con la cola vacía responde {"id": null}
+        aparato = self.servicio.tomar_siguiente(cuerpo.get('tecnico'), origen='api')
+        return 200, aparato._asdict() if aparato is not None else {'id': None}
+
+    def trabajos_de(self, consulta, cuerpo):
+        campos = ('id', 'tipo', 'marca', 'fecha_prometida', 'tomado')
+        return 200, [dict(zip(campos, fila)) for fila in self.servicio.trabajos_de(consulta.get('nombre', ''))]
+
+    def cambiar_politica(self, consulta, cuerpo):
+        self.servicio.cambiar_politica(cuerpo.get('politica'))
+        return 200, {'politica': cuerpo.get('politica')}
+
+    def registrar(self, consulta, cuerpo):
+        campos = ('tipo', 'marca', 'modelo', 'numero_serie', 'problema', 'estado',
+                  'nombre_cliente', 'telefono_cliente')
+        aparato_id = self.servicio.registrar_aparato(*(cuerpo.get(c, '') for c in campos),
+                                                     origen='api', usuario=cuerpo.get('usuario'))
+        return 201, {'id': aparato_id}
+
+    def consultar(self, aparato_id, consulta, cuerpo):
+        return 200, self.servicio.consultar(aparato_id)._asdict()
+
+    def diagnosticar(self, aparato_id, consulta, cuerpo):
+        lineas = cuerpo.get('lineas') or []
+        if not isinstance(lineas, list):
+            raise ErrorHTTP(400, "lineas debe ser una lista")
+        diagnostico_id = self.servicio.registrar_diagnostico(aparato_id, cuerpo.get('diagnostico', ''),
+                                                             cuerpo.get('valor', ''), [linea_de(l) for l in lineas])
+        return 201, {'id': int(aparato_id), 'diagnostico_id': diagnostico_id}
+
+    def agregar_linea(self, aparato_id, consulta, cuerpo):
+        linea_id = self.servicio.agregar_linea(aparato_id, *linea_de(cuerpo))
+        return 201, {'id': int(aparato_id), 'linea_id': linea_id}
+
+    def cambiar_estado(self, aparato_id, consulta, cuerpo):
+        self.servicio.cambiar_estado(aparato_id, cuerpo.get('estado'), origen='api', usuario=cuerpo.get('usuario'))
+        return 200, {'id': int(aparato_id), 'estado': cuerpo.get('estado')}
+
+    def marcar_listo(self, aparato_id, consulta, cuerpo):
+        self.servicio.marcar_listo(aparato_id, cuerpo.get('observaciones'), origen='api',
+                                   usuario=cuerpo.get('usuario'))
+        return 200, {'id': int(aparato_id), 'estado': 'Listo'}
+
+    def observaciones(self, aparato_id, consulta, cuerpo):
+        self.servicio.guardar_observaciones(aparato_id, cuerpo.get('observaciones', ''))
+        return 200, {'id': int(aparato_id)}
+
+    def entregar(self, aparato_id, consulta, cuerpo):
+        self.servicio.entregar(aparato_id, origen='api', usuario=cuerpo.get('usuario'))
+        return 200, {'id': int(aparato_id), 'estado': ESTADO_ENTREGADO}
+
+    def facturar(self, aparato_id, consulta, cuerpo):
+        return 200, self.servicio.facturar(aparato_id)
+
+    def historial(self, aparato_id, consulta, cuerpo):
+        campos = ('estado_anterior', 'estado_nuevo', 'fecha', 'origen', 'usuario')
+        return 200, [dict(zip(campos, fila)) for fila in self.servicio.historial(aparato_id)]
+
+    def avisos(self, aparato_id, consulta, cuerpo):
+        campos = ('id', 'estado', 'destino', 'mensaje', 'creado', 'proximo_intento', 'intentos', 'enviado', 'error')
+        return 200, [dict(zip(campos, fila)) for fila in self.servicio.avisos(aparato_id)]
+
+    def fotos(self, aparato_id, consulta, cuerpo):
+        # Solo los datos: los archivos se cargan y se ven desde la aplicación
+        campos = ('id', 'hash', 'nombre', 'tamano', 'etapa', 'fecha')
+        return 200, [dict(zip(campos, fila)) for fila in self.servicio.fotos(aparato_id)]
+
+    def quitar_foto(self, adjunto_id, consulta, cuerpo):
+        self.servicio.quitar_foto(adjunto_id)
+        return 200, {'id': int(adjunto_id)}
+
+    def estimar_precio(self, consulta, cuerpo):
+        # ?tipo=&marca=&modelo=; sin datos suficientes responde null
+        return 200, estimacion_de(self.servicio.estimar_precio(consulta.get('tipo', ''), consulta.get('marca', ''),
+                                                               consulta.get('modelo', '')))
+
+    def precio_aparato(self, aparato_id, consulta, cuerpo):
+        return 200, estimacion_de(self.servicio.estimar_precio_aparato(aparato_id))
+
+    def tablero(self, consulta, cuerpo):
+        datos = self.servicio.tablero(consulta.get('periodo', 'dia'),
+                                      leer_entero(consulta, 'dias_atraso', DIAS_ATRASO))
+        return 200, {
+            'por_estado': [{'estado': e, 'en_cola': n, 'segundos_promedio': p} for e, n, p in datos['por_estado']],
+            'ingresos': [{'periodo': p, 'diagnosticos': n, 'total': t} for p, n, t in datos['ingresos']],
+            'top_marcas': [{'marca': m, 'cantidad': n} for m, n in datos['top_marcas']],
+            'top_tipos': [{'tipo': t, 'cantidad': n} for t, n in datos['top_tipos']],
+            'atrasados': [{'id': i, 'tipo': t, 'marca': m, 'estado': e, 'ingreso': f}
+                          for i, t, m, e, f in datos['atrasados']],
+        }
+
+    def estadisticas_estados(self, consulta, cuerpo):
+        campos = ('estado', 'en_cola', 'salidas', 'segundos_promedio')
+        return 200, [dict(zip(campos, fila)) for fila in self.servicio.estadisticas_estados()]
+
+
+class ServidorAPI:
+    def __init__(self, db_path=None, host='127.0.0.1', port=8765, enviar_avisos=False):
+        self.db_path = db_path
+        self.host = host
+        self.port = port
+        # Con enviar_avisos también vacía la bandeja de avisos (avisos.py);
+        # si la aplicación hace lo mismo, cada aviso igual sale una sola vez
+        self.enviar_avisos = enviar_avisos
+        self.cola_avisos = None
+        # Un solo hilo para SQLite: las escrituras quedan serializadas y el
+        # bucle de asyncio sigue atendiendo conexiones mientras tanto
+        self.ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='api-db')
+        self.rutas = None
+        self.servidor = None
+
+    def abrir_base(self):
+        db = DatabaseManager(self.db_path)
+        self.rutas = Rutas(ServicioReparaciones(db))
+        if self.enviar_avisos and db.db_path != ':memory:':
+            self.cola_avisos = ColaAvisos(db.db_path)
+            db.oyentes.append(self.cola_avisos.despertar)
+            self.cola_avisos.iniciar()
+
+    def cerrar_base(self):
+        if self.cola_avisos is not None:
+            self.cola_avisos.cerrar()
+        self.rutas.servicio.db.close()
+
+    async def iniciar(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.ejecutor, self.abrir_base)
+        self.servidor = await asyncio.start_server(self.conexion, self.host, self.port)
+        self.port = self.servidor.sockets[0].getsockname()[1]
+        return self.servidor
+
+    async def detener(self):
+        self.servidor.close()
+        await self.servidor.wait_closed()
+        await asyncio.get_running_loop().run_in_executor(self.ejecutor, self.cerrar_base)
+        self.ejecutor.shutdown()
+
+    async def conexion(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    pedido = await asyncio.wait_for(self.leer_pedido(reader), ESPERA_INACTIVA)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if pedido is None:
+                    break
+                metodo, ruta, version, encabezados, cuerpo = pedido
+                if isinstance(cuerpo, ErrorHTTP):
+                    estado, respuesta = cuerpo.estado, {'error': str(cuerpo)}
+                else:
+                    estado, respuesta = await loop.run_in_executor(
+                        self.ejecutor, self.rutas.atender, metodo, ruta, cuerpo)
+                conexion = encabezados.get('connection', '').lower()
+                seguir = conexion != 'close' and (version == 'HTTP/1.1' or conexion == 'keep-alive')
+                self.escribir_respuesta(writer, estado, respuesta, seguir)
+                await writer.drain()
+                if not seguir:
+                    break
+        finally:
+            writer.close()
+
+    async def leer_pedido(self, reader):
+        linea = await reader.readline()
+        if not linea:
+            return None
+        try:
+            metodo, ruta, version = linea.decode('latin-1').split()
+        except ValueError:
+            return 'GET', '', 'HTTP/1.0', {}, ErrorHTTP(400, "Línea de pedido inválida")
+        encabezados = {}
+        while True:
+            linea = await reader.readline()
+            if linea in (b'\r\n', b'\n', b''):
+                break
+            nombre, _, valor = linea.decode('latin-1').partition(':')
+            encabezados[nombre.strip().lower()] = valor.strip()
+        # Sin un largo válido no se sabe dónde termina el cuerpo: se cierra
+        largo = encabezados.get('content-length') or '0'
+        if not (largo.isascii() and largo.isdigit()):
+            return metodo.upper(), ruta, version, {'connection': 'close'}, ErrorHTTP(400, "Content-Length inválido")
+        largo = int(largo)
+        if largo > MAX_CUERPO:
+            return metodo.upper(), ruta, version, {'connection': 'close'}, ErrorHTTP(413, "Cuerpo demasiado grande")
+        cuerpo = None
+        if largo:
+            datos = await reader.readexactly(largo)
+            try:
+                cuerpo = json.loads(datos)
+            except ValueError:
+                cuerpo = ErrorHTTP(400, "El cuerpo no es JSON válido")
+        return metodo.upper(), ruta, version, encabezados, cuerpo
+
+    def escribir_respuesta(self, writer, estado, respuesta, seguir):
+        cuerpo = json.dumps(respuesta, ensure_ascii=False).encode('utf-8')
+        encabezado = (
+            f"HTTP/1.1 {estado} {RAZONES.get(estado, '')}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(cuerpo)}\r\n"
+            f"Connection: {'keep-alive' if seguir else 'close'}\r\n\r\n"
+        )
+        writer.write(encabezado.encode('latin-1') + cuerpo)
+
+
+async def servir(db_path, host, port, enviar_avisos=True):
+    servidor_api = ServidorAPI(db_path, host, port, enviar_avisos)
+    servidor = await servidor_api.iniciar()
+    print(f"API escuchando en http://{servidor_api.host}:{servidor_api.port}", flush=True)
+    try:
+        async with servidor:
+            await servidor.serve_forever()
+    finally:
+        await servidor_api.detener()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='API HTTP local del taller de reparaciones')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--db', default=None, help='Ruta de la base (por defecto REPARACIONES_DB o reparaciones.db)')
+    parser.add_argument('--sin-avisos', action='store_true', help='No enviar los avisos a los clientes desde la API')
+    args = parser.parse_args()
+    try:
+        asyncio.run(servir(args.db, args.host, args.port, not args.sin_avisos))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
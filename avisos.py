@@ -0,0 +1,166 @@
+import json
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from database import DatabaseManager, ESPERA_REINTENTO_AVISO, REINTENTOS_AVISOS
+
+# Avisos a los clientes ("su aparato está listo"). update_estado deja cada
+# aviso en la tabla avisos en la misma transacción que el cambio de estado
+# (bandeja de salida): si el cambio se confirmó, el aviso existe, aunque la
+# aplicación se cierre antes de enviarlo. ColaAvisos los vacía en segundo
+# plano: un hilo con su propia conexión reserva lotes, varios hilos los
+# entregan por el transporte y los resultados se anotan juntos; lo que falla
+# se reintenta con espera creciente.
+#
+# Un transporte es cualquier objeto con enviar(avisos) que recibe una lista
+# de Aviso y devuelve los pares (id, error) de los que no salieron; si lanza
+# una excepción, falló todo el lote.
+
+DIRECTORIO_AVISOS_POR_DEFECTO = 'avisos'
+LOTE_AVISOS = 50
+HILOS_AVISOS = 4
+REVISION_AVISOS = 30.0     # segundos entre revisiones si nadie despierta la cola
+
+
+class TransporteArchivo:
+    # Cada lote queda en un archivo JSON por líneas en el directorio, como
+    # los documentos en el spool: lo levanta la pasarela de mensajes del
+    # taller (o sirve de registro de lo enviado)
+    def __init__(self, directorio=None):
+        if directorio is None:
+            directorio = os.environ.get('REPARACIONES_AVISOS', DIRECTORIO_AVISOS_POR_DEFECTO)
+        self.directorio = directorio
+
+    def enviar(self, avisos):
+        os.makedirs(self.directorio, exist_ok=True)
+        # El id del primer aviso hace único el nombre: un lote reintentado
+        # no pisa al anterior
+        ruta = os.path.join(self.directorio, '%s_%d_%d.jsonl' % (time.strftime('%Y%m%d-%H%M%S'), avisos[0].id,
+                                                                 avisos[0].intentos))
+        temporal = ruta + '.tmp'
+        with open(temporal, 'w', encoding='utf-8') as archivo:
+            for aviso in avisos:
+                archivo.write(json.dumps({'id': aviso.id, 'aparato_id': aviso.aparato_id, 'destino': aviso.destino,
+                                          'mensaje': aviso.mensaje}, ensure_ascii=False) + '\n')
+        os.replace(temporal, ruta)
+        return []
+
+
+class TransporteSimulado:
+    # Pasarela de mentira para pruebas y benchmarks: tarda demora_lote más
+    # demora_mensaje por aviso, rechaza la fracción fallos al azar y guarda
+    # lo entregado en enviados
+    def __init__(self, demora_lote=0.0, demora_mensaje=0.0, fallos=0.0, semilla=None):
+        self.demora_lote = demora_lote
+        self.demora_mensaje = demora_mensaje
+        self.fallos = fallos
+        self.azar = random.Random(semilla)
+        self.cerrojo = threading.Lock()
+        self.enviados = []
+        self.lotes = 0
+
+    def enviar(self, avisos):
+        time.sleep(self.demora_lote + self.demora_mensaje * len(avisos))
+        with self.cerrojo:
+            fallidos = [(aviso.id, 'rechazado por la pasarela') for aviso in avisos if self.azar.random() < self.fallos]
+            rechazados = {aviso_id for aviso_id, _ in fallidos}
+            self.enviados.extend(aviso for aviso in avisos if aviso.id not in rechazados)
+            self.lotes += 1
+        return fallidos
+
+
+class ColaAvisos:
+    # despertar() (se puede agregar a DatabaseManager.oyentes) hace que
+    # revise enseguida; si no, revisa cada `revision` segundos o cuando vence
+    # un reintento. al_terminar(enviados, fallidos) se llama desde el hilo de
+    # la cola después de anotar cada tanda.
+    def __init__(self, db_path, transporte=None, hilos=HILOS_AVISOS, lote=LOTE_AVISOS, revision=REVISION_AVISOS,
+                 espera=ESPERA_REINTENTO_AVISO, reintentos=REINTENTOS_AVISOS, al_terminar=None):
+        self.db_path = db_path
+        self.transporte = transporte or TransporteArchivo()
+        self.hilos = hilos
+        self.lote = lote
+        self.revision = revision
+        self.espera = espera
+        self.reintentos = reintentos
+        self.al_terminar = al_terminar
+        self.envios = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='avisos-envio')
+        self.resultados = queue.Queue()
+        self.despertador = threading.Event()
+        self.en_vuelo = 0          # lotes en los hilos de envío
+        self.detenida = False
+        self.hilo = threading.Thread(target=self.trabajar, name='avisos', daemon=True)
+
+    def iniciar(self):
+        self.hilo.start()
+
+    def despertar(self, *args):
+        self.despertador.set()
+
+    def trabajar(self):
+        db = DatabaseManager(self.db_path)
+        try:
+            while not self.detenida:
+                try:
+                    self.repartir(db)
+                except sqlite3.Error as e:
+                    # Lo reservado que no se anotó vuelve solo al vencer la reserva
+                    print(f"Avisos: {e}")
+                    self.despertador.wait(self.revision)
+            # Al cerrar no se reservan más, pero lo que está en envío se anota
+            while self.en_vuelo:
+                self.anotar(db)
+        finally:
+            db.close()
+
+    def repartir(self, db):
+        # Un lote por hilo libre; después, esperar a que vuelva alguno o a
+        # que haya algo para enviar
+        while self.en_vuelo < self.hilos:
+            avisos = db.tomar_avisos(self.lote, reintentos=self.reintentos)
+            if not avisos:
+                break
+            self.envios.submit(self.enviar, avisos)
+            self.en_vuelo += 1
+        if self.en_vuelo:
+            self.anotar(db)
+            return
+        proximo = db.get_proximo_aviso()
+        self.despertador.wait(self.revision if proximo is None else min(self.revision, max(proximo - time.time(), 0)))
+        self.despertador.clear()
+
+    def enviar(self, avisos):
+        # En un hilo de envío; el resultado vuelve al hilo de la cola
+        try:
+            fallidos = dict(self.transporte.enviar(avisos) or ())
+        except Exception as e:
+            fallidos = {aviso.id: f"{type(e).__name__}: {e}" for aviso in avisos}
+        self.resultados.put(([aviso.id for aviso in avisos if aviso.id not in fallidos], list(fallidos.items())))
+
+    def anotar(self, db):
+        # Espera al menos un lote y anota todos los que ya volvieron en una
+        # transacción
+        tandas = [self.resultados.get()]
+        try:
+            while True:
+                tandas.append(self.resultados.get_nowait())
+        except queue.Empty:
+            pass
+        self.en_vuelo -= len(tandas)
+        enviados = [aviso_id for tanda in tandas for aviso_id in tanda[0]]
+        fallidos = [par for tanda in tandas for par in tanda[1]]
+        db.registrar_envios(enviados, fallidos, espera=self.espera, reintentos=self.reintentos)
+        if self.al_terminar:
+            self.al_terminar(enviados, fallidos)
+
+    def cerrar(self):
+        self.detenida = True
+        self.despertador.set()
+        if self.hilo.is_alive():
+            self.hilo.join()
+        self.envios.shutdown()
@@ -0,0 +1,137 @@
+# Fotos de los aparatos (adjuntos.py): guarda fotos sintéticas dos veces
+# cada una y comprueba que el directorio tiene una sola copia, mide cuánto
+# tarda el hilo de miniaturas por foto y cuánto cuesta pedir una que ya está
+# en disco. Después simula desplazarse varias veces por la tira de un
+# aparato con muchas fotos, decodificando lo que se ve como hace la interfaz
+# (miniaturas) y, para comparar, las fotos originales: muestra el tiempo de
+# decodificar cada una y la memoria residente del proceso, que con las
+# miniaturas debe quedar plana.
+#
+# Uso: python benchmarks/bench_adjuntos.py [--fotos 36] [--ancho 2000] [--alto 1500] [--vueltas 5]
+import argparse
+import os
+import statistics
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+os.environ.setdefault('KIVY_NO_CONSOLELOG', '1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from adjuntos import ColaMiniaturas, DirectorioAdjuntos, ImagenPIL, LADO_MINIATURA, decodificar
+
+VISIBLES = 8   # fotos de la tira en pantalla a la vez
+
+
+def memoria_mb():
+    # Memoria residente (Linux); en otros sistemas no se informa
+    try:
+        with open('/proc/self/statm') as archivo:
+            return int(archivo.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        return 0.0
+
+
+def png(ancho, alto, pixeles):
+    # PNG RGB de 8 bits con las filas de arriba abajo; sin otra librería
+    largo_fila = ancho * 3
+    crudo = b''.join(b'\x00' + pixeles[y * largo_fila:(y + 1) * largo_fila] for y in range(alto))
+
+    def bloque(tipo, datos):
+        return struct.pack('>I', len(datos)) + tipo + datos + struct.pack('>I', zlib.crc32(tipo + datos))
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + bloque(b'IHDR', struct.pack('>IIBBBBB', ancho, alto, 8, 2, 0, 0, 0))
+            + bloque(b'IDAT', zlib.compress(crudo, 6))
+            + bloque(b'IEND', b''))
+
+
+def esperar(cola):
+    # Sin Pillow la GPU reduce en el hilo de Kivy (este): hace falta la
+    # ventana, y atender el reloj mientras el hilo de miniaturas trabaja
+    if ImagenPIL is not None:
+        cola.esperar()
+        return
+    from kivy.clock import Clock
+    from kivy.core.window import Window  # crea el contexto de OpenGL
+    while cola.pendientes:
+        Clock.tick()
+
+
+def foto(ruta, ancho, alto, semilla):
+    # Franjas de colores distintas en cada foto (el hash cambia)
+    fila = bytes((x * 3 + semilla * 37 + canal * 85) % 256 for x in range(ancho) for canal in range(3))
+    with open(ruta, 'wb') as archivo:
+        archivo.write(png(ancho, alto, fila * alto))
+
+
+def desplazar(rutas, vueltas):
+    # Cada vuelta decodifica todas las fotos en orden y conserva solo las
+    # visibles, como las vistas recicladas de la RecycleView
+    tiempos, memoria, visibles = [], [memoria_mb()], []
+    for _ in range(vueltas):
+        for ruta in rutas:
+            inicio = time.perf_counter()
+            visibles.append(decodificar(ruta))
+            tiempos.append(time.perf_counter() - inicio)
+            del visibles[:-VISIBLES]
+        memoria.append(memoria_mb())
+    return tiempos, memoria
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de las fotos de los aparatos')
+    parser.add_argument('--fotos', type=int, default=36)
+    parser.add_argument('--ancho', type=int, default=2000)
+    parser.add_argument('--alto', type=int, default=1500)
+    parser.add_argument('--vueltas', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        originales = []
+        for i in range(args.fotos):
+            ruta = os.path.join(directorio, 'foto%03d.png' % i)
+            foto(ruta, args.ancho, args.alto, i)
+            originales.append(ruta)
+        tamano = sum(os.path.getsize(ruta) for ruta in originales)
+        print('%d fotos de %dx%d, %.1f MB' % (args.fotos, args.ancho, args.alto, tamano / 2 ** 20))
+
+        # Cada foto se carga dos veces: la segunda no ocupa lugar
+        adjuntos = DirectorioAdjuntos(os.path.join(directorio, 'adjuntos'))
+        inicio = time.perf_counter()
+        hashes = [adjuntos.guardar(ruta)[0] for ruta in originales + originales]
+        guardar = (time.perf_counter() - inicio) / len(hashes)
+        en_disco = sum(os.path.getsize(adjuntos.ruta(h)) for h in set(hashes))
+        print('guardar: %.1f ms por foto; %d cargadas, %d archivos, %.1f MB en el directorio' % (
+            guardar * 1000, len(hashes), len(set(hashes)), en_disco / 2 ** 20))
+
+        cola = ColaMiniaturas(adjuntos)
+        hashes = list(dict.fromkeys(hashes))
+        inicio = time.perf_counter()
+        for hash_archivo in hashes:
+            cola.pedir(hash_archivo, LADO_MINIATURA)
+        esperar(cola)
+        generar = (time.perf_counter() - inicio) / len(hashes)
+        inicio = time.perf_counter()
+        miniaturas = [cola.pedir(hash_archivo, LADO_MINIATURA) for hash_archivo in hashes]
+        pedir = (time.perf_counter() - inicio) / len(hashes)
+        cola.cerrar()
+        print('miniaturas (%s): %.1f ms por foto; pedir una ya generada: %.1f µs' % (
+            'Pillow' if ImagenPIL is not None else 'GPU', generar * 1000, pedir * 1e6))
+
+        print()
+        print('%-14s %14s %14s %12s %12s %12s' % ('decodificando', 'mediana ms', 'máximo ms', 'MB inicial',
+                                                   'MB final', 'MB máximo'))
+        for nombre, rutas in (('miniaturas', miniaturas), ('originales', originales)):
+            tiempos, memoria = desplazar(rutas, args.vueltas)
+            print('%-14s %14.2f %14.2f %12.1f %12.1f %12.1f' % (
+                nombre, statistics.median(tiempos) * 1000, max(tiempos) * 1000, memoria[0], memoria[-1], max(memoria)))
+        print('(memoria residente al terminar cada vuelta; se conservan %d fotos decodificadas)' % VISIBLES)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+# Bandeja de avisos a los clientes (avisos.py): cuánto agrega encolar el
+# aviso al cambio de estado y cuántos avisos por segundo vacía ColaAvisos
+# con distinta cantidad de hilos y tamaño de lote, contra una pasarela
+# simulada que tarda por lote y por mensaje y rechaza algunos al azar (se
+# reintentan). Al final corta la cola a mitad de camino y la vuelve a
+# iniciar, como al cerrar y abrir la aplicación: cada aviso debe llegar una
+# sola vez.
+#
+# Uso: python benchmarks/bench_avisos.py [--avisos 5000] [--demora-lote 0.01] [--demora-mensaje 0.0002]
+#                                        [--fallos 0.02] [--configuraciones 4x1 4x10 4x50 1x50 8x50]
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from avisos import ColaAvisos, TransporteSimulado
+from database import DatabaseManager
+
+ESPERA_REINTENTO = 0.01   # segundos: los reintentos no deben dominar la medición
+
+
+def pendientes(db):
+    return db.conn.execute('SELECT COUNT(*) FROM avisos WHERE proximo_intento IS NOT NULL').fetchone()[0]
+
+
+def reiniciar(db):
+    # Todos los avisos de nuevo sin enviar
+    with db.transaction():
+        db.cursor.execute('UPDATE avisos SET proximo_intento = creado, intentos = 0, enviado = NULL, error = NULL')
+
+
+def vaciar(db, cola, limite=None):
+    # Corre la cola hasta que no queda nada pendiente (o hasta limite segundos)
+    inicio = time.perf_counter()
+    cola.iniciar()
+    while pendientes(db) and (limite is None or time.perf_counter() - inicio < limite):
+        time.sleep(0.005)
+    cola.cerrar()
+    return time.perf_counter() - inicio
+
+
+def resumen(db, transporte):
+    enviados, fallidos, intentos = db.conn.execute('''
+        SELECT COUNT(enviado), COUNT(*) - COUNT(enviado), SUM(intentos) FROM avisos
+    ''').fetchone()
+    ids = [aviso.id for aviso in transporte.enviados]
+    return enviados, fallidos, intentos, len(ids) - len(set(ids))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de la bandeja de avisos a los clientes')
+    parser.add_argument('--avisos', type=int, default=5000)
+    parser.add_argument('--demora-lote', type=float, default=0.01, help='Segundos por lote en la pasarela')
+    parser.add_argument('--demora-mensaje', type=float, default=0.0002, help='Segundos por aviso en la pasarela')
+    parser.add_argument('--fallos', type=float, default=0.02, help='Fracción de avisos rechazados')
+    parser.add_argument('--configuraciones', nargs='+', default=['4x1', '4x10', '4x50', '1x50', '8x50'],
+                        help='HILOSxLOTE')
+    parser.add_argument('--semilla', type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        db_path = os.path.join(directorio, 'avisos.db')
+        db = DatabaseManager(db_path)
+        db.insert_aparatos_many([('Celular', 'Samsung', 'SAM-%d' % i, 'SN%d' % i, 'Pantalla', 'Revisado',
+                                  'Cliente %d' % i, '300%07d' % i) for i in range(args.avisos)])
+        ids = [fila[0] for fila in db.conn.execute('SELECT id FROM aparatos ORDER BY id')]
+
+        # Costo de escribir el aviso con el cambio de estado: a un estado sin
+        # aviso y a Listo, de a uno como en el mostrador
+        muestra = ids[:min(len(ids), 2000)]
+        tiempos = {}
+        for estado in ('En reparación', 'Listo'):
+            inicio = time.perf_counter()
+            for aparato_id in muestra:
+                db.update_estado(aparato_id, estado)
+            tiempos[estado] = (time.perf_counter() - inicio) / len(muestra)
+        db.update_estado_many([(aparato_id, 'Listo') for aparato_id in ids[len(muestra):]])
+        total = db.conn.execute('SELECT COUNT(*) FROM avisos').fetchone()[0]
+        print('update_estado: %.3f ms sin aviso, %.3f ms con aviso (%d avisos encolados)' % (
+            tiempos['En reparación'] * 1000, tiempos['Listo'] * 1000, total))
+        print('pasarela simulada: %.1f ms por lote + %.2f ms por aviso, %.0f %% rechazados' % (
+            args.demora_lote * 1000, args.demora_mensaje * 1000, args.fallos * 100))
+        print()
+        print('%-8s %6s %10s %12s %10s %10s %10s %10s' % ('hilos', 'lote', 'segundos', 'avisos/s', 'lotes',
+                                                       'intentos', 'fallidos', 'repetidos'))
+        correcto = True
+        for configuracion in args.configuraciones:
+            hilos, lote = (int(parte) for parte in configuracion.split('x'))
+            reiniciar(db)
+            transporte = TransporteSimulado(args.demora_lote, args.demora_mensaje, args.fallos, args.semilla)
+            segundos = vaciar(db, ColaAvisos(db_path, transporte, hilos=hilos, lote=lote, espera=ESPERA_REINTENTO))
+            enviados, fallidos, intentos, repetidos = resumen(db, transporte)
+            correcto = correcto and enviados + fallidos == total and not repetidos
+            print('%-8d %6d %10.2f %12.0f %10d %10d %10d %10d' % (hilos, lote, segundos, total / segundos,
+                                                                  transporte.lotes, intentos, fallidos, repetidos))
+
+        # Cortar a mitad de camino y seguir con otra cola
+        hilos, lote = (int(parte) for parte in args.configuraciones[-1].split('x'))
+        reiniciar(db)
+        transporte = TransporteSimulado(args.demora_lote, args.demora_mensaje, args.fallos, args.semilla)
+        antes = vaciar(db, ColaAvisos(db_path, transporte, hilos=hilos, lote=lote, espera=ESPERA_REINTENTO),
+                       limite=0.1)
+        quedaban = pendientes(db)
+        despues = vaciar(db, ColaAvisos(db_path, transporte, hilos=hilos, lote=lote, espera=ESPERA_REINTENTO))
+        enviados, fallidos, intentos, repetidos = resumen(db, transporte)
+        correcto = correcto and enviados + fallidos == total and not repetidos
+        print()
+        print('Cortada a los %.2f s con %d pendientes; la segunda cola terminó en %.2f s: %d enviados, '
+              '%d fallidos, %d repetidos' % (antes, quedaban, despues, enviados, fallidos, repetidos))
+        print('Cada aviso salió una sola vez: %s' % ('sí' if correcto else 'NO'))
+        db.close()
+    return 0 if correcto else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+# Compara la búsqueda original (recorrer todos los aparatos en Python)
+# contra la búsqueda indexada con FTS5 de DatabaseManager.search_aparatos.
+#
+# Uso: python benchmarks/bench_busqueda.py [--tamanos 10000 100000 1000000]
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from database import DatabaseManager
+
+TIPOS = ['Televisor', 'Celular', 'Laptop', 'Tablet', 'Consola', 'Microondas', 'Licuadora', 'Radio']
+MARCAS = ['Samsung', 'LG', 'Sony', 'Apple', 'Huawei', 'Xiaomi', 'Philips', 'Panasonic', 'Lenovo', 'HP']
+NOMBRES = ['Ana', 'Luis', 'María', 'José', 'Carlos', 'Lucía', 'Pedro', 'Sofía', 'Jorge', 'Elena']
+BUSQUEDAS = ['sony', 'lapt', 'maría', '5551', 'SN00042']
+
+
+def poblar(db, n, lote=50000):
+    rnd = random.Random(42)
+    for inicio in range(0, n, lote):
+        filas = []
+        for i in range(inicio, min(inicio + lote, n)):
+            filas.append((rnd.choice(TIPOS), rnd.choice(MARCAS), 'M-%d' % rnd.randint(1, 500),
+                          'SN%07d' % i, 'No enciende', 'Recibido', rnd.choice(NOMBRES),
+                          '555%07d' % rnd.randint(0, 9999999)))
+        db.cursor.executemany('''
+            INSERT INTO aparatos (tipo, marca, modelo, numero_serie, problema, estado, nombre_cliente, telefono_cliente)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', filas)
+        db.conn.commit()
+
+
+def busqueda_original(db, busqueda):
+    busqueda = busqueda.lower()
+    resultado = []
+    for aparato in db.get_all_aparatos():
+        if busqueda in str(aparato[0]).lower() or busqueda in aparato[1].lower() or busqueda in aparato[2].lower():
+            resultado.append(aparato)
+    return resultado
+
+
+def medir(funcion, repeticiones=3):
+    mejor = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        duracion = time.perf_counter() - inicio
+        mejor = duracion if mejor is None else min(mejor, duracion)
+    return mejor
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de búsqueda de aparatos')
+    parser.add_argument('--tamanos', type=int, nargs='+', default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+
+    print('%10s  %-10s  %12s  %12s  %8s' % ('filas', 'busqueda', 'scan (ms)', 'fts5 (ms)', 'x'))
+    for n in args.tamanos:
+        with tempfile.TemporaryDirectory() as directorio:
+            db = DatabaseManager(os.path.join(directorio, 'bench.db'))
+            poblar(db, n)
+            for busqueda in BUSQUEDAS:
+                scan = medir(lambda: busqueda_original(db, busqueda))
+                fts = medir(lambda: db.search_aparatos(busqueda, limit=100))
+                print('%10d  %-10s  %12.2f  %12.2f  %8.1f' % (n, busqueda, scan * 1000, fts * 1000, scan / fts))
+            db.close()
+
+
+if __name__ == '__main__':
+    main()
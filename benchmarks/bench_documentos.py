@@ -0,0 +1,68 @@
+# Documentos generados por segundo con ColaImpresion y tiempo que el hilo
+# que imprime (la interfaz) queda bloqueado en cada pedido, comparado con
+# generar el PDF directamente en ese hilo.
+#
+# Uso: python benchmarks/bench_documentos.py [--documentos 2000]
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from documentos import ColaImpresion, renderizar
+
+APARATO = {'id': 123, 'tipo': 'Televisor', 'marca': 'Samsung', 'modelo': 'UN55', 'problema': 'No enciende',
+           'nombre_cliente': 'María Pérez', 'telefono_cliente': '5551234567'}
+FACTURA = {'id': 123, 'cliente': 'María Pérez', 'telefono': '5551234567', 'aparato': 'Televisor Samsung UN55',
+           'diagnostico': 'Fuente de poder',
+           'lineas': [{'tipo': 'repuesto', 'descripcion': 'Fuente 12V', 'cantidad': 1, 'precio': 90.0, 'importe': 90.0},
+                      {'tipo': 'mano_obra', 'descripcion': 'Cambio de fuente', 'cantidad': 1, 'precio': 60.0,
+                       'importe': 60.0}],
+           'repuestos': 90.0, 'mano_obra': 60.0, 'impuestos': 0.0, 'descuentos': 0.0, 'valor': 150.0}
+
+
+def pedidos(n):
+    tipos = [('orden', APARATO), ('etiqueta', APARATO), ('factura', FACTURA)]
+    return [tipos[i % len(tipos)] for i in range(n)]
+
+
+def milisegundos(valores):
+    ordenados = sorted(valores)
+    return (statistics.mean(ordenados) * 1000, ordenados[int(len(ordenados) * 0.99)] * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de la cola de documentos')
+    parser.add_argument('--documentos', type=int, default=2000)
+    args = parser.parse_args()
+    lista = pedidos(args.documentos)
+
+    # Generación en el mismo hilo (como hacía la interfaz)
+    bloqueos = []
+    for tipo, datos in lista:
+        inicio = time.perf_counter()
+        renderizar(tipo, datos)
+        bloqueos.append(time.perf_counter() - inicio)
+    print('sincrónico:  bloqueo medio %.3f ms  p99 %.3f ms' % milisegundos(bloqueos))
+
+    with tempfile.TemporaryDirectory() as directorio:
+        cola = ColaImpresion(directorio)
+        bloqueos = []
+        inicio_total = time.perf_counter()
+        for tipo, datos in lista:
+            inicio = time.perf_counter()
+            cola.encolar(tipo, datos)
+            bloqueos.append(time.perf_counter() - inicio)
+        cola.esperar()
+        duracion = time.perf_counter() - inicio_total
+        cola.cerrar()
+        print('cola:        bloqueo medio %.3f ms  p99 %.3f ms' % milisegundos(bloqueos))
+        print('cola:        %d documentos en %.2f s = %.0f documentos/s' % (
+            args.documentos, duracion, args.documentos / duracion))
+
+
+if __name__ == '__main__':
+    main()
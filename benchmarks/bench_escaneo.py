@@ -0,0 +1,61 @@
+# Latencia de abrir un aparato a partir de lo que entrega el lector de
+# códigos: etiqueta (AP000123), ID o número de serie, con la caché de
+# detalles fría y caliente.
+#
+# Uso: python benchmarks/bench_escaneo.py [--filas 100000] [--lecturas 2000]
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from database import DatabaseManager
+from documentos import codigo_etiqueta
+from servicio import ServicioReparaciones
+from bench_busqueda import poblar
+
+
+def medir(servicio, codigos, limpiar_cache):
+    tiempos = []
+    for codigo in codigos:
+        if limpiar_cache:
+            servicio.db.invalidar_detalle()
+        inicio = time.perf_counter()
+        servicio.resolver_codigo(codigo)
+        tiempos.append(time.perf_counter() - inicio)
+    tiempos.sort()
+    return statistics.mean(tiempos) * 1000, tiempos[int(len(tiempos) * 0.99)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de lectura de etiquetas')
+    parser.add_argument('--filas', type=int, default=100000)
+    parser.add_argument('--lecturas', type=int, default=2000)
+    args = parser.parse_args()
+
+    rnd = random.Random(7)
+    ids = [rnd.randint(1, args.filas) for _ in range(args.lecturas)]
+    casos = [
+        ('etiqueta', [codigo_etiqueta(i) for i in ids]),
+        ('id', [str(i) for i in ids]),
+        # poblar() asigna el número de serie SN%07d según el orden de inserción
+        ('numero_serie', ['SN%07d' % (i - 1) for i in ids]),
+    ]
+    with tempfile.TemporaryDirectory() as directorio:
+        db = DatabaseManager(os.path.join(directorio, 'escaneo.db'))
+        poblar(db, args.filas)
+        servicio = ServicioReparaciones(db)
+        print('%d aparatos, %d lecturas por caso' % (args.filas, args.lecturas))
+        for nombre, codigos in casos:
+            for estado, limpiar in (('fría', True), ('caliente', False)):
+                media, p99 = medir(servicio, codigos, limpiar)
+                print('%-13s caché %-8s media %7.3f ms  p99 %7.3f ms' % (nombre, estado, media, p99))
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# Mide el arranque de la aplicación hasta el primer cuadro, por fases.
+# Lanza main.py varias veces contra una base temporal con REPARACIONES_DB y
+# REPARACIONES_SALIR_TRAS_INICIO, y resume la traza que imprime GestionApp.
+#
+# Uso: python benchmarks/bench_inicio.py [--filas 100000] [--repeticiones 5]
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, RAIZ)
+
+from database import DatabaseManager
+from bench_busqueda import poblar
+
+LINEA_TRAZA = re.compile(r'^Inicio (.+?)\s+([\d.]+) ms$')
+
+
+def arrancar(db_path):
+    entorno = dict(os.environ, REPARACIONES_DB=db_path, REPARACIONES_SALIR_TRAS_INICIO='1',
+                   KIVY_NO_CONSOLELOG='1', KIVY_NO_ARGS='1')
+    salida = subprocess.run([sys.executable, 'main.py'], cwd=RAIZ, env=entorno,
+                            capture_output=True, text=True, check=True).stdout
+    fases = {}
+    for linea in salida.splitlines():
+        coincidencia = LINEA_TRAZA.match(linea.strip())
+        if coincidencia:
+            fases[coincidencia.group(1)] = float(coincidencia.group(2))
+    return fases
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark del tiempo de arranque')
+    parser.add_argument('--filas', type=int, default=100000)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        db_path = os.path.join(directorio, 'inicio.db')
+        db = DatabaseManager(db_path)
+        poblar(db, args.filas)
+        db.close()
+
+        mediciones = [arrancar(db_path) for _ in range(args.repeticiones)]
+
+    print('%d aparatos, mediana de %d arranques' % (args.filas, args.repeticiones))
+    for fase in mediciones[0]:
+        valores = [m[fase] for m in mediciones if fase in m]
+        print('%-26s %8.1f ms' % (fase, statistics.median(valores)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# Costo de la instrumentación (instrumentacion.py): cada operación de la
+# suite sobre la misma base con las conexiones sin envolver, con
+# ConexionMedida y además con el trace callback, y el resumen que quedaría
+# al cerrar la aplicación.
+#
+# Uso: python benchmarks/bench_instrumentacion.py [--aparatos 20000] [--repeticiones 30]
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import instrumentacion
+from database import DatabaseManager
+from suite import base_de_escala, medir, operaciones_db
+
+# La variable de entorno no debe activar la instrumentación en la corrida "sin"
+os.environ.pop('REPARACIONES_INSTRUMENTAR', None)
+
+
+def correr(db_path, aparatos, repeticiones, semilla, medida):
+    db = DatabaseManager(db_path, instrumentacion=medida)
+    resultados = {nombre: medir(funcion, repeticiones)['mediana_ms']
+                  for nombre, funcion in operaciones_db(db, aparatos, random.Random(semilla))}
+    db.close()
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Costo de medir cada sentencia SQL')
+    parser.add_argument('--aparatos', type=int, default=20000)
+    parser.add_argument('--repeticiones', type=int, default=30)
+    parser.add_argument('--semilla', type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        variantes = [
+            ('sin', None),
+            ('medida', instrumentacion.Instrumentacion(archivo_log=os.path.join(directorio, 'lento.log'))),
+            ('con traza', instrumentacion.Instrumentacion(contar_sentencias=True)),
+        ]
+        cache = None
+        tiempos = []
+        for nombre, medida in variantes:
+            # Cada variante sobre una copia nueva de la misma base
+            db_path = base_de_escala(args.aparatos, args.semilla, directorio, cache)
+            cache = directorio
+            tiempos.append(correr(db_path, args.aparatos, args.repeticiones, args.semilla, medida))
+
+        print('%-30s' % 'operación' + ''.join('%12s %8s' % (nombre + ' ms', '') for nombre, _ in variantes))
+        sin = tiempos[0]
+        for operacion in list(sin) + ['total']:
+            fila = '%-30s' % operacion
+            for resultado in tiempos:
+                valor = sum(resultado.values()) if operacion == 'total' else resultado[operacion]
+                base = sum(sin.values()) if operacion == 'total' else sin[operacion]
+                fila += '%12.3f %+7.1f%%' % (valor, (valor / base - 1) * 100 if base else 0)
+            print(fila)
+        for nombre, medida in variantes[1:]:
+            print()
+            print('Resumen %s:' % nombre)
+            print(medida.resumen(5))
+
+
+if __name__ == '__main__':
+    main()
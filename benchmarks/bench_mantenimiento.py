@@ -0,0 +1,103 @@
+# Efecto del mantenimiento (mantenimiento.py) sobre una base sintética de
+# varios años: latencia de las consultas de todos los días y tamaño del
+# archivo antes y después de archivar los entregados, compactar y
+# actualizar las estadísticas, lo que tarda cada tarea (y el respaldo) y si
+# el tablero y las estadísticas de estados siguen dando lo mismo.
+#
+# Uso: python benchmarks/bench_mantenimiento.py [--aparatos 200000] [--anos 3] [--repeticiones 50]
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from database import DatabaseManager
+from servicio import ServicioReparaciones
+from generar_datos import generar
+from mantenimiento import Mantenimiento
+from suite import medir
+
+
+def tamano(db_path):
+    return sum(os.path.getsize(db_path + sufijo) for sufijo in ('', '-wal') if os.path.exists(db_path + sufijo))
+
+
+def operaciones(db, servicio, rnd):
+    maximo = db.conn.execute('SELECT MAX(id) FROM aparatos').fetchone()[0]
+
+    def detalle():
+        db.invalidar_detalle()
+        return db.get_aparato_detalle(rnd.randint(1, maximo))
+
+    def tablero():
+        db.invalidar_tablero()
+        return servicio.tablero()
+
+    return [
+        ('lista del menú (1.ª página)', lambda: db.get_aparatos_page(0, 200)),
+        ('lista del menú (al azar)', lambda: db.get_aparatos_page(rnd.randint(0, maximo), 200)),
+        ('búsqueda "samsung"', lambda: db.search_aparatos('samsung')),
+        ('número de serie', lambda: db.get_aparato_id_por_serie('SN%08d' % rnd.randint(1, maximo))),
+        ('detalle', detalle),
+        ('tablero', tablero),
+    ]
+
+
+def correr(db_path, repeticiones, semilla):
+    db = DatabaseManager(db_path)
+    servicio = ServicioReparaciones(db)
+    resultados = {nombre: medir(funcion, repeticiones)['mediana_ms']
+                  for nombre, funcion in operaciones(db, servicio, random.Random(semilla))}
+    db.invalidar_tablero()
+    tablero = servicio.tablero()
+    filas = db.conn.execute('SELECT COUNT(*) FROM aparatos').fetchone()[0]
+    db.close()
+    return resultados, tablero, filas
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latencia y tamaño antes y después del mantenimiento')
+    parser.add_argument('--aparatos', type=int, default=200000)
+    parser.add_argument('--anos', type=int, default=3)
+    parser.add_argument('--repeticiones', type=int, default=50)
+    parser.add_argument('--semilla', type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        db_path = os.path.join(directorio, 'mantenimiento.db')
+        db = DatabaseManager(db_path)
+        generar(db, args.aparatos, anos=args.anos, semilla=args.semilla)
+        db.close()
+
+        antes, tablero_antes, filas_antes = correr(db_path, args.repeticiones, args.semilla)
+        bytes_antes = tamano(db_path)
+
+        mantenimiento = Mantenimiento(db_path, os.path.join(directorio, 'respaldos'))
+        for tarea in ('archivar', 'compactar', 'optimizar', 'respaldar'):
+            resultado = mantenimiento.ejecutar(tarea)
+            print('%-10s %8.1f ms  %s' % (tarea, resultado.pop('segundos') * 1000, resultado))
+        mantenimiento.conn.close()
+
+        despues, tablero_despues, filas_despues = correr(db_path, args.repeticiones, args.semilla)
+        bytes_despues = tamano(db_path)
+
+        print()
+        print('%-30s %12s %12s %8s' % ('operación', 'antes ms', 'después ms', ''))
+        for operacion in antes:
+            print('%-30s %12.3f %12.3f %+7.1f%%' % (operacion, antes[operacion], despues[operacion],
+                                                   (despues[operacion] / antes[operacion] - 1) * 100))
+        print('%-30s %12d %12d' % ('aparatos en la base', filas_antes, filas_despues))
+        print('%-30s %12.1f %12.1f' % ('tamaño MB', bytes_antes / 1e6, bytes_despues / 1e6))
+        print('%-30s %25.1f' % ('archivo MB', tamano(mantenimiento.archivo) / 1e6))
+
+        # Archivar no cambia los ingresos ni lo que está en curso
+        iguales = all(tablero_antes[clave] == tablero_despues[clave]
+                      for clave in ('ingresos', 'top_marcas', 'top_tipos', 'atrasados'))
+        print('Tablero igual antes y después: %s' % ('sí' if iguales else 'NO'))
+        return 0 if iguales else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
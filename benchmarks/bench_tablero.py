@@ -0,0 +1,68 @@
+# Mide el tablero (TableroScreen / ServicioReparaciones.tablero) sobre una
+# base sintética de varios años: cada consulta en frío, el tablero completo
+# en frío, desde la caché y después de una escritura que la invalida.
+#
+# Uso: python benchmarks/bench_tablero.py [--aparatos 1000000] [--anos 3] [--db RUTA]
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from database import DatabaseManager
+from servicio import ESTADOS_TERMINADOS, ServicioReparaciones
+from generar_datos import FLUJO, generar
+
+ESTADOS_EN_CURSO = [estado for estado in FLUJO if estado not in ESTADOS_TERMINADOS]
+
+
+def medir(funcion):
+    inicio = time.perf_counter()
+    resultado = funcion()
+    return (time.perf_counter() - inicio) * 1000, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tiempos del tablero sobre una base sintética')
+    parser.add_argument('--aparatos', type=int, default=1000000)
+    parser.add_argument('--anos', type=int, default=3)
+    parser.add_argument('--db', default=None, help='Usar esta base en vez de generar una temporal')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        db_path = args.db
+        if db_path is None:
+            db_path = os.path.join(directorio, 'tablero.db')
+            db = DatabaseManager(db_path)
+            segundos, _ = medir(lambda: generar(db, args.aparatos, args.anos))
+            print('Base sintética: %d aparatos en %d años (%.1f s)' % (args.aparatos, args.anos, segundos / 1000))
+            db.close()
+        db = DatabaseManager(db_path)
+        servicio = ServicioReparaciones(db)
+
+        consultas = [
+            ('aparatos por estado', db.get_aparatos_por_estado),
+            ('ingresos por día', lambda: db.get_ingresos_por_periodo('dia')),
+            ('ingresos por semana', lambda: db.get_ingresos_por_periodo('semana')),
+            ('ingresos por mes', lambda: db.get_ingresos_por_periodo('mes')),
+            ('marcas más frecuentes', db.get_top_marcas),
+            ('tipos más frecuentes', db.get_top_tipos),
+            ('reparaciones atrasadas', lambda: db.get_aparatos_atrasados(ESTADOS_EN_CURSO, time.time() - 7 * 86400)),
+        ]
+        for nombre, funcion in consultas:
+            db.invalidar_tablero()
+            milisegundos, filas = medir(funcion)
+            print('  %-24s %8.2f ms  (%d filas)' % (nombre, milisegundos, len(filas)))
+
+        db.invalidar_tablero()
+        print('Tablero completo en frío   %8.2f ms' % medir(servicio.tablero)[0])
+        print('Tablero desde la caché     %8.3f ms' % medir(servicio.tablero)[0])
+        servicio.cambiar_estado(args.aparatos or 1, 'Revisado')
+        print('Después de una escritura   %8.2f ms' % medir(servicio.tablero)[0])
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
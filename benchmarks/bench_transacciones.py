@@ -0,0 +1,69 @@
+# Filas por segundo insertando/actualizando aparatos con un commit por
+# fila frente a una sola transacción y a los métodos *_many.
+#
+# Uso: python benchmarks/bench_transacciones.py [--filas 2000]
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from database import DatabaseManager
+
+
+def fila(i):
+    return ('Laptop', 'Lenovo', 'T480', 'SN%07d' % i, 'No carga', 'Recibido', 'Empresa SA', '5550000')
+
+
+def commit_por_fila(db, n):
+    for i in range(n):
+        db.insert_aparato(*fila(i))
+
+
+def una_transaccion(db, n):
+    with db.transaction():
+        for i in range(n):
+            db.insert_aparato(*fila(i))
+
+
+def insert_many(db, n):
+    db.insert_aparatos_many(fila(i) for i in range(n))
+
+
+def estado_por_fila(db, n):
+    for aparato_id in range(1, n + 1):
+        db.update_estado(aparato_id, 'Aprobado')
+
+
+def estado_many(db, n):
+    db.update_estado_many((aparato_id, 'Aprobado') for aparato_id in range(1, n + 1))
+
+
+def medir(nombre, funcion, n, preparar=None):
+    with tempfile.TemporaryDirectory() as directorio:
+        db = DatabaseManager(os.path.join(directorio, 'bench.db'))
+        if preparar:
+            preparar(db, n)
+        inicio = time.perf_counter()
+        funcion(db, n)
+        duracion = time.perf_counter() - inicio
+        db.close()
+    print('%-28s %10d filas %10.3f s %12.0f filas/s' % (nombre, n, duracion, n / duracion))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de commits por fila contra commits en lote')
+    parser.add_argument('--filas', type=int, default=2000)
+    args = parser.parse_args()
+
+    medir('insert_aparato (commit c/u)', commit_por_fila, args.filas)
+    medir('insert_aparato en transaction', una_transaccion, args.filas)
+    medir('insert_aparatos_many', insert_many, args.filas)
+    medir('update_estado (commit c/u)', estado_por_fila, args.filas, preparar=insert_many)
+    medir('update_estado_many', estado_many, args.filas, preparar=insert_many)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# Prueba de carga local de api.py: levanta el servidor contra una base
+# temporal y lanza varios clientes concurrentes con conexiones keep-alive.
+# Reporta pedidos por segundo y latencias p50/p99 para consultas y cambios
+# de estado.
+#
+# Uso: python benchmarks/carga_api.py [--aparatos 10000] [--clientes 8] [--pedidos 500]
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, RAIZ)
+
+from database import DatabaseManager
+from bench_busqueda import poblar
+
+ESTADOS = ['Revisado', 'Aprobado', 'En reparación', 'Listo']
+
+
+class Cliente:
+    # Cliente HTTP mínimo que reutiliza una sola conexión
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def conectar(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def pedir(self, metodo, ruta, cuerpo=None):
+        datos = json.dumps(cuerpo).encode('utf-8') if cuerpo is not None else b''
+        self.writer.write((f"{metodo} {ruta} HTTP/1.1\r\nHost: {self.host}\r\n"
+                           f"Content-Length: {len(datos)}\r\n\r\n").encode('latin-1') + datos)
+        await self.writer.drain()
+        estado = int((await self.reader.readline()).split()[1])
+        largo = 0
+        while True:
+            linea = await self.reader.readline()
+            if linea in (b'\r\n', b''):
+                break
+            nombre, _, valor = linea.decode('latin-1').partition(':')
+            if nombre.lower() == 'content-length':
+                largo = int(valor)
+        return estado, json.loads(await self.reader.readexactly(largo))
+
+    async def cerrar(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def trabajar(host, port, pedidos, aparatos, latencias, semilla):
+    rnd = random.Random(semilla)
+    cliente = Cliente(host, port)
+    await cliente.conectar()
+    for _ in range(pedidos):
+        aparato_id = rnd.randint(1, aparatos)
+        if rnd.random() < 0.8:
+            tipo, metodo, ruta, cuerpo = 'consulta', 'GET', f'/aparatos/{aparato_id}', None
+        else:
+            tipo, metodo, ruta, cuerpo = 'estado', 'POST', f'/aparatos/{aparato_id}/estado', {'estado': rnd.choice(ESTADOS)}
+        inicio = time.perf_counter()
+        estado, _ = await cliente.pedir(metodo, ruta, cuerpo)
+        latencias.setdefault(tipo, []).append(time.perf_counter() - inicio)
+        if estado >= 400:
+            latencias.setdefault('errores', []).append(estado)
+    await cliente.cerrar()
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+async def cargar(host, port, args):
+    latencias = {}
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabajar(host, port, args.pedidos, args.aparatos, latencias, i)
+                           for i in range(args.clientes)))
+    duracion = time.perf_counter() - inicio
+    total = args.clientes * args.pedidos
+    print('%d clientes x %d pedidos: %.0f pedidos/s' % (args.clientes, args.pedidos, total / duracion))
+    for tipo in ('consulta', 'estado'):
+        valores = latencias.get(tipo, [])
+        if valores:
+            print('  %-9s %6d pedidos  p50 %6.2f ms  p99 %6.2f ms' % (
+                tipo, len(valores), percentil(valores, 0.5) * 1000, percentil(valores, 0.99) * 1000))
+    if latencias.get('errores'):
+        print('  errores: %d' % len(latencias['errores']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga de la API local')
+    parser.add_argument('--aparatos', type=int, default=10000)
+    parser.add_argument('--clientes', type=int, default=8)
+    parser.add_argument('--pedidos', type=int, default=500, help='pedidos por cliente')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        db_path = os.path.join(directorio, 'carga.db')
+        db = DatabaseManager(db_path)
+        poblar(db, args.aparatos)
+        db.close()
+
+        servidor = subprocess.Popen([sys.executable, 'api.py', '--db', db_path, '--port', '0', '--sin-avisos'],
+                                    cwd=RAIZ, stdout=subprocess.PIPE, text=True)
+        try:
+            linea = servidor.stdout.readline()
+            host, port = linea.strip().rsplit('//', 1)[1].split(':')
+            asyncio.run(cargar(host, int(port), args))
+        finally:
+            servidor.terminate()
+            servidor.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+# Evalúa la sugerencia de precios (DatabaseManager.estimar_precio) sobre una
+# base sintética: aparta el último 10 % de los diagnósticos como prueba
+# (los borra, así los triggers descuentan su aporte) y estima cada uno con lo
+# anterior. Muestra el error de la mediana contra la mediana global de todos
+# los precios, cuántos valores reales caen entre p25 y p75 (debería rondar
+# la mitad), qué nivel se usó, si el diagnóstico más frecuente acierta y
+# cuánto se apartan los cuartiles del histograma de los exactos. Antes
+# comprueba que lo mantenido por los triggers es igual a rebuild_precios.
+# Al final compara el tiempo de estimar_precio con calcular lo mismo leyendo
+# el historial.
+#
+# Uso: python benchmarks/evaluar_precios.py [--aparatos 100000] [--prueba 0.1] [--repeticiones 200]
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from database import DatabaseManager, MINIMO_PRECIOS, TODOS
+from generar_datos import generar
+from suite import medir
+
+TABLAS_PRECIOS = ('precios_modelos', 'precios_cubetas', 'diagnosticos_modelos')
+
+
+def contenido(db):
+    # Renglones con cantidad distinta de cero, con las sumas redondeadas
+    return {tabla: {tuple(round(v, 4) if isinstance(v, float) else v for v in fila)
+                    for fila in db.conn.execute('SELECT * FROM %s WHERE cantidad != 0' % tabla)}
+            for tabla in TABLAS_PRECIOS}
+
+
+def cuantil(valores, fraccion):
+    # valores ordenados; interpolación lineal como statistics.quantiles
+    posicion = fraccion * (len(valores) - 1)
+    i = int(posicion)
+    return valores[i] + (valores[min(i + 1, len(valores) - 1)] - valores[i]) * (posicion - i)
+
+
+def historial(db):
+    # (tipo, marca, modelo) normalizados de cada diagnóstico con valor
+    return db.conn.execute('''
+        SELECT UPPER(TRIM(a.tipo)), UPPER(TRIM(a.marca)), UPPER(TRIM(a.modelo)), d.valor
+        FROM diagnosticos d JOIN aparatos a ON a.id = d.aparato_id WHERE d.valor > 0
+    ''').fetchall()
+
+
+def estimar_leyendo(db, tipo, marca, modelo):
+    # Lo mismo que estimar_precio pero recorriendo los diagnósticos
+    tipo, marca, modelo = (texto.strip().upper() for texto in (tipo, marca, modelo))
+    for condicion, parametros in (('AND UPPER(TRIM(a.marca)) = ? AND UPPER(TRIM(a.modelo)) = ?', (marca, modelo)),
+                                  ('AND UPPER(TRIM(a.marca)) = ?', (marca,)), ('', ())):
+        valores = sorted(fila[0] for fila in db.conn.execute(
+            'SELECT d.valor FROM diagnosticos d JOIN aparatos a ON a.id = d.aparato_id '
+            'WHERE d.valor > 0 AND UPPER(TRIM(a.tipo)) = ? ' + condicion, (tipo,) + parametros))
+        if len(valores) >= MINIMO_PRECIOS:
+            return [cuantil(valores, f) for f in (0.25, 0.5, 0.75)]
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evalúa la sugerencia de precios sobre una base sintética')
+    parser.add_argument('--aparatos', type=int, default=100000)
+    parser.add_argument('--prueba', type=float, default=0.1, help='Fracción de diagnósticos a estimar')
+    parser.add_argument('--repeticiones', type=int, default=200)
+    parser.add_argument('--semilla', type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        db = DatabaseManager(os.path.join(directorio, 'precios.db'))
+        generar(db, args.aparatos, semilla=args.semilla)
+        db.commit()
+
+        # Los diagnósticos más nuevos son la prueba: se estiman con lo anterior
+        total = db.conn.execute('SELECT COUNT(*) FROM diagnosticos').fetchone()[0]
+        corte = db.conn.execute('SELECT id FROM diagnosticos ORDER BY id DESC LIMIT 1 OFFSET ?',
+                                (int(total * args.prueba),)).fetchone()[0]
+        prueba = db.conn.execute('''
+            SELECT a.tipo, a.marca, a.modelo, TRIM(d.diagnostico), d.valor
+            FROM diagnosticos d JOIN aparatos a ON a.id = d.aparato_id
+            WHERE d.id > ? AND d.valor > 0
+        ''', (corte,)).fetchall()
+        with db.transaction():
+            db.cursor.execute('DELETE FROM diagnosticos WHERE id > ?', (corte,))
+
+        incrementales = contenido(db)
+        db.rebuild_precios()
+        iguales = incrementales == contenido(db)
+        print('%d diagnósticos de entrenamiento, %d de prueba' % (total - len(prueba), len(prueba)))
+        print('Triggers y rebuild_precios coinciden: %s' % ('sí' if iguales else 'NO'))
+
+        anteriores = historial(db)
+        mediana_global = statistics.median(fila[3] for fila in anteriores)
+        # Valores exactos de cada renglón, para comparar los cuartiles del histograma
+        exactos = {}
+        for tipo, marca, modelo, valor in anteriores:
+            for clave in ((tipo, TODOS, TODOS), (tipo, marca, TODOS), (tipo, marca, modelo)):
+                exactos.setdefault(clave, []).append(valor)
+
+        errores, errores_base, relativos, relativos_base = [], [], [], []
+        dentro, aciertos, sin_estimar, error_cuartiles = 0, 0, 0, []
+        niveles = {'modelo': 0, 'marca': 0, 'tipo': 0}
+        for tipo, marca, modelo, diagnostico, valor in prueba:
+            estimacion = db.estimar_precio(tipo, marca, modelo)
+            if estimacion is None:
+                sin_estimar += 1
+                continue
+            niveles[estimacion.nivel] += 1
+            errores.append(abs(estimacion.mediana - valor))
+            errores_base.append(abs(mediana_global - valor))
+            relativos.append(abs(estimacion.mediana - valor) / valor)
+            relativos_base.append(abs(mediana_global - valor) / valor)
+            dentro += estimacion.p25 <= valor <= estimacion.p75
+            aciertos += bool(estimacion.diagnosticos) and estimacion.diagnosticos[0][0] == diagnostico
+            clave = (tipo.strip().upper(),
+                     marca.strip().upper() if estimacion.nivel != 'tipo' else TODOS,
+                     modelo.strip().upper() if estimacion.nivel == 'modelo' else TODOS)
+            valores = sorted(exactos[clave])
+            for aproximado, fraccion in zip((estimacion.p25, estimacion.mediana, estimacion.p75), (0.25, 0.5, 0.75)):
+                exacto = cuantil(valores, fraccion)
+                error_cuartiles.append(abs(aproximado - exacto) / exacto)
+
+        estimados = len(errores)
+        print()
+        print('%-34s %12s %12s' % ('', 'sugerencia', 'mediana global'))
+        print('%-34s %12.2f %12.2f' % ('error absoluto medio', statistics.fmean(errores), statistics.fmean(errores_base)))
+        print('%-34s %11.1f%% %11.1f%%' % ('error relativo medio', statistics.fmean(relativos) * 100,
+                                           statistics.fmean(relativos_base) * 100))
+        print()
+        print('Valor real entre p25 y p75:        %5.1f %%' % (dentro / estimados * 100))
+        print('Diagnóstico más frecuente acierta: %5.1f %%' % (aciertos / estimados * 100))
+        print('Cuartiles del histograma vs exactos: error medio %.2f %%, máximo %.2f %%' % (
+            statistics.fmean(error_cuartiles) * 100, max(error_cuartiles) * 100))
+        print('Nivel usado: ' + ', '.join('%s %.1f %%' % (nivel, cantidad / estimados * 100)
+                                          for nivel, cantidad in niveles.items())
+              + ', sin estimación %d' % sin_estimar)
+
+        # Tiempos: con las estadísticas precalculadas contra leer el historial
+        rnd = random.Random(args.semilla)
+        consultas = [fila[:3] for fila in rnd.sample(prueba, min(len(prueba), 1000))]
+        print()
+        print('%-22s %12s %12s' % ('', 'mediana ms', 'p95 ms'))
+        for nombre, funcion in (('estimar_precio', lambda: db.estimar_precio(*rnd.choice(consultas))),
+                                ('leyendo el historial', lambda: estimar_leyendo(db, *rnd.choice(consultas)))):
+            r = medir(funcion, args.repeticiones)
+            print('%-22s %12.4f %12.4f' % (nombre, r['mediana_ms'], r['p95_ms']))
+        db.close()
+    return 0 if iguales else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+# Generador reproducible de datos sintéticos: aparatos con distribuciones
+# realistas de tipo y marca, su historial de estados, diagnósticos fechados y
+# líneas de diagnóstico, repartidos a lo largo de varios años. La misma
+# semilla y escala producen siempre la misma base.
+#
+# Uso: python benchmarks/generar_datos.py [--aparatos 100000] [--anos 3] [--semilla 42] salida.db
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from database import DatabaseManager
+
+# tipo: (peso, marcas de la más a la menos frecuente, problemas habituales)
+TIPOS = {
+    'Celular': (30, ['Samsung', 'Apple', 'Xiaomi', 'Motorola', 'Huawei', 'Oppo'],
+                ['Pantalla rota', 'No carga', 'Batería dura poco', 'Se mojó']),
+    'Televisor': (16, ['Samsung', 'LG', 'Sony', 'TCL', 'Hisense', 'Philips'],
+                  ['No enciende', 'Sin imagen', 'Líneas en pantalla', 'Sin sonido']),
+    'Laptop': (15, ['Lenovo', 'HP', 'Dell', 'Asus', 'Apple', 'Acer'],
+               ['No enciende', 'Teclado dañado', 'Se calienta', 'Bisagra rota']),
+    'Tablet': (8, ['Samsung', 'Apple', 'Lenovo', 'Huawei'], ['Pantalla rota', 'No carga']),
+    'Consola': (7, ['Sony', 'Microsoft', 'Nintendo'], ['No lee discos', 'Se apaga', 'Control no conecta']),
+    'Impresora': (6, ['Epson', 'HP', 'Canon', 'Brother'], ['Atasca papel', 'No imprime']),
+    'Microondas': (5, ['LG', 'Samsung', 'Whirlpool', 'Panasonic'], ['No calienta', 'Plato no gira']),
+    'Equipo de sonido': (5, ['Sony', 'LG', 'Panasonic', 'JBL'], ['Sin sonido', 'No lee USB']),
+    'Licuadora': (4, ['Oster', 'Black+Decker', 'Philips'], ['Motor quemado', 'Cuchilla floja']),
+    'Video juego portatil': (4, ['Nintendo', 'Sony'], ['Prende conectado, pero no carga', 'Botones pegados']),
+}
+NOMBRES = ['Ana', 'Luis', 'María', 'José', 'Carlos', 'Lucía', 'Pedro', 'Sofía', 'Jorge', 'Elena',
+           'Andrés', 'Camila', 'Diego', 'Valentina', 'Juan', 'Paula']
+APELLIDOS = ['Gómez', 'Rodríguez', 'Pérez', 'López', 'Martínez', 'García', 'Hernández', 'Díaz', 'Torres']
+FLUJO = ['Recibido', 'Revisado', 'Aprobado', 'En reparación', 'Listo', 'Entregado']
+HORAS_POR_ESTADO = [6, 24, 12, 48, 72]   # media de horas en cada estado antes de pasar al siguiente
+CLIENTES_QUE_VUELVEN = 0.3          # aparatos de alguien que ya trajo otro
+OLVIDADOS = 0.0005                   # aparatos viejos que quedaron a medio camino
+IMPUESTO = 0.19
+# Mano de obra típica por tipo; según el número de modelo cuesta entre la
+# mitad y 2,5 veces eso (los más nuevos, más caros) y el repuesto ronda igual
+PRECIO_TIPO = {
+    'Celular': 40, 'Televisor': 80, 'Laptop': 70, 'Tablet': 45, 'Consola': 55, 'Impresora': 35,
+    'Microondas': 30, 'Equipo de sonido': 40, 'Licuadora': 20, 'Video juego portatil': 35,
+}
+
+
+def ponderado(opciones):
+    # Marcas con pesos decrecientes (Zipf): la primera es la más común
+    return opciones, [1 / (i + 1) for i in range(len(opciones))]
+
+
+def generar(db, aparatos, anos=3, semilla=42, lote=20000, hasta=None):
+    rnd = random.Random(semilla)
+    hasta = time.time() if hasta is None else hasta
+    inicio = hasta - anos * 365 * 86400
+    tipos = list(TIPOS)
+    pesos_tipos = [TIPOS[t][0] for t in tipos]
+    marcas = {t: ponderado(TIPOS[t][1]) for t in tipos}
+    db.cursor.execute('SELECT COALESCE(MAX(id), 0) FROM aparatos')
+    primer_id = db.cursor.fetchone()[0] + 1
+    db.cursor.execute('SELECT COALESCE(MAX(id), 0) FROM diagnosticos')
+    diagnostico_id = db.cursor.fetchone()[0]
+    clientes = []
+    for desde in range(0, aparatos, lote):
+        filas_aparatos, historial, diagnosticos, lineas = [], [], [], []
+        for i in range(desde, min(desde + lote, aparatos)):
+            aparato_id = primer_id + i
+            tipo = rnd.choices(tipos, pesos_tipos)[0]
+            marca = rnd.choices(*marcas[tipo])[0]
+            fecha = inicio + (i + rnd.random()) * (hasta - inicio) / aparatos
+            # Recorre el flujo mientras no se pase de hoy; algunos quedan trabados
+            pasos = [fecha]
+            limite = rnd.randint(0, len(FLUJO) - 2) if rnd.random() < OLVIDADOS else len(FLUJO) - 1
+            for horas in HORAS_POR_ESTADO[:limite]:
+                siguiente = pasos[-1] + rnd.expovariate(1 / (horas * 3600))
+                if siguiente >= hasta:
+                    break
+                pasos.append(siguiente)
+            estado = FLUJO[len(pasos) - 1]
+            if clientes and rnd.random() < CLIENTES_QUE_VUELVEN:
+                # El mismo cliente, a veces con el teléfono escrito con espacios
+                nombre, telefono = rnd.choice(clientes)
+                if rnd.random() < 0.3:
+                    telefono = '%s %s %s' % (telefono[:3], telefono[3:6], telefono[6:])
+            else:
+                nombre = '%s %s' % (rnd.choice(NOMBRES), rnd.choice(APELLIDOS))
+                telefono = '3%09d' % rnd.randint(0, 10 ** 9 - 1)
+                clientes.append((nombre, telefono))
+            numero_modelo = rnd.randint(1, 300)
+            precio_modelo = PRECIO_TIPO[tipo] * (0.5 + numero_modelo / 150)
+            filas_aparatos.append((aparato_id, tipo, marca, '%s-%d' % (marca[:3].upper(), numero_modelo),
+                                   'SN%08d' % aparato_id, rnd.choice(TIPOS[tipo][2]), estado, nombre, telefono))
+            anterior = None
+            for numero, fecha_estado in enumerate(pasos):
+                historial.append((aparato_id, anterior, FLUJO[numero], fecha_estado, 'generador'))
+                anterior = FLUJO[numero]
+            if len(pasos) < 2:
+                continue
+            # Un diagnóstico al revisarlo (a veces dos), con sus líneas
+            for _ in range(2 if rnd.random() < 0.1 else 1):
+                diagnostico_id += 1
+                problema = filas_aparatos[-1][5]
+                diagnosticos.append((diagnostico_id, aparato_id, 'Revisión: %s' % problema.lower(), pasos[1]))
+                mano_obra = max(round(precio_modelo * rnd.uniform(0.7, 1.3) / 5), 1) * 5.0
+                lineas.append((diagnostico_id, aparato_id, 'mano_obra', problema, 1, mano_obra, mano_obra))
+                subtotal = mano_obra
+                if rnd.random() < 0.6:
+                    cantidad, precio = rnd.randint(1, 3), round(precio_modelo * rnd.uniform(0.5, 1.5) / 2) * 2.0
+                    lineas.append((diagnostico_id, aparato_id, 'repuesto', 'Repuesto %s' % marca,
+                                   cantidad, precio, cantidad * precio))
+                    subtotal += cantidad * precio
+                if rnd.random() < 0.3:
+                    impuesto = round(subtotal * IMPUESTO, 2)
+                    lineas.append((diagnostico_id, aparato_id, 'impuesto', 'IVA', 1, impuesto, impuesto))
+                if rnd.random() < 0.05:
+                    lineas.append((diagnostico_id, aparato_id, 'descuento', 'Cliente frecuente', 1, 10.0, -10.0))
+        db.cursor.executemany('''
+            INSERT INTO aparatos (id, tipo, marca, modelo, numero_serie, problema, estado, nombre_cliente, telefono_cliente)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', filas_aparatos)
+        db.cursor.executemany('''
+            INSERT INTO historial_estados (aparato_id, estado_anterior, estado_nuevo, fecha, origen)
+            VALUES (?, ?, ?, ?, ?)
+        ''', historial)
+        # Los triggers completan valor, totales_aparatos e ingresos_diarios
+        db.cursor.executemany('INSERT INTO diagnosticos (id, aparato_id, diagnostico, valor, fecha) VALUES (?, ?, ?, 0, ?)',
+                              diagnosticos)
+        db.cursor.executemany('''
+            INSERT INTO lineas_diagnostico (diagnostico_id, aparato_id, tipo, descripcion, cantidad, precio, importe)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', lineas)
+        db.vincular_clientes(primer_id + desde - 1)
+    db.rebuild_estadisticas_estados()
+    # Esfuerzo por tipo y marca desde el historial, y la cola con los aprobados
+    db.rebuild_esfuerzos()
+    db.encolar_pendientes()
+    db.invalidar_detalle()
+    db.invalidar_tablero()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera una base sintética de reparaciones')
+    parser.add_argument('--aparatos', type=int, default=100000)
+    parser.add_argument('--anos', type=int, default=3)
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('salida', help='Ruta de la base a crear (o completar)')
+    args = parser.parse_args()
+
+    db = DatabaseManager(args.salida)
+    inicio = time.perf_counter()
+    generar(db, args.aparatos, args.anos, args.semilla)
+    db.close()
+    print('%d aparatos generados en %s (%.1f s)' % (args.aparatos, args.salida, time.perf_counter() - inicio))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+# Simulador de la cola de trabajos: repite la misma carga sintética con cada
+# política de POLITICAS_TRABAJOS, sobre una base temporal y con la cola real
+# (encolar_trabajo, tomar_trabajo, terminar_trabajo) pero con reloj simulado.
+# Llegan aparatos aprobados al azar (proceso de Poisson), cada uno con un
+# esfuerzo real según su tipo y marca que la cola no conoce: lo estima con
+# lo que van tardando los terminados. Cada técnico que queda libre toma el
+# siguiente. Por política muestra los trabajos terminados por día, la demora
+# desde la aprobación hasta terminar (promedio, p90 y la de los clientes con
+# prioridad), los atrasados respecto de la fecha prometida y el error de la
+# estimación. Al final mide tomar_trabajo con colas de distinto tamaño.
+#
+# Uso: python benchmarks/simular_taller.py [--tecnicos 4] [--dias 60] [--carga 0.95]
+#                                          [--politicas prioridad fecha ...] [--colas 1000 10000 100000]
+import argparse
+import heapq
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from database import DatabaseManager, ESTADO_EN_COLA, POLITICAS_TRABAJOS
+from generar_datos import TIPOS, ponderado
+from suite import medir
+
+# Horas de trabajo de un técnico por tipo de aparato; las marcas menos
+# comunes tardan más (cada una un 15 % más que la anterior)
+HORAS_TRABAJO = {
+    'Celular': 1.5, 'Televisor': 4.0, 'Laptop': 3.0, 'Tablet': 2.0, 'Consola': 2.5, 'Impresora': 2.0,
+    'Microondas': 2.0, 'Equipo de sonido': 2.5, 'Licuadora': 1.0, 'Video juego portatil': 1.5,
+}
+DISPERSION = 0.5                         # sigma del lognormal del esfuerzo real
+PRIORIDADES = ([0, 1, 2], [85, 12, 3])   # prioridad del cliente y sus pesos
+HORAS_PROMETIDAS = [8, 24, 24, 48, 72]   # plazo prometido al aprobar
+
+
+def esfuerzo_medio(tipo, marca):
+    return HORAS_TRABAJO[tipo] * 3600 * (1 + 0.15 * TIPOS[tipo][1].index(marca))
+
+
+def generar_carga(tecnicos, dias, carga, semilla):
+    # Lista de (llegada, tipo, marca, prioridad, plazo, esfuerzo real), igual
+    # para todas las políticas
+    rnd = random.Random(semilla)
+    tipos = list(TIPOS)
+    pesos = [TIPOS[t][0] for t in tipos]
+    marcas = {t: ponderado(TIPOS[t][1]) for t in tipos}
+    muestra = [(t, rnd.choices(*marcas[t])[0]) for t in rnd.choices(tipos, pesos, k=10000)]
+    media = statistics.fmean(esfuerzo_medio(t, m) for t, m in muestra)
+    # Con carga 1 los técnicos justo alcanzan a atender lo que llega
+    intervalo = media / (tecnicos * carga)
+    trabajos, ahora = [], 0.0
+    while True:
+        ahora += rnd.expovariate(1 / intervalo)
+        if ahora >= dias * 86400:
+            return trabajos
+        tipo = rnd.choices(tipos, pesos)[0]
+        marca = rnd.choices(*marcas[tipo])[0]
+        real = esfuerzo_medio(tipo, marca) * rnd.lognormvariate(-DISPERSION ** 2 / 2, DISPERSION)
+        trabajos.append((ahora, tipo, marca, rnd.choices(*PRIORIDADES)[0],
+                         rnd.choice(HORAS_PROMETIDAS) * 3600, real))
+
+
+def simular(politica, carga, tecnicos, dias, directorio):
+    db = DatabaseManager(os.path.join(directorio, 'taller_%s.db' % politica))
+    db.cambiar_politica_trabajos(politica)
+    # Entran sin aprobar: llegan a la cola en su momento del reloj simulado
+    # (aprobados, insert_aparatos_many ya los encolaría con la hora real)
+    db.insert_aparatos_many([(tipo, marca, '', '', '', 'Revisado', 'Cliente %d' % i, '')
+                             for i, (_, tipo, marca, _, _, _) in enumerate(carga)])
+    primero = 1  # la base es nueva: los ids siguen el orden de la carga
+    reales = {primero + i: trabajo[5] for i, trabajo in enumerate(carga)}
+    ids_tecnicos = [db.get_tecnico_id('Técnico %d' % i) for i in range(tecnicos)]
+    horizonte = dias * 86400
+
+    # Eventos (momento, orden, aparato o None, técnico): llegadas y fines
+    eventos = [(trabajo[0], i, primero + i, None) for i, trabajo in enumerate(carga)]
+    heapq.heapify(eventos)
+    orden = len(eventos)
+    libres = list(ids_tecnicos)
+    tiempos_tomar, en_cola, cola_maxima = [], 0, 0
+    while eventos:
+        ahora, _, aparato_id, tecnico_id = heapq.heappop(eventos)
+        if ahora > horizonte:
+            break
+        if tecnico_id is None:
+            _, _, _, prioridad, plazo, _ = carga[aparato_id - primero]
+            db.encolar_trabajo(aparato_id, ahora + plazo, prioridad, ahora=ahora)
+            en_cola += 1
+            cola_maxima = max(cola_maxima, en_cola)
+        else:
+            db.terminar_trabajo(aparato_id, ahora=ahora)
+            libres.append(tecnico_id)
+        while libres and en_cola:
+            inicio = time.perf_counter()
+            tomado = db.tomar_trabajo(libres[-1], ahora=ahora)
+            tiempos_tomar.append(time.perf_counter() - inicio)
+            en_cola -= 1
+            orden += 1
+            heapq.heappush(eventos, (ahora + reales[tomado], orden, tomado, libres.pop()))
+
+    terminados = db.conn.execute('''
+        SELECT aparato_id, prioridad, terminado - ingreso, terminado > fecha_prometida, esfuerzo
+        FROM trabajos WHERE terminado IS NOT NULL
+    ''').fetchall()
+    pendientes = db.conn.execute('SELECT COUNT(*) FROM trabajos WHERE terminado IS NULL').fetchone()[0]
+    db.close()
+    demoras = sorted(fila[2] for fila in terminados)
+    con_prioridad = [fila[2] for fila in terminados if fila[1] > 0]
+    # La estimación se mide en la segunda mitad, cuando ya aprendió
+    segunda_mitad = [fila for fila in terminados if fila[0] - primero >= len(carga) // 2]
+    return {
+        'terminados_por_dia': len(terminados) / dias,
+        'demora_h': statistics.fmean(demoras) / 3600 if demoras else 0,
+        'p90_h': demoras[int(len(demoras) * 0.9)] / 3600 if demoras else 0,
+        'prioridad_h': statistics.fmean(con_prioridad) / 3600 if con_prioridad else 0,
+        'atrasados': sum(fila[3] for fila in terminados) / len(terminados) if terminados else 0,
+        'pendientes': pendientes,
+        'error_estimacion': statistics.fmean(abs(fila[4] - reales[fila[0]]) / reales[fila[0]]
+                                             for fila in segunda_mitad) if segunda_mitad else 0,
+        'tomar_us': statistics.fmean(tiempos_tomar) * 1e6 if tiempos_tomar else 0,
+        'cola_maxima': cola_maxima,
+    }
+
+
+def medir_cola(tamano, directorio, repeticiones=200):
+    # tomar_trabajo con la cola llena: debe costar lo mismo con mil que con
+    # cien mil pendientes
+    db = DatabaseManager(os.path.join(directorio, 'cola_%d.db' % tamano))
+    rnd = random.Random(tamano)
+    db.insert_aparatos_many([('Celular', 'Samsung', '', '', '', ESTADO_EN_COLA, 'Cliente %d' % rnd.randint(1, 999), '')
+                             for _ in range(tamano + repeticiones + 1)])
+    tecnico_id = db.get_tecnico_id('Técnico')
+    resultado = medir(lambda: db.tomar_trabajo(tecnico_id), repeticiones)
+    db.close()
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simula la cola de trabajos con distintas políticas')
+    parser.add_argument('--tecnicos', type=int, default=4)
+    parser.add_argument('--dias', type=int, default=60)
+    parser.add_argument('--carga', type=float, default=0.95,
+                        help='Trabajo que llega sobre lo que pueden hacer los técnicos (1 = justo)')
+    parser.add_argument('--politicas', nargs='+', default=list(POLITICAS_TRABAJOS), choices=list(POLITICAS_TRABAJOS))
+    parser.add_argument('--colas', type=int, nargs='*', default=[1000, 10000, 100000])
+    parser.add_argument('--semilla', type=int, default=42)
+    args = parser.parse_args()
+
+    carga = generar_carga(args.tecnicos, args.dias, args.carga, args.semilla)
+    print('%d trabajos en %d días, %d técnicos, carga %.2f' % (len(carga), args.dias, args.tecnicos, args.carga))
+    print()
+    print('%-10s %9s %9s %9s %11s %10s %10s %10s %10s %10s' % (
+        'política', 'por día', 'demora h', 'p90 h', 'prioridad h', 'atrasados', 'pendientes', 'error est.',
+        'tomar µs', 'cola máx.'))
+    with tempfile.TemporaryDirectory() as directorio:
+        for politica in args.politicas:
+            r = simular(politica, carga, args.tecnicos, args.dias, directorio)
+            print('%-10s %9.1f %9.1f %9.1f %11.1f %9.1f%% %10d %9.1f%% %10.1f %10d' % (
+                politica, r['terminados_por_dia'], r['demora_h'], r['p90_h'], r['prioridad_h'],
+                r['atrasados'] * 100, r['pendientes'], r['error_estimacion'] * 100, r['tomar_us'], r['cola_maxima']))
+        if args.colas:
+            print()
+            print('%-22s %12s %12s' % ('pendientes en la cola', 'mediana ms', 'p95 ms'))
+            for tamano in args.colas:
+                r = medir_cola(tamano, directorio)
+                print('%-22d %12.4f %12.4f' % (tamano, r['mediana_ms'], r['p95_ms']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,316 @@
+# Suite de benchmarks: mide cada método de DatabaseManager y los refrescos
+# de pantalla (lista del menú, búsqueda, selección de un aparato en las pantallas
+# del flujo) sobre bases generadas con generar_datos.py a varias escalas.
+# Guarda los resultados en JSON y, con --comparar, marca regresiones contra
+# una corrida anterior. Las pantallas necesitan una ventana de Kivy; en un
+# servidor sin pantalla usar xvfb-run o --sin-pantallas.
+#
+# Uso: python benchmarks/suite.py [--escalas 1000 10000 100000] [--repeticiones 30]
+#                                 [--salida RUTA.json] [--comparar ANTERIOR.json] [--sin-pantallas]
+import argparse
+import inspect
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, RAIZ)
+
+from database import DatabaseManager, ETAPAS_ADJUNTO
+from generar_datos import generar
+
+DIRECTORIO_RESULTADOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resultados')
+TOLERANCIA = 1.25  # una mediana 25 % más lenta que la anterior es regresión
+
+# Métodos de DatabaseManager que no son operaciones a medir
+NO_MEDIDOS = set(DatabaseManager.MIGRACIONES) | {
+    'create_tables', 'commit', 'transaction', 'close', 'read_connection',
+    'invalidar_detalle', 'invalidar_tablero', 'consultar_tablero',
+    'registrar_transicion', 'cambiar_estado_fila', 'notificar_cambios',
+    'reordenar_trabajos', 'sumar_esfuerzo',
+}
+BUSQUEDAS = ['samsung', 'cel', 'pantalla rota', 'gómez', 'SN0000', '3']
+BUSQUEDAS_CLIENTES = ['an', 'jose p', 'lucia', '30', '3001']
+
+
+def operaciones_db(db, n, rnd):
+    # (nombre, función) por cada método; las funciones eligen sus argumentos
+    # al azar en cada repetición para no medir solo la caché
+    def al_azar():
+        return rnd.randint(1, n)
+
+    def detalle():
+        db.invalidar_detalle()
+        return db.get_aparato_detalle(al_azar())
+
+    def tablero(funcion):
+        def medir():
+            db.invalidar_tablero()
+            return funcion()
+        return medir
+
+    aparato = ('Celular', 'Samsung', 'SAM-1', 'SN-BENCH', 'Pantalla rota', 'Recibido', 'Ana Gómez', '3001234567')
+    return [
+        ('insert_aparato', lambda: db.insert_aparato(*aparato)),
+        ('insert_aparatos_many', lambda: db.insert_aparatos_many([aparato] * 100)),
+        ('insert_diagnostico', lambda: db.insert_diagnostico(al_azar(), 'Revisión', 50.0,
+                                                             [('repuesto', 'Pantalla', 1, 120.0)])),
+        ('insert_linea', lambda: db.insert_linea(1, 'repuesto', 'Tornillo', 2, 1.5)),
+        ('get_aparato', lambda: db.get_aparato(al_azar())),
+        ('get_aparato_id_por_serie', lambda: db.get_aparato_id_por_serie('SN%08d' % al_azar())),
+        ('get_diagnostico', lambda: db.get_diagnostico(al_azar())),
+        ('get_lineas_aparato', lambda: db.get_lineas_aparato(al_azar())),
+        ('get_aparato_detalle', detalle),
+        ('update_estado', lambda: db.update_estado(al_azar(), rnd.choice(['Revisado', 'Aprobado', 'Listo']))),
+        ('update_estado_many', lambda: db.update_estado_many([(al_azar(), 'Aprobado') for _ in range(100)])),
+        ('update_observaciones', lambda: db.update_observaciones(al_azar(), 'Sin novedad')),
+        ('get_historial_estados', lambda: db.get_historial_estados(al_azar())),
+        ('get_estadisticas_estados', db.get_estadisticas_estados),
+        ('rebuild_estadisticas_estados', db.rebuild_estadisticas_estados),
+        ('get_all_aparatos', db.get_all_aparatos),
+        ('get_aparatos_page', lambda: db.get_aparatos_page(al_azar(), 200)),
+        ('get_aparatos_filas', lambda: db.get_aparatos_filas({al_azar() for _ in range(10)})),
+        ('iter_tabla', lambda: sum(1 for _ in db.iter_tabla('diagnosticos'))),
+        ('search_aparatos', lambda: db.search_aparatos(rnd.choice(BUSQUEDAS))),
+        ('get_aparatos_por_estado', tablero(db.get_aparatos_por_estado)),
+        ('get_ingresos_por_periodo', tablero(lambda: db.get_ingresos_por_periodo(rnd.choice(['dia', 'semana', 'mes'])))),
+        ('get_top_marcas', tablero(db.get_top_marcas)),
+        ('get_top_tipos', tablero(db.get_top_tipos)),
+        ('get_top_conteos', tablero(lambda: db.get_top_conteos('marca', 20))),
+        ('get_aparatos_atrasados', tablero(lambda: db.get_aparatos_atrasados(
+            ['Recibido', 'Revisado', 'Aprobado', 'En reparación'], time.time() - 7 * 86400))),
+        ('get_cliente_id', lambda: db.get_cliente_id('Ana Gómez', '300 123 4567')),
+        ('vincular_clientes', lambda: db.vincular_clientes(n)),
+        ('buscar_clientes', lambda: db.buscar_clientes(rnd.choice(BUSQUEDAS_CLIENTES))),
+        ('get_cliente', lambda: db.get_cliente(al_azar())),
+        ('get_aparatos_cliente', lambda: db.get_aparatos_cliente(al_azar())),
+        ('get_tecnico_id', lambda: db.get_tecnico_id('Técnico %d' % rnd.randint(1, 5))),
+        ('get_politica_trabajos', db.get_politica_trabajos),
+        ('cambiar_politica_trabajos', lambda: db.cambiar_politica_trabajos(rnd.choice(['fecha', 'prioridad']))),
+        ('estimar_esfuerzo', lambda: db.estimar_esfuerzo(*rnd.choice([('Celular', 'Samsung'), ('Licuadora', 'Oster')]))),
+        ('rebuild_esfuerzos', db.rebuild_esfuerzos),
+        ('encolar_trabajo', lambda: db.encolar_trabajo(al_azar())),
+        ('encolar_pendientes', db.encolar_pendientes),
+        ('get_cola_trabajos', db.get_cola_trabajos),
+        ('tomar_trabajo', lambda: db.tomar_trabajo(1)),
+        ('terminar_trabajo', lambda: db.terminar_trabajo(al_azar())),
+        ('get_trabajos_tecnico', lambda: db.get_trabajos_tecnico(1)),
+        ('quitar_trabajo', lambda: db.quitar_trabajo(al_azar())),
+        ('update_prioridad_cliente', lambda: db.update_prioridad_cliente(al_azar(), rnd.randint(0, 2))),
+        ('estimar_precio', lambda: db.estimar_precio(*rnd.choice([('Celular', 'Samsung', 'SAM-%d' % rnd.randint(1, 300)),
+                                                                  ('Licuadora', 'Oster', ''), ('Drone', '', '')]))),
+        ('rebuild_precios', db.rebuild_precios),
+        ('insert_adjunto', lambda: db.insert_adjunto(al_azar(), '%064x' % rnd.getrandbits(256), 'foto.jpg', 250000,
+                                                     rnd.choice(ETAPAS_ADJUNTO))),
+        ('get_adjuntos_aparato', lambda: db.get_adjuntos_aparato(al_azar())),
+        ('delete_adjunto', lambda: db.delete_adjunto(al_azar())),
+        ('insert_aviso', lambda: db.insert_aviso(al_azar(), 'Listo')),
+        ('tomar_avisos', lambda: db.tomar_avisos(50)),
+        ('registrar_envios', lambda: db.registrar_envios([al_azar() for _ in range(45)],
+                                                         [(al_azar(), 'rechazado') for _ in range(5)])),
+        ('get_proximo_aviso', db.get_proximo_aviso),
+        ('get_avisos_aparato', lambda: db.get_avisos_aparato(al_azar())),
+    ]
+
+
+def operaciones_pantallas(db, n, rnd):
+    # Importar Kivy solo si se miden las pantallas: abre una ventana
+    os.environ.setdefault('KIVY_NO_ARGS', '1')
+    os.environ.setdefault('KIVY_NO_CONSOLELOG', '1')
+    from kivy.clock import Clock
+    import main
+    from almacen import AlmacenAparatos
+    from documentos import ColaImpresion
+    from servicio import ServicioReparaciones
+
+    servicio = ServicioReparaciones(db)
+    impresion = ColaImpresion(tempfile.mkdtemp(prefix='suite-spool-'))
+    almacen = AlmacenAparatos(db)
+    menu = main.MenuPrincipalScreen(name='menu', db=db, almacen=almacen)
+
+    # Cuenta las entregas de resultados: si la búsqueda devuelve las mismas
+    # filas, Kivy no cambia tabla_aparatos.data y no sirve para detectarlas
+    entregas = []
+    mostrar_resultados = menu.mostrar_resultados
+
+    def mostrar_y_contar(busqueda, aparatos):
+        mostrar_resultados(busqueda, aparatos)
+        entregas.append(busqueda)
+    menu.mostrar_resultados = mostrar_y_contar
+
+    def buscar_en_menu():
+        # De la tecla al resultado en la tabla: búsqueda en el hilo del
+        # buscador y entrega por el Clock de Kivy (incluye la espera al
+        # próximo cuadro, como en la aplicación)
+        antes = len(entregas)
+        menu.search_input.text = rnd.choice(BUSQUEDAS)
+        menu.search_aparatos(None)
+        limite = time.perf_counter() + 5
+        while len(entregas) == antes and time.perf_counter() < limite:
+            Clock.tick()
+
+    def seleccionar():
+        # Una consulta y las cuatro pantallas del flujo se actualizan
+        db.cache_detalles.clear()
+        almacen.seleccionar(rnd.randint(1, n))
+
+    def escribir():
+        # Escritura sobre filas de la tabla: el aviso relee esas filas y la
+        # tabla reemplaza solo las que cambiaron (la lista quedó cargada
+        # por actualizar_lista_aparatos)
+        db.update_estado_many([(rnd.randint(1, max(menu.ultimo_id, 1)), rnd.choice(['Aprobado', 'Listo']))
+                               for _ in range(10)])
+
+    operaciones = [
+        ('MenuPrincipalScreen.actualizar_lista_aparatos', menu.actualizar_lista_aparatos),
+        ('MenuPrincipalScreen.search_aparatos', buscar_en_menu),
+        ('AlmacenAparatos.seleccionar', seleccionar),
+        ('AlmacenAparatos.recibir_cambios', escribir),
+    ]
+    for clase in (main.DiagnosticoScreen, main.AprobacionScreen, main.ReparacionScreen,
+                  main.EntregaFacturacionScreen):
+        extra = {'impresion': impresion} if clase is main.EntregaFacturacionScreen else {}
+        clase(name=clase.__name__, servicio=servicio, almacen=almacen, **extra)
+
+    def cerrar():
+        menu.buscador.cerrar()
+        impresion.cerrar()
+        shutil.rmtree(impresion.directorio, ignore_errors=True)
+    return operaciones, cerrar
+
+
+def medir(funcion, repeticiones):
+    funcion()  # calentamiento
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    return {
+        'mediana_ms': round(statistics.median(tiempos), 4),
+        'p95_ms': round(tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))], 4),
+        'min_ms': round(tiempos[0], 4),
+        'repeticiones': repeticiones,
+    }
+
+
+def sin_medir(operaciones):
+    metodos = {nombre for nombre, _ in inspect.getmembers(DatabaseManager, inspect.isfunction)
+               if not nombre.startswith('_')}
+    return sorted(metodos - NO_MEDIDOS - {nombre for nombre, _ in operaciones})
+
+
+def base_de_escala(n, semilla, directorio, cache):
+    # Las bases generadas se pueden reutilizar entre corridas con --cache
+    nombre = 'suite_%d_%d.db' % (n, semilla)
+    if cache and os.path.exists(os.path.join(cache, nombre)):
+        origen = os.path.join(cache, nombre)
+    else:
+        origen = os.path.join(cache or directorio, nombre)
+        db = DatabaseManager(origen)
+        generar(db, n, semilla=semilla)
+        db.close()
+    # Se mide sobre una copia: los métodos de escritura modifican la base
+    destino = os.path.join(directorio, 'medicion.db')
+    fuente = sqlite3.connect(origen)
+    copia = sqlite3.connect(destino)
+    fuente.backup(copia)
+    fuente.close()
+    copia.close()
+    return destino
+
+
+def correr_escala(n, args, directorio):
+    inicio = time.perf_counter()
+    db_path = base_de_escala(n, args.semilla, directorio, args.cache)
+    print('Escala %d aparatos (base lista en %.1f s)' % (n, time.perf_counter() - inicio))
+    db = DatabaseManager(db_path)
+    rnd = random.Random(args.semilla)
+    resultados = {}
+    operaciones = operaciones_db(db, n, rnd)
+    faltan = sin_medir(operaciones)
+    if faltan:
+        print('  Aviso: métodos de DatabaseManager sin medir: %s' % ', '.join(faltan))
+    cerrar = None
+    if not args.sin_pantallas:
+        pantallas, cerrar = operaciones_pantallas(db, n, rnd)
+        operaciones += pantallas
+    for nombre, funcion in operaciones:
+        resultados[nombre] = medir(funcion, args.repeticiones)
+        print('  %-48s mediana %9.3f ms  p95 %9.3f ms' % (
+            nombre, resultados[nombre]['mediana_ms'], resultados[nombre]['p95_ms']))
+    if cerrar:
+        cerrar()
+    db.close()
+    os.remove(db_path)
+    return resultados
+
+
+def comparar(actual, anterior, tolerancia):
+    regresiones = []
+    for escala, resultados in actual['escalas'].items():
+        previos = anterior.get('escalas', {}).get(escala, {})
+        for nombre, medicion in resultados.items():
+            previo = previos.get(nombre)
+            # Por debajo de 0.05 ms el ruido pesa más que el cambio
+            if previo and medicion['mediana_ms'] > max(previo['mediana_ms'] * tolerancia, 0.05):
+                regresiones.append((escala, nombre, previo['mediana_ms'], medicion['mediana_ms']))
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks de DatabaseManager y de las pantallas')
+    parser.add_argument('--escalas', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeticiones', type=int, default=30)
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--salida', default=None, help='JSON de resultados (por defecto en benchmarks/resultados/)')
+    parser.add_argument('--comparar', default=None, help='JSON de una corrida anterior')
+    parser.add_argument('--tolerancia', type=float, default=TOLERANCIA)
+    parser.add_argument('--cache', default=None, help='Directorio donde guardar y reutilizar las bases generadas')
+    parser.add_argument('--sin-pantallas', action='store_true', help='Medir solo la base, sin abrir Kivy')
+    args = parser.parse_args()
+
+    resultado = {
+        'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'plataforma': platform.platform(),
+        'semilla': args.semilla,
+        'escalas': {},
+    }
+    if args.cache:
+        os.makedirs(args.cache, exist_ok=True)
+    directorio = tempfile.mkdtemp(prefix='suite-')
+    try:
+        for n in args.escalas:
+            resultado['escalas'][str(n)] = correr_escala(n, args, directorio)
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    salida = args.salida or os.path.join(DIRECTORIO_RESULTADOS, 'suite_%s.json' % time.strftime('%Y%m%d_%H%M%S'))
+    os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+    with open(salida, 'w', encoding='utf-8') as archivo:
+        json.dump(resultado, archivo, ensure_ascii=False, indent=2)
+    print('Resultados en %s' % salida)
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as archivo:
+            regresiones = comparar(resultado, json.load(archivo), args.tolerancia)
+        for escala, nombre, antes, ahora in regresiones:
+            print('REGRESIÓN escala %s %s: %.3f ms -> %.3f ms' % (escala, nombre, antes, ahora))
+        if regresiones:
+            return 1
+        print('Sin regresiones respecto de %s' % args.comparar)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
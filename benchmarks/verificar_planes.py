@@ -0,0 +1,205 @@
+# Verifica con EXPLAIN QUERY PLAN que ninguna consulta de DatabaseManager
+# recorra una tabla completa. Ejecuta cada método sobre una base temporal,
+# captura las sentencias con el trace callback de sqlite3 y analiza su plan.
+# Termina con código 1 si alguna consulta hace SCAN de una tabla, si algún
+# método público no se verifica ni está en PERMITIDOS o SIN_CONSULTAS, o si
+# sobra alguna excepción de PERMITIDOS, SIN_CONSULTAS o ACOTADOS.
+#
+# Uso: python benchmarks/verificar_planes.py
+import inspect
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from database import DatabaseManager
+
+# Métodos que recorren una tabla a propósito; no se ejecutan
+PERMITIDOS = {
+    # estadisticas_estados tiene una fila por estado
+    'get_estadisticas_estados', 'get_aparatos_por_estado',
+    # Leen la tabla entera por definición: el volcado de la pantalla de
+    # estadísticas y la exportación por lotes
+    'get_all_aparatos', 'iter_tabla',
+    # Recalculan tablas derivadas desde cero (cargas masivas, reparaciones)
+    'rebuild_totales', 'rebuild_estadisticas_estados', 'rebuild_esfuerzos', 'rebuild_precios',
+}
+# Métodos que no hacen consultas propias: conexiones, transacciones, cachés
+# y migraciones. consultar_tablero ejecuta la consulta que le pasan; se
+# verifica con los métodos del tablero que la llaman.
+SIN_CONSULTAS = set(DatabaseManager.MIGRACIONES) | {
+    'create_tables', 'commit', 'transaction', 'close', 'read_connection',
+    'invalidar_detalle', 'invalidar_tablero', 'notificar_cambios', 'revisar_version_datos',
+    'consultar_tablero',
+}
+# Recorridos que no leen una tabla completa, con el método que los hace y
+# el comienzo del detalle del plan. Una excepción que ya no aparece también
+# es una falla: la lista no debe crecer sin control.
+ACOTADOS = {
+    # FTS5 busca con MATCH en su propio índice
+    ('search_aparatos', 'SCAN aparatos_fts VIRTUAL TABLE INDEX '),
+    # Índice parcial de la cola de trabajos en orden con LIMIT: leen solo
+    # las primeras entradas
+    ('get_cola_trabajos', 'SCAN t USING INDEX idx_trabajos_cola'),
+    ('tomar_trabajo', 'SCAN trabajos USING INDEX idx_trabajos_cola'),
+    # Cambiar la política recalcula la clave de los pendientes: recorre
+    # solo el índice parcial de la cola, no los trabajos terminados
+    ('cambiar_politica_trabajos', 'SCAN trabajos USING INDEX idx_trabajos_cola'),
+    ('reordenar_trabajos', 'SCAN trabajos USING INDEX idx_trabajos_cola'),
+    # Subconsulta materializada con los aparatos nuevos, que ya salieron de
+    # una búsqueda por rowid
+    ('insert_aparatos_many', 'SCAN (subquery-1)'),
+    ('vincular_clientes', 'SCAN (subquery-1)'),
+    # Lista VALUES con los tres niveles de precio (modelo, marca, tipo)
+    ('estimar_precio', 'SCAN 3 CONSTANT ROWS'),
+}
+
+
+def llamadas(db):
+    # (nombre del método, argumentos) para cada consulta a verificar
+    return [
+        ('get_aparato', (1,)),
+        ('get_diagnostico', (1,)),
+        ('get_aparato_detalle', (1,)),
+        ('get_aparato_id_por_serie', ('SN0',)),
+        ('get_aparatos_page', (0, 50)),
+        ('get_aparatos_filas', ([1, 2],)),
+        ('get_historial_estados', (1,)),
+        ('get_ingresos_por_periodo', ('dia',)),
+        ('get_ingresos_por_periodo', ('mes',)),
+        ('get_aparatos_atrasados', (('Recibido', 'Aprobado'), 2e9)),
+        ('get_top_marcas', ()),
+        ('get_top_tipos', ()),
+        ('get_top_conteos', ('marca', 5)),
+        ('search_aparatos', ('sony',)),
+        ('search_aparatos', ('1',)),
+        ('update_estado', (1, 'Aprobado')),
+        ('update_observaciones', (1, 'Sin novedad')),
+        ('update_estado_many', ([(1, 'Listo'), (2, 'Listo')],)),
+        ('insert_diagnostico', (1, 'Pantalla rota', 100.0)),
+        ('insert_diagnostico', (1, 'Batería', 0, [('repuesto', 'Batería', 1, 40.0), ('descuento', 'Cliente', 1, 5.0)])),
+        ('insert_linea', (1, 'impuesto', 'IVA', 1, 12.0)),
+        ('get_lineas_aparato', (1,)),
+        ('insert_aparato', ('TV', 'Sony', 'X1', 'SN1', 'No enciende', 'Recibido', 'Ana', '555')),
+        ('insert_aparatos_many', ([('TV', 'LG', 'X2', 'SN2', 'No enciende', 'Recibido', 'Luis', '556')],)),
+        ('vincular_clientes', (0,)),
+        ('get_cliente_id', ('Ana', '555')),
+        ('buscar_clientes', ('an',)),
+        ('buscar_clientes', ('55',)),
+        ('get_cliente', (1,)),
+        ('get_aparatos_cliente', (1,)),
+        ('get_tecnico_id', ('Pedro',)),
+        ('get_politica_trabajos', ()),
+        ('estimar_esfuerzo', ('TV', 'Sony')),
+        ('sumar_esfuerzo', (1, 600)),
+        ('encolar_trabajo', (1,)),
+        ('encolar_trabajo', (2,)),
+        ('encolar_pendientes', ()),
+        ('get_cola_trabajos', ()),
+        ('tomar_trabajo', (1,)),
+        ('tomar_trabajo', (1, 2)),
+        ('get_trabajos_tecnico', (1,)),
+        ('terminar_trabajo', (1,)),
+        ('update_prioridad_cliente', (1, 1)),
+        ('cambiar_politica_trabajos', ('holgura',)),
+        ('reordenar_trabajos', ()),
+        ('quitar_trabajo', (2,)),
+        ('registrar_transicion', (2, 'Recibido', 'Aprobado')),
+        ('seguir_cola', (2, 'Recibido', 'Aprobado')),
+        ('cambiar_estado_fila', (2, 'En reparación', None, 'Pedro')),
+        ('estimar_precio', ('TV', 'Sony', 'X1')),
+        ('estimar_precio', ('Licuadora', '', '')),
+        ('insert_adjunto', (1, 'ab' * 32, 'foto.jpg', 1000, 'ingreso')),
+        ('get_adjuntos_aparato', (1,)),
+        ('delete_adjunto', (1,)),
+        ('update_estado', (3, 'Listo')),
+        ('insert_aviso', (1, 'Listo')),
+        ('tomar_avisos', (10,)),
+        ('registrar_envios', ([1], [(2, 'rechazado')])),
+        ('get_proximo_aviso', ()),
+        ('get_avisos_aparato', (1,)),
+    ]
+
+
+def sentencias_de(db, metodo, argumentos):
+    capturadas = []
+
+    def trace(sql):
+        # Las sentencias de triggers llegan como comentarios '-- ...'
+        if sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH')):
+            capturadas.append(sql)
+
+    # Las consultas del tablero van por la conexión de lectura
+    conexiones = (db.conn, db.read_connection())
+    for conn in conexiones:
+        conn.set_trace_callback(trace)
+    try:
+        getattr(db, metodo)(*argumentos)
+    finally:
+        for conn in conexiones:
+            conn.set_trace_callback(None)
+    return capturadas
+
+
+def excepcion_de(metodo, detalle):
+    for excepcion in ACOTADOS:
+        if excepcion[0] == metodo and detalle.startswith(excepcion[1]):
+            return excepcion
+    return None
+
+
+def recorridos_completos(db, metodo, sql, usados):
+    plan = db.conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+    completos = []
+    for fila in plan:
+        if not fila[3].startswith('SCAN '):
+            continue
+        excepcion = excepcion_de(metodo, fila[3])
+        if excepcion is None:
+            completos.append(fila[3])
+        else:
+            usados.add(excepcion)
+    return completos
+
+
+def main():
+    fallas = 0
+    usados = set()
+    with tempfile.TemporaryDirectory() as directorio:
+        db = DatabaseManager(os.path.join(directorio, 'planes.db'))
+        db.insert_aparato('TV', 'Sony', 'X1', 'SN0', 'No enciende', 'Recibido', 'Ana', '555')
+        db.insert_aparato('Radio', 'LG', 'R2', 'SN9', 'Sin sonido', 'Recibido', 'Luis', '556')
+        db.insert_diagnostico(1, 'Fuente quemada', 50.0)
+        verificadas = llamadas(db)
+        llamados = {metodo for metodo, _ in verificadas}
+        publicos = {nombre for nombre, _ in inspect.getmembers(DatabaseManager, inspect.isfunction)
+                    if not nombre.startswith('_')}
+        for metodo in sorted(publicos - llamados - PERMITIDOS - SIN_CONSULTAS):
+            fallas += 1
+            print('FALTA %s: no está en llamadas() ni en PERMITIDOS o SIN_CONSULTAS' % metodo)
+        for nombre, excepciones in (('PERMITIDOS', PERMITIDOS), ('SIN_CONSULTAS', SIN_CONSULTAS)):
+            for metodo in sorted(excepciones - (publicos - llamados)):
+                fallas += 1
+                print('SOBRA %s en %s: no es un método público o ya está en llamadas()' % (metodo, nombre))
+        for metodo in sorted(PERMITIDOS & SIN_CONSULTAS):
+            fallas += 1
+            print('SOBRA %s: está en PERMITIDOS y en SIN_CONSULTAS' % metodo)
+        for metodo, argumentos in verificadas:
+            for sql in sentencias_de(db, metodo, argumentos):
+                for detalle in recorridos_completos(db, metodo, sql, usados):
+                    fallas += 1
+                    print('FALLA %s: %s\n    %s' % (metodo, detalle, ' '.join(sql.split())))
+        db.close()
+    for metodo, prefijo in sorted(ACOTADOS - usados):
+        fallas += 1
+        print('SOBRA la excepción %s: %s' % (metodo, prefijo))
+    if fallas:
+        print('%d fallas' % fallas)
+        return 1
+    print('OK: ninguna consulta recorre una tabla completa')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+# Verifica la sincronización entre dos sucursales con dos bases locales:
+# datos sintéticos distintos en cada una, un intercambio completo, cambios y
+# conflictos de los dos lados y un intercambio de deltas. Al final las dos
+# bases deben tener las mismas filas (por id global), los mismos totales y
+# estadísticas de estados coherentes. Muestra el tamaño de cada paquete.
+# Termina con código 1 si algo no coincide.
+#
+# Uso: python benchmarks/verificar_sincronizacion.py [--aparatos 5000]
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from database import DatabaseManager
+from generar_datos import generar
+from sincronizacion import COLUMNAS, EXPRESIONES, UNIONES, exportar, importar, sucursal_de
+
+
+def foto(db):
+    # Contenido comparable entre bases: filas por id global, con valor y
+    # totales que cada base recalcula por su cuenta
+    sucursal = sucursal_de(db)
+    resultado = {}
+    extras = {'aparatos': ', COALESCE(tot.total, 0)', 'diagnosticos': ', t.valor', 'lineas_diagnostico': ''}
+    for tabla, columnas in COLUMNAS.items():
+        union = UNIONES[tabla]
+        if tabla == 'aparatos':
+            union += ' LEFT JOIN totales_aparatos tot ON tot.aparato_id = t.id'
+        sql = 'SELECT COALESCE(t.uid, :sucursal || \'-\' || t.id), %s%s FROM %s t %s' % (
+            ', '.join(EXPRESIONES[tabla].get(c, 't.' + c) for c in columnas), extras[tabla], tabla, union)
+        resultado[tabla] = {fila[0]: tuple(round(v, 6) if isinstance(v, float) else v for v in fila[1:])
+                            for fila in db.conn.execute(sql, {'sucursal': sucursal})}
+    return resultado
+
+
+def estadisticas_coherentes(db):
+    reales = dict(db.conn.execute("SELECT COALESCE(estado, ''), COUNT(*) FROM aparatos GROUP BY 1"))
+    en_cola = {estado: cantidad for estado, cantidad in
+               db.conn.execute('SELECT estado, en_cola FROM estadisticas_estados WHERE en_cola != 0')}
+    return reales == en_cola
+
+
+def intercambiar(origen, destino, directorio, nombre, para):
+    ruta = os.path.join(directorio, nombre + '.json.gz')
+    inicio = time.perf_counter()
+    cantidad = exportar(origen, ruta, para)
+    exportado = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    resultado = importar(destino, ruta)
+    print('  %-22s %7d cambios %10d bytes  exportar %7.1f ms  importar %7.1f ms  %s' % (
+        nombre, cantidad, os.path.getsize(ruta), exportado * 1000, (time.perf_counter() - inicio) * 1000,
+        ', '.join('%s=%d' % (k, v) for k, v in resultado.items() if k != 'sucursal')))
+    return ruta, resultado
+
+
+def comparar(a, b):
+    fallas = 0
+    foto_a, foto_b = foto(a), foto(b)
+    for tabla in COLUMNAS:
+        distintas = set(foto_a[tabla].items()) ^ set(foto_b[tabla].items())
+        if distintas:
+            fallas += 1
+            print('FALLA %s: %d filas distintas, p. ej. %s' % (tabla, len(distintas), sorted(distintas)[:2]))
+    for nombre, db in (('A', a), ('B', b)):
+        if not estadisticas_coherentes(db):
+            fallas += 1
+            print('FALLA estadisticas_estados de %s no coincide con los aparatos' % nombre)
+    return fallas
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Verifica la sincronización entre dos bases')
+    parser.add_argument('--aparatos', type=int, default=5000)
+    args = parser.parse_args()
+
+    fallas = 0
+    with tempfile.TemporaryDirectory() as directorio:
+        a = DatabaseManager(os.path.join(directorio, 'sucursal_a.db'))
+        b = DatabaseManager(os.path.join(directorio, 'sucursal_b.db'))
+        generar(a, args.aparatos, semilla=1)
+        generar(b, args.aparatos // 2, semilla=2)
+        id_a, id_b = sucursal_de(a), sucursal_de(b)
+        print('Sucursal A %s, sucursal B %s' % (id_a, id_b))
+
+        print('Primer intercambio (todo):')
+        intercambiar(a, b, directorio, 'a_completo', id_b)
+        intercambiar(b, a, directorio, 'b_completo', id_a)
+        fallas += comparar(a, b)
+
+        # Cambios de los dos lados: los mismos aparatos en ambas (conflicto,
+        # gana el cambio más reciente: el de B), un diagnóstico nuevo en A
+        # sobre un aparato de B, un diagnóstico borrado en B y altas en A
+        ids_b_en_a = [fila[0] for fila in a.conn.execute(
+            'SELECT id FROM aparatos WHERE uid LIKE ? ORDER BY id LIMIT 20', (id_b + '-%',))]
+        for aparato_id in range(1, 51):
+            a.update_estado(aparato_id, 'Aprobado', 'verificacion')
+        time.sleep(0.01)
+        for aparato_id in range(1, 26):
+            b.update_observaciones(b.conn.execute('SELECT id FROM aparatos WHERE uid = ?',
+                                                  ('%s-%d' % (id_a, aparato_id),)).fetchone()[0], 'Cambio en B')
+            b.update_estado(b.conn.execute('SELECT id FROM aparatos WHERE uid = ?',
+                                           ('%s-%d' % (id_a, aparato_id),)).fetchone()[0], 'En reparación')
+        for aparato_id in ids_b_en_a:
+            a.insert_diagnostico(aparato_id, 'Revisión en A', 30.0, [('repuesto', 'Cable', 2, 5.0)])
+        with b.transaction():
+            b.cursor.execute('DELETE FROM diagnosticos WHERE id = (SELECT MIN(id) FROM diagnosticos)')
+        a.insert_aparatos_many([('Celular', 'Apple', 'X', 'SN-NUEVO-%d' % i, 'No carga', 'Recibido', 'Ana', '300')
+                                for i in range(100)])
+
+        print('Deltas:')
+        ruta_a, _ = intercambiar(a, b, directorio, 'a_delta', id_b)
+        intercambiar(b, a, directorio, 'b_delta', id_a)
+        fallas += comparar(a, b)
+
+        print('Sin cambios nuevos y paquete repetido:')
+        _, vacio = intercambiar(a, b, directorio, 'a_vacio', id_b)
+        intercambiar(b, a, directorio, 'b_vacio', id_a)
+        repetido = importar(b, ruta_a)
+        if vacio['aplicados'] or repetido['aplicados']:
+            fallas += 1
+            print('FALLA un paquete vacío o repetido aplicó cambios: %s / %s' % (vacio, repetido))
+        fallas += comparar(a, b)
+        ganador = (a.conn.execute('SELECT observaciones, estado FROM aparatos WHERE id = 1').fetchall() +
+                   b.conn.execute('SELECT observaciones, estado FROM aparatos WHERE uid = ?', ('%s-1' % id_a,)).fetchall())
+        if ganador != [('Cambio en B', 'En reparación')] * 2:
+            fallas += 1
+            print('FALLA el conflicto no lo ganó el cambio más reciente: %s' % ganador)
+        a.close()
+        b.close()
+    if fallas:
+        print('%d verificaciones fallaron' % fallas)
+        return 1
+    print('OK: las dos sucursales quedaron iguales')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1906 @@
+import os
+import pathlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import uuid
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from string import Template
+
+from instrumentacion import conectar, instrumentacion_entorno
+
+# La ruta se puede cambiar sin tocar el código con la variable REPARACIONES_DB
+DB_PATH_POR_DEFECTO = 'reparaciones.db'
+CACHE_SIZE_POR_DEFECTO = -16000        # negativo = KiB (16 MB)
+MMAP_SIZE_POR_DEFECTO = 64 * 1024 * 1024
+ESPERA_BLOQUEO = 5.0                   # segundos esperando a otro escritor
+
+TAMANO_CACHE_DETALLES = 128
+TTL_TABLERO = 60.0                     # segundos que vale una consulta del tablero
+
+# Agrupación de ingresos del tablero: (expresión SQL sobre ingresos_diarios.dia,
+# períodos por defecto, segundos por período)
+PERIODOS_TABLERO = {
+    'dia': ('dia', 30, 86400),
+    'semana': ("strftime('%Y-%W', dia)", 26, 7 * 86400),
+    'mes': ("strftime('%Y-%m', dia)", 24, 31 * 86400),
+}
+
+# Tablas que se sincronizan entre sucursales (sincronizacion.py), en el
+# orden en que se aplican
+TABLAS_SINCRONIZADAS = ('aparatos', 'diagnosticos', 'lineas_diagnostico')
+
+# Clave de ajustes que marca la transacción que archiva aparatos, y los
+# triggers que no corren en ella (ver create_archive_support)
+ARCHIVANDO = 'archivando'
+TRIGGERS_FUERA_DE_ARCHIVO = (
+    'lineas_totales_ad', 'diagnosticos_ingresos_ad', 'aparatos_conteos_ad',
+    'aparatos_cambios_ad', 'diagnosticos_cambios_ad', 'lineas_diagnostico_cambios_ad',
+)
+FUERA_DE_ARCHIVO = "NOT EXISTS (SELECT 1 FROM ajustes WHERE clave = '%s')" % ARCHIVANDO
+
+# Tipos de línea de un diagnóstico; los descuentos restan del total
+TIPOS_LINEA = ('repuesto', 'mano_obra', 'impuesto', 'descuento')
+# Momento de una foto del aparato: cómo llegó y cómo quedó
+ETAPAS_ADJUNTO = ('ingreso', 'reparado')
+
+# Avisos al cliente (ver create_notifications y avisos.py): el mensaje que
+# se encola cuando un aparato pasa a cada estado
+MENSAJES_AVISOS = {
+    'Listo': 'Hola $nombre_cliente, su $tipo $marca $modelo (orden $id) ya está listo para retirar.',
+}
+REINTENTOS_AVISOS = 8                  # intentos antes de darlo por fallido
+ESPERA_REINTENTO_AVISO = 30.0          # segundos hasta el primer reintento; se duplica en cada uno
+RESERVA_AVISOS = 300.0                 # segundos que un lote en envío queda reservado
+
+# Cola de trabajos del taller: los aparatos aprobados esperan en ella hasta
+# que un técnico los toma (pasan a ESTADO_EN_TRABAJO)
+ESTADO_EN_COLA = 'Aprobado'
+ESTADO_EN_TRABAJO = 'En reparación'
+ESTADO_LISTO = 'Listo'
+ESTADO_ENTREGADO = 'Entregado'
+# Estados que ya no cuentan como trabajo pendiente (cierran el trabajo de
+# la cola y no suman en el tablero)
+ESTADOS_TERMINADOS = (ESTADO_LISTO, ESTADO_ENTREGADO)
+DIAS_PROMETIDOS = 3                    # entrega prometida si no se indica otra
+ESFUERZO_POR_DEFECTO = 4 * 3600        # segundos, sin reparaciones anteriores que sirvan
+MINIMO_REPARACIONES = 5                # para estimar por tipo y marca (si no, por tipo)
+SEGUNDOS_POR_PRIORIDAD = 2 * 86400     # cada nivel de prioridad del cliente adelanta dos días
+# En las tablas de estadísticas por tipo, marca y modelo, TODOS en una
+# columna acumula todos sus valores
+TODOS = '*'
+# (tipo, marca) del renglón de esfuerzos_modelos que acumula todo el taller
+TODO_EL_TALLER = (TODOS, TODOS)
+
+# Estimación de precios (ver create_price_stats): cuántos diagnósticos con
+# valor hacen falta para sugerir con un nivel (modelo, marca o tipo)
+MINIMO_PRECIOS = 5
+# Claves de tipo, marca y modelo del aparato `a` en cada nivel `n`, y la
+# cubeta de un valor: sus dos primeras cifras significativas, en centavos
+# (1234.5 -> 120000), así cada cubeta abarca menos del 10 % del valor
+CLAVES_PRECIO = '''UPPER(TRIM(COALESCE(a.tipo, ''))),
+    CASE WHEN n.nivel > 1 THEN UPPER(TRIM(COALESCE(a.marca, ''))) ELSE '*' END,
+    CASE WHEN n.nivel > 2 THEN UPPER(TRIM(COALESCE(a.modelo, ''))) ELSE '*' END'''
+NIVELES_PRECIO = '(SELECT 1 AS nivel UNION ALL SELECT 2 UNION ALL SELECT 3) n'
+CUBETA_PRECIO = '''CAST(substr(printf('%d', ROUND({valor} * 100)), 1, 2)
+    || substr('0000000000000000', 1, length(printf('%d', ROUND({valor} * 100))) - 2) AS INTEGER)'''
+
+# Políticas de la cola: expresión SQL sobre las columnas de trabajos; sale
+# primero el valor más chico. La elegida queda en ajustes.
+POLITICAS_TRABAJOS = {
+    'llegada': 'ingreso',
+    'fecha': 'fecha_prometida',
+    'holgura': 'fecha_prometida - esfuerzo',
+    'corto': 'esfuerzo',
+    'prioridad': 'fecha_prometida - esfuerzo - prioridad * %d' % SEGUNDOS_POR_PRIORIDAD,
+}
+POLITICA_TRABAJOS_POR_DEFECTO = 'prioridad'
+
+# Aparato con su último diagnóstico y los totales de todos sus diagnósticos
+DetalleAparato = namedtuple('DetalleAparato', [
+    'id', 'tipo', 'marca', 'modelo', 'numero_serie', 'problema', 'estado',
+    'nombre_cliente', 'telefono_cliente', 'observaciones',
+    'diagnostico', 'valor', 'cantidad_diagnosticos', 'total',
+    'repuestos', 'mano_obra', 'impuestos', 'descuentos', 'fotos',
+])
+
+# Aviso reservado para enviar; intentos ya cuenta el envío en curso
+Aviso = namedtuple('Aviso', ['id', 'aparato_id', 'destino', 'mensaje', 'intentos'])
+
+# Sugerencia de precio para un tipo, marca y modelo; nivel dice de qué
+# renglón salió ('modelo', 'marca' o 'tipo') y diagnosticos son los más
+# anotados en ese nivel: pares (texto, veces)
+EstimacionPrecio = namedtuple('EstimacionPrecio', [
+    'nivel', 'cantidad', 'promedio', 'desvio', 'p25', 'mediana', 'p75', 'diagnosticos',
+])
+
+
+def normalizar_telefono(telefono):
+    # Solo los dígitos: "300 123-4567" y "3001234567" son el mismo número
+    return re.sub(r'[^0-9]', '', telefono or '')
+
+
+def normalizar_nombre(nombre):
+    # Minúsculas, sin tildes y con un espacio entre palabras; es la clave
+    # con la que se reconoce a un cliente y se busca por prefijo
+    descompuesto = unicodedata.normalize('NFKD', nombre or '')
+    return ' '.join(''.join(c for c in descompuesto if not unicodedata.combining(c)).casefold().split())
+
+
+def fin_de_prefijo(prefijo):
+    # Primer texto mayor que todos los que empiezan con prefijo: "col >= p AND
+    # col < fin" usa el índice, LIKE 'p%' no (distingue mayúsculas)
+    return prefijo[:-1] + chr(ord(prefijo[-1]) + 1)
+
+
+def cuantiles_cubetas(cubetas, fracciones):
+    # cubetas: pares (cubeta, cantidad) en orden (ver CUBETA_PRECIO). Dentro
+    # de la cubeta se interpola suponiendo los valores repartidos parejo.
+    total = sum(cantidad for _, cantidad in cubetas)
+    resultado = []
+    for fraccion in fracciones:
+        objetivo, acumulado = fraccion * total, 0
+        for cubeta, cantidad in cubetas:
+            if acumulado + cantidad >= objetivo:
+                ancho = 10 ** max(len(str(cubeta)) - 2, 0)
+                resultado.append((cubeta + ancho * (objetivo - acumulado) / cantidad) / 100)
+                break
+            acumulado += cantidad
+    return resultado
+
+
+def configurar_conexion(conn, cache_size=CACHE_SIZE_POR_DEFECTO, mmap_size=MMAP_SIZE_POR_DEFECTO):
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA cache_size = %d' % cache_size)
+    conn.execute('PRAGMA mmap_size = %d' % mmap_size)
+    conn.execute('PRAGMA temp_store = MEMORY')
+    return conn
+
+
+class PoolLectura:
+    # Conexiones de solo lectura, una por hilo. Con WAL los lectores no
+    # bloquean al escritor ni se bloquean entre sí.
+    def __init__(self, db_path, cache_size=CACHE_SIZE_POR_DEFECTO, mmap_size=MMAP_SIZE_POR_DEFECTO,
+                 instrumentacion=None):
+        self.db_path = db_path
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.instrumentacion = instrumentacion
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.conexiones = []
+
+    def conexion(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            uri = pathlib.Path(self.db_path).absolute().as_uri() + '?mode=ro'
+            # check_same_thread=False solo para poder cerrarlas desde close()
+            conn = conectar(self.instrumentacion, uri, uri=True, timeout=ESPERA_BLOQUEO, check_same_thread=False)
+            configurar_conexion(conn, self.cache_size, self.mmap_size)
+            self.local.conn = conn
+            with self.lock:
+                self.conexiones.append(conn)
+        return conn
+
+    def close(self):
+        with self.lock:
+            for conn in self.conexiones:
+                conn.close()
+            self.conexiones = []
+        self.local = threading.local()
+
+
+def buscar_aparatos(cursor, texto, limit=100):
+    # Cada palabra se busca como prefijo; todas deben aparecer (AND)
+    palabras = ['"%s"*' % p.replace('"', '""') for p in texto.split()]
+    if not palabras:
+        return []
+    resultados = []
+    numero = texto.strip()
+    if numero.isascii() and numero.isdecimal() and len(numero) <= 18:
+        # Un número exacto también puede ser el ID del aparato
+        cursor.execute('SELECT id, tipo, marca FROM aparatos WHERE id = ?', (int(numero),))
+        resultados.extend(cursor.fetchall())
+    cursor.execute('''
+        SELECT a.id, a.tipo, a.marca FROM aparatos_fts
+        JOIN aparatos a ON a.id = aparatos_fts.rowid
+        WHERE aparatos_fts MATCH ?
+        ORDER BY rank
+        LIMIT ?
+    ''', (' '.join(palabras), limit))
+    ids = {r[0] for r in resultados}
+    resultados.extend(r for r in cursor.fetchall() if r[0] not in ids)
+    return resultados[:limit]
+
+
+class DatabaseManager:
+    def __init__(self, db_path=None, cache_size=CACHE_SIZE_POR_DEFECTO, mmap_size=MMAP_SIZE_POR_DEFECTO,
+                 instrumentacion=None):
+        if db_path is None:
+            db_path = os.environ.get('REPARACIONES_DB', DB_PATH_POR_DEFECTO)
+        self.db_path = db_path
+        # Sin instrumentación (lo normal) las conexiones son las de sqlite3 sin envolver
+        if instrumentacion is None:
+            instrumentacion = instrumentacion_entorno()
+        self.instrumentacion = instrumentacion
+        # Única conexión de escritura; las lecturas en segundo plano usan self.lectores
+        self.conn = conectar(instrumentacion, db_path, timeout=ESPERA_BLOQUEO)
+        # Para vincular_clientes, que normaliza en SQL lotes enteros
+        self.conn.create_function('normalizar_telefono', 1, normalizar_telefono, deterministic=True)
+        self.conn.create_function('normalizar_nombre', 1, normalizar_nombre, deterministic=True)
+        # Solo tiene efecto en una base nueva; en las existentes lo aplica el
+        # primer VACUUM del mantenimiento
+        self.conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        if db_path != ':memory:':
+            self.conn.execute('PRAGMA journal_mode = WAL')
+        configurar_conexion(self.conn, cache_size, mmap_size)
+        self.lectores = PoolLectura(db_path, cache_size, mmap_size, instrumentacion)
+        self.cursor = self.conn.cursor()
+        self.nivel_transaccion = 0
+        self.cache_detalles = OrderedDict()
+        self.version_datos = None
+        # Consultas del tablero: clave -> (vence, generación, resultado)
+        self.cache_tablero = {}
+        self.generacion_datos = 0
+        # Funciones oyente(ids) que se llaman después de cada commit con los
+        # aparatos que cambiaron (ids None: cualquiera pudo cambiar)
+        self.oyentes = []
+        self.cambiados = set()
+        self.create_tables()
+
+    # Migraciones del esquema, en orden. PRAGMA user_version guarda cuántas
+    # se aplicaron; las nuevas se agregan siempre al final de la lista.
+    MIGRACIONES = [
+        'create_base_tables',
+        'create_search_index',
+        'create_indexes',
+        'create_state_history',
+        'create_line_items',
+        'create_dashboard_tables',
+        'create_sync_tables',
+        'create_archive_support',
+        'create_customers',
+        'create_job_queue',
+        'create_price_stats',
+        'create_attachments',
+        'create_notifications',
+        'create_totals_cleanup',
+        'create_revenue_on_delete',
+    ]
+
+    def create_tables(self):
+        self.cursor.execute('PRAGMA user_version')
+        version = self.cursor.fetchone()[0]
+        for numero, migracion in enumerate(self.MIGRACIONES, start=1):
+            if numero <= version:
+                continue
+            with self.transaction():
+                getattr(self, migracion)()
+                self.cursor.execute('PRAGMA user_version = %d' % numero)
+
+    def create_base_tables(self):
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS aparatos (
+                id INTEGER PRIMARY KEY,
+                tipo TEXT,
+                marca TEXT,
+                modelo TEXT,
+                numero_serie TEXT,
+                problema TEXT,
+                estado TEXT,
+                nombre_cliente TEXT,
+                telefono_cliente TEXT,
+                observaciones TEXT            
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS diagnosticos (
+                id INTEGER PRIMARY KEY,
+                aparato_id INTEGER,
+                diagnostico TEXT,
+                valor REAL,
+                FOREIGN KEY (aparato_id) REFERENCES aparatos (id)
+            )
+        ''')
+
+    def create_search_index(self):
+        # Índice de texto completo sobre aparatos, sincronizado por triggers
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'aparatos_fts'")
+        existia = self.cursor.fetchone() is not None
+        self.cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS aparatos_fts USING fts5(
+                tipo, marca, modelo, numero_serie, nombre_cliente, telefono_cliente,
+                content='aparatos', content_rowid='id',
+                prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS aparatos_fts_ai AFTER INSERT ON aparatos BEGIN
+                INSERT INTO aparatos_fts (rowid, tipo, marca, modelo, numero_serie, nombre_cliente, telefono_cliente)
+                VALUES (new.id, new.tipo, new.marca, new.modelo, new.numero_serie, new.nombre_cliente, new.telefono_cliente);
+            END
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS aparatos_fts_ad AFTER DELETE ON aparatos BEGIN
+                INSERT INTO aparatos_fts (aparatos_fts, rowid, tipo, marca, modelo, numero_serie, nombre_cliente, telefono_cliente)
+                VALUES ('delete', old.id, old.tipo, old.marca, old.modelo, old.numero_serie, old.nombre_cliente, old.telefono_cliente);
+            END
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS aparatos_fts_au
+            AFTER UPDATE OF tipo, marca, modelo, numero_serie, nombre_cliente, telefono_cliente ON aparatos BEGIN
+                INSERT INTO aparatos_fts (aparatos_fts, rowid, tipo, marca, modelo, numero_serie, nombre_cliente, telefono_cliente)
+                VALUES ('delete', old.id, old.tipo, old.marca, old.modelo, old.numero_serie, old.nombre_cliente, old.telefono_cliente);
+                INSERT INTO aparatos_fts (rowid, tipo, marca, modelo, numero_serie, nombre_cliente, telefono_cliente)
+                VALUES (new.id, new.tipo, new.marca, new.modelo, new.numero_serie, new.nombre_cliente, new.telefono_cliente);
+            END
+        ''')
+        if not existia:
+            # Indexar las filas que ya estaban en la base
+            self.cursor.execute("INSERT INTO aparatos_fts (aparatos_fts) VALUES ('rebuild')")
+
+    def create_indexes(self):
+        # get_diagnostico se llama en cada búsqueda de las pantallas del flujo
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_diagnosticos_aparato ON diagnosticos (aparato_id)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_aparatos_estado ON aparatos (estado)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_aparatos_numero_serie ON aparatos (numero_serie)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_aparatos_telefono ON aparatos (telefono_cliente)')
+
+    def create_state_history(self):
+        # Historial de cambios de estado (solo se agregan filas) y totales por
+        # estado que se actualizan en cada cambio: el tablero lee una fila por
+        # estado sin recorrer el historial
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS historial_estados (
+                id INTEGER PRIMARY KEY,
+                aparato_id INTEGER NOT NULL,
+                estado_anterior TEXT,
+                estado_nuevo TEXT NOT NULL,
+                fecha REAL NOT NULL,
+                origen TEXT,
+                usuario TEXT,
+                FOREIGN KEY (aparato_id) REFERENCES aparatos (id)
+            )
+        ''')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_historial_aparato ON historial_estados (aparato_id)')
+        # en_cola: aparatos que están hoy en el estado; salidas y
+        # segundos_total: cuántos salieron del estado y cuánto estuvieron en él
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS estadisticas_estados (
+                estado TEXT PRIMARY KEY,
+                en_cola INTEGER NOT NULL DEFAULT 0,
+                salidas INTEGER NOT NULL DEFAULT 0,
+                segundos_total REAL NOT NULL DEFAULT 0
+            )
+        ''')
+        # Los aparatos que ya estaban cuentan en la cola de su estado actual;
+        # su tiempo en ese estado se desconoce y no entra en los promedios
+        self.cursor.execute('''
+            INSERT OR REPLACE INTO estadisticas_estados (estado, en_cola)
+            SELECT COALESCE(estado, ''), COUNT(*) FROM aparatos GROUP BY 1
+        ''')
+
+    def create_line_items(self):
+        # Cada diagnóstico se compone de líneas (repuestos, mano de obra,
+        # impuestos, descuentos). Los triggers mantienen diagnosticos.valor
+        # como la suma de sus líneas y totales_aparatos con un renglón por
+        # aparato, así la factura no suma nada al leerse.
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS lineas_diagnostico (
+                id INTEGER PRIMARY KEY,
+                diagnostico_id INTEGER NOT NULL,
+                aparato_id INTEGER NOT NULL,
+                tipo TEXT NOT NULL,
+                descripcion TEXT,
+                cantidad REAL NOT NULL DEFAULT 1,
+                precio REAL NOT NULL DEFAULT 0,
+                importe REAL NOT NULL,
+                FOREIGN KEY (diagnostico_id) REFERENCES diagnosticos (id),
+                FOREIGN KEY (aparato_id) REFERENCES aparatos (id)
+            )
+        ''')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_lineas_diagnostico ON lineas_diagnostico (diagnostico_id)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_lineas_aparato ON lineas_diagnostico (aparato_id)')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS totales_aparatos (
+                aparato_id INTEGER PRIMARY KEY,
+                cantidad_diagnosticos INTEGER NOT NULL DEFAULT 0,
+                ultimo_diagnostico_id INTEGER,
+                repuestos REAL NOT NULL DEFAULT 0,
+                mano_obra REAL NOT NULL DEFAULT 0,
+                impuestos REAL NOT NULL DEFAULT 0,
+                descuentos REAL NOT NULL DEFAULT 0,
+                total REAL NOT NULL DEFAULT 0
+            )
+        ''')
+        # Los diagnósticos que ya existían pasan a tener una línea de mano de
+        # obra por su valor; se cargan antes de crear los triggers
+        self.cursor.execute('''
+            INSERT INTO lineas_diagnostico (diagnostico_id, aparato_id, tipo, descripcion, cantidad, precio, importe)
+            SELECT id, aparato_id, 'mano_obra', diagnostico, 1, valor, valor
+            FROM diagnosticos WHERE COALESCE(valor, 0) != 0
+        ''')
+        self.cursor.execute('''
+            INSERT OR REPLACE INTO totales_aparatos
+                (aparato_id, cantidad_diagnosticos, ultimo_diagnostico_id, mano_obra, total)
+            SELECT aparato_id, COUNT(*), MAX(id), COALESCE(SUM(valor), 0), COALESCE(SUM(valor), 0)
+            FROM diagnosticos GROUP BY aparato_id
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS diagnosticos_totales_ai AFTER INSERT ON diagnosticos BEGIN
+                INSERT OR IGNORE INTO totales_aparatos (aparato_id) VALUES (new.aparato_id);
+                UPDATE totales_aparatos
+                SET cantidad_diagnosticos = cantidad_diagnosticos + 1, ultimo_diagnostico_id = new.id
+                WHERE aparato_id = new.aparato_id;
+            END
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS diagnosticos_totales_bd BEFORE DELETE ON diagnosticos BEGIN
+                DELETE FROM lineas_diagnostico WHERE diagnostico_id = old.id;
+            END
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS diagnosticos_totales_ad AFTER DELETE ON diagnosticos BEGIN
+                UPDATE totales_aparatos
+                SET cantidad_diagnosticos = cantidad_diagnosticos - 1,
+                    ultimo_diagnostico_id = (SELECT MAX(id) FROM diagnosticos WHERE aparato_id = old.aparato_id)
+                WHERE aparato_id = old.aparato_id;
+            END
+        ''')
+        for trigger, signo, fila in (('lineas_totales_ai', '+', 'new'), ('lineas_totales_ad', '-', 'old')):
+            self.cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS {trigger} AFTER {evento} ON lineas_diagnostico BEGIN
+                    UPDATE diagnosticos SET valor = COALESCE(valor, 0) {signo} {fila}.importe
+                    WHERE id = {fila}.diagnostico_id;
+                    UPDATE totales_aparatos SET
+                        repuestos = repuestos {signo} CASE {fila}.tipo WHEN 'repuesto' THEN {fila}.importe ELSE 0 END,
+                        mano_obra = mano_obra {signo} CASE {fila}.tipo WHEN 'mano_obra' THEN {fila}.importe ELSE 0 END,
+                        impuestos = impuestos {signo} CASE {fila}.tipo WHEN 'impuesto' THEN {fila}.importe ELSE 0 END,
+                        descuentos = descuentos {signo} CASE {fila}.tipo WHEN 'descuento' THEN {fila}.importe ELSE 0 END,
+                        total = total {signo} {fila}.importe
+                    WHERE aparato_id = {fila}.aparato_id;
+                END
+            '''.format(trigger=trigger, evento='INSERT' if fila == 'new' else 'DELETE', signo=signo, fila=fila))
+
+    def create_dashboard_tables(self):
+        # Fecha de cada diagnóstico para los ingresos del tablero; los
+        # anteriores quedan sin fecha y no entran en los períodos
+        self.cursor.execute('ALTER TABLE diagnosticos ADD COLUMN fecha REAL')
+        # Resúmenes del tablero mantenidos por triggers. Son WITHOUT ROWID:
+        # la clave primaria es el propio índice de cobertura, y las consultas
+        # leen unos cientos de filas aunque la base tenga millones.
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ingresos_diarios (
+                dia TEXT PRIMARY KEY,
+                diagnosticos INTEGER NOT NULL DEFAULT 0,
+                total REAL NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS conteos_aparatos (
+                campo TEXT NOT NULL,
+                valor TEXT NOT NULL,
+                cantidad INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (campo, valor)
+            ) WITHOUT ROWID
+        ''')
+        self.cursor.execute('''
+            INSERT OR REPLACE INTO conteos_aparatos (campo, valor, cantidad)
+            SELECT 'marca', COALESCE(marca, ''), COUNT(*) FROM aparatos GROUP BY 2
+            UNION ALL
+            SELECT 'tipo', COALESCE(tipo, ''), COUNT(*) FROM aparatos GROUP BY 2
+        ''')
+        dia = "date({fila}.fecha, 'unixepoch', 'localtime')"
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS diagnosticos_ingresos_ai AFTER INSERT ON diagnosticos
+            WHEN new.fecha IS NOT NULL BEGIN
+                INSERT OR IGNORE INTO ingresos_diarios (dia) VALUES ({dia});
+                UPDATE ingresos_diarios SET diagnosticos = diagnosticos + 1, total = total + COALESCE(new.valor, 0)
+                WHERE dia = {dia};
+            END
+        '''.format(dia=dia.format(fila='new')))
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS diagnosticos_ingresos_au AFTER UPDATE OF valor ON diagnosticos
+            WHEN new.fecha IS NOT NULL BEGIN
+                UPDATE ingresos_diarios SET total = total + COALESCE(new.valor, 0) - COALESCE(old.valor, 0)
+                WHERE dia = {dia};
+            END
+        '''.format(dia=dia.format(fila='new')))
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS diagnosticos_ingresos_ad AFTER DELETE ON diagnosticos
+            WHEN old.fecha IS NOT NULL BEGIN
+                UPDATE ingresos_diarios SET diagnosticos = diagnosticos - 1, total = total - COALESCE(old.valor, 0)
+                WHERE dia = {dia};
+            END
+        '''.format(dia=dia.format(fila='old')))
+        sumar = '''
+            INSERT OR IGNORE INTO conteos_aparatos (campo, valor) VALUES ('{campo}', COALESCE(new.{campo}, ''));
+            UPDATE conteos_aparatos SET cantidad = cantidad + 1 WHERE campo = '{campo}' AND valor = COALESCE(new.{campo}, '');
+        '''
+        restar = '''
+            UPDATE conteos_aparatos SET cantidad = cantidad - 1 WHERE campo = '{campo}' AND valor = COALESCE(old.{campo}, '');
+        '''
+        for trigger, evento, cuerpo in (('aparatos_conteos_ai', 'INSERT', sumar),
+                                        ('aparatos_conteos_ad', 'DELETE', restar),
+                                        ('aparatos_conteos_au', 'UPDATE OF marca, tipo', restar + sumar)):
+            self.cursor.execute('CREATE TRIGGER IF NOT EXISTS %s AFTER %s ON aparatos BEGIN %s END' % (
+                trigger, evento, cuerpo.format(campo='marca') + cuerpo.format(campo='tipo')))
+
+    def create_sync_tables(self):
+        # Registro de cambios para sincronizar sucursales. Cada base tiene un
+        # identificador de sucursal; el id global de una fila es
+        # "sucursal-id", y las filas que vinieron de otra sucursal guardan el
+        # suyo en uid (NULL = creada aquí). Los triggers anotan en cambios la
+        # última versión de cada fila y en borrados las filas eliminadas, con
+        # un contador de versión propio de la base en ajustes.
+        self.cursor.execute('CREATE TABLE IF NOT EXISTS ajustes (clave TEXT PRIMARY KEY, valor) WITHOUT ROWID')
+        self.cursor.execute("INSERT OR IGNORE INTO ajustes (clave, valor) VALUES ('sucursal', ?)", (uuid.uuid4().hex[:12],))
+        self.cursor.execute("INSERT OR IGNORE INTO ajustes (clave, valor) VALUES ('version_cambios', 1)")
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cambios (
+                tabla TEXT NOT NULL,
+                fila_id INTEGER NOT NULL,
+                version INTEGER NOT NULL,
+                fecha REAL NOT NULL,
+                autor TEXT,
+                recibido_de TEXT,
+                PRIMARY KEY (tabla, fila_id)
+            ) WITHOUT ROWID
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS borrados (
+                tabla TEXT NOT NULL,
+                uid TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                fecha REAL NOT NULL,
+                autor TEXT,
+                recibido_de TEXT,
+                PRIMARY KEY (tabla, uid)
+            ) WITHOUT ROWID
+        ''')
+        # enviado: última versión propia exportada a esa sucursal; recibido:
+        # última versión de ella importada aquí
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sincronizaciones (
+                sucursal TEXT PRIMARY KEY,
+                enviado INTEGER NOT NULL DEFAULT 0,
+                recibido INTEGER NOT NULL DEFAULT 0,
+                fecha REAL
+            )
+        ''')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_cambios_version ON cambios (version)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_borrados_version ON borrados (version)')
+        # Las filas anteriores entran en la primera exportación; con fecha 0
+        # cualquier cambio real les gana
+        for tabla in TABLAS_SINCRONIZADAS:
+            self.cursor.execute('ALTER TABLE %s ADD COLUMN uid TEXT' % tabla)
+            self.cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_%s_uid ON %s (uid) WHERE uid IS NOT NULL'
+                                % (tabla, tabla))
+            self.cursor.execute('INSERT OR IGNORE INTO cambios (tabla, fila_id, version, fecha) SELECT ?, id, 1, 0 FROM %s'
+                                % tabla, (tabla,))
+        version = "(SELECT valor FROM ajustes WHERE clave = 'version_cambios')"
+        ahora = "(julianday('now') - 2440587.5) * 86400.0"
+        anotar = '''
+            UPDATE ajustes SET valor = valor + 1 WHERE clave = 'version_cambios';
+            INSERT OR REPLACE INTO cambios (tabla, fila_id, version, fecha) VALUES ('{tabla}', new.id, {version}, {ahora});
+        '''
+        borrar = '''
+            UPDATE ajustes SET valor = valor + 1 WHERE clave = 'version_cambios';
+            DELETE FROM cambios WHERE tabla = '{tabla}' AND fila_id = old.id;
+            INSERT OR REPLACE INTO borrados (tabla, uid, version, fecha) VALUES ('{tabla}',
+                COALESCE(old.uid, (SELECT valor FROM ajustes WHERE clave = 'sucursal') || '-' || old.id), {version}, {ahora});
+        '''
+        # Solo las columnas que se copian: diagnosticos.valor lo recalculan
+        # las líneas en cada base y las líneas no se modifican
+        modificables = {
+            'aparatos': 'tipo, marca, modelo, numero_serie, problema, estado, nombre_cliente, '
+                        'telefono_cliente, observaciones',
+            'diagnosticos': 'aparato_id, diagnostico',
+        }
+        for tabla in TABLAS_SINCRONIZADAS:
+            eventos = [('ai', 'INSERT', anotar), ('ad', 'DELETE', borrar)]
+            if tabla in modificables:
+                eventos.append(('au', 'UPDATE OF ' + modificables[tabla], anotar))
+            for sufijo, evento, cuerpo in eventos:
+                self.cursor.execute('CREATE TRIGGER IF NOT EXISTS %s_cambios_%s AFTER %s ON %s BEGIN %s END' % (
+                    tabla, sufijo, evento, tabla, cuerpo.format(tabla=tabla, version=version, ahora=ahora)))
+
+    def create_archive_support(self):
+        # Archivar (mantenimiento.py) borra aparatos ya entregados de esta
+        # base. Mientras lo hace deja la clave ARCHIVANDO en ajustes, dentro
+        # de su propia transacción (nadie más la ve), y estos triggers no
+        # corren: los ingresos y conteos del tablero se conservan y los
+        # borrados no se propagan a las otras sucursales.
+        condicion = FUERA_DE_ARCHIVO
+        for nombre in TRIGGERS_FUERA_DE_ARCHIVO:
+            self.cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (nombre,))
+            sql = self.cursor.fetchone()[0]
+            cabecera, cuerpo = re.split(r'\bBEGIN\b', sql, maxsplit=1)
+            if re.search(r'\bWHEN\b', cabecera):
+                cabecera = re.sub(r'\bWHEN\b', 'WHEN %s AND (' % condicion, cabecera, count=1).rstrip() + ') '
+            else:
+                cabecera += 'WHEN %s ' % condicion
+            self.cursor.execute('DROP TRIGGER %s' % nombre)
+            self.cursor.execute(cabecera + 'BEGIN' + cuerpo)
+
+    def create_customers(self):
+        # Un cliente por teléfono y nombre normalizados. Los aparatos siguen
+        # guardando el nombre y el teléfono tal como se anotaron en la orden
+        # (la búsqueda, los documentos y la sincronización los usan) y
+        # apuntan a su cliente con cliente_id. Cada sucursal deduce sus
+        # clientes de sus aparatos; la tabla no se sincroniza.
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS clientes (
+                id INTEGER PRIMARY KEY,
+                nombre TEXT NOT NULL,
+                telefono TEXT NOT NULL,
+                nombre_clave TEXT NOT NULL
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_clientes_telefono_nombre ON clientes (telefono, nombre_clave)
+        ''')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_clientes_nombre ON clientes (nombre_clave)')
+        self.cursor.execute('ALTER TABLE aparatos ADD COLUMN cliente_id INTEGER REFERENCES clientes (id)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_aparatos_cliente ON aparatos (cliente_id)')
+        # Las búsquedas por teléfono van a clientes; este índice solo ocupaba lugar
+        self.cursor.execute('DROP INDEX IF EXISTS idx_aparatos_telefono')
+        self.vincular_clientes()
+
+    def create_job_queue(self):
+        # Un renglón por aparato aprobado. clave es el orden según la
+        # política vigente, calculado al encolar; el índice parcial tiene
+        # solo los pendientes, así el siguiente trabajo es una búsqueda en
+        # el índice sin importar cuántos hubo. Los terminados quedan para
+        # medir demoras. La cola es de cada sucursal y no se sincroniza.
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tecnicos (
+                id INTEGER PRIMARY KEY,
+                nombre TEXT NOT NULL UNIQUE
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS trabajos (
+                aparato_id INTEGER PRIMARY KEY REFERENCES aparatos (id),
+                prioridad INTEGER NOT NULL DEFAULT 0,
+                ingreso REAL NOT NULL,
+                fecha_prometida REAL NOT NULL,
+                esfuerzo REAL NOT NULL,
+                clave REAL NOT NULL,
+                tecnico_id INTEGER REFERENCES tecnicos (id),
+                tomado REAL,
+                terminado REAL
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_trabajos_cola ON trabajos (clave, aparato_id)
+            WHERE terminado IS NULL AND tecnico_id IS NULL
+        ''')
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_trabajos_tecnico ON trabajos (tecnico_id)
+            WHERE terminado IS NULL AND tecnico_id IS NOT NULL
+        ''')
+        # Los aparatos borrados (archivo, sincronización) salen de la cola
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS aparatos_trabajos_ad AFTER DELETE ON aparatos BEGIN
+                DELETE FROM trabajos WHERE aparato_id = old.id;
+            END
+        ''')
+        # Segundos de trabajo por tipo y marca, para estimar el esfuerzo
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS esfuerzos_modelos (
+                tipo TEXT NOT NULL,
+                marca TEXT NOT NULL,
+                reparaciones INTEGER NOT NULL DEFAULT 0,
+                segundos_total REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (tipo, marca)
+            ) WITHOUT ROWID
+        ''')
+        self.cursor.execute('ALTER TABLE clientes ADD COLUMN prioridad INTEGER NOT NULL DEFAULT 0')
+        self.cursor.execute('INSERT OR IGNORE INTO ajustes (clave, valor) VALUES (?, ?)',
+                            ('politica_trabajos', POLITICA_TRABAJOS_POR_DEFECTO))
+        self.rebuild_esfuerzos()
+        self.encolar_pendientes()
+
+    def create_price_stats(self):
+        # Estadísticas de precios para sugerir el valor al diagnosticar, en
+        # tres niveles por aparato: (tipo, marca, modelo), (tipo, marca, '*')
+        # y (tipo, '*', '*'), con las claves en mayúsculas y sin espacios a
+        # los lados. precios_modelos guarda cantidad y sumas de los valores,
+        # precios_cubetas un histograma (de él salen los cuartiles) y
+        # diagnosticos_modelos cuántas veces se anotó cada diagnóstico. Los
+        # triggers las actualizan con cada cambio de diagnosticos y del tipo,
+        # marca o modelo de su aparato; los diagnósticos sin valor (todavía
+        # sin líneas) no cuentan para el precio. Archivar no las toca: la
+        # historia se conserva.
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS precios_modelos (
+                tipo TEXT NOT NULL,
+                marca TEXT NOT NULL,
+                modelo TEXT NOT NULL,
+                cantidad INTEGER NOT NULL DEFAULT 0,
+                suma REAL NOT NULL DEFAULT 0,
+                suma_cuadrados REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (tipo, marca, modelo)
+            ) WITHOUT ROWID
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS precios_cubetas (
+                tipo TEXT NOT NULL,
+                marca TEXT NOT NULL,
+                modelo TEXT NOT NULL,
+                cubeta INTEGER NOT NULL,
+                cantidad INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (tipo, marca, modelo, cubeta)
+            ) WITHOUT ROWID
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS diagnosticos_modelos (
+                tipo TEXT NOT NULL,
+                marca TEXT NOT NULL,
+                modelo TEXT NOT NULL,
+                diagnostico TEXT NOT NULL,
+                cantidad INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (tipo, marca, modelo, diagnostico)
+            ) WITHOUT ROWID
+        ''')
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_diagnosticos_modelos_cantidad
+            ON diagnosticos_modelos (tipo, marca, modelo, cantidad)
+        ''')
+        niveles = 'SELECT {claves} FROM aparatos a, {niveles} WHERE a.id = {{fila}}.aparato_id'.format(
+            claves=CLAVES_PRECIO, niveles=NIVELES_PRECIO)
+        sumar_precio = '''
+            INSERT INTO precios_modelos (tipo, marca, modelo, cantidad, suma, suma_cuadrados)
+            SELECT {claves}, 1, {{fila}}.valor, {{fila}}.valor * {{fila}}.valor FROM aparatos a, {niveles}
+            WHERE a.id = {{fila}}.aparato_id AND {{fila}}.valor > 0
+            ON CONFLICT (tipo, marca, modelo) DO UPDATE SET cantidad = cantidad + 1,
+                suma = suma + excluded.suma, suma_cuadrados = suma_cuadrados + excluded.suma_cuadrados;
+            INSERT INTO precios_cubetas (tipo, marca, modelo, cubeta, cantidad)
+            SELECT {claves}, {cubeta}, 1 FROM aparatos a, {niveles}
+            WHERE a.id = {{fila}}.aparato_id AND {{fila}}.valor > 0
+            ON CONFLICT (tipo, marca, modelo, cubeta) DO UPDATE SET cantidad = cantidad + 1;
+        '''.format(claves=CLAVES_PRECIO, niveles=NIVELES_PRECIO, cubeta=CUBETA_PRECIO.format(valor='{fila}.valor'))
+        restar_precio = '''
+            UPDATE precios_modelos SET cantidad = cantidad - 1, suma = suma - {{valor}},
+                suma_cuadrados = suma_cuadrados - {{valor}} * {{valor}}
+            WHERE {{valor}} > 0 AND (tipo, marca, modelo) IN ({niveles});
+            UPDATE precios_cubetas SET cantidad = cantidad - 1
+            WHERE {{valor}} > 0 AND cubeta = {cubeta} AND (tipo, marca, modelo) IN ({niveles});
+        '''.format(niveles=niveles, cubeta=CUBETA_PRECIO.format(valor='{valor}'))
+        sumar_diagnostico = '''
+            INSERT INTO diagnosticos_modelos (tipo, marca, modelo, diagnostico, cantidad)
+            SELECT {claves}, TRIM({{fila}}.diagnostico), 1 FROM aparatos a, {niveles}
+            WHERE a.id = {{fila}}.aparato_id AND TRIM(COALESCE({{fila}}.diagnostico, '')) != ''
+            ON CONFLICT (tipo, marca, modelo, diagnostico) DO UPDATE SET cantidad = cantidad + 1;
+        '''.format(claves=CLAVES_PRECIO, niveles=NIVELES_PRECIO)
+        restar_diagnostico = '''
+            UPDATE diagnosticos_modelos SET cantidad = cantidad - 1
+            WHERE diagnostico = TRIM({{fila}}.diagnostico) AND (tipo, marca, modelo) IN ({niveles});
+        '''.format(niveles=niveles)
+        # Al borrar un diagnóstico, diagnosticos_totales_bd borra antes sus
+        # líneas y eso le cambia el valor; old.valor ya no es lo que está
+        # sumado. Por eso se resta antes de borrar (borrando las líneas aquí
+        # mismo si este trigger corre primero) y con el valor que tiene ahora.
+        # Si cambian tipo, marca o modelo del aparato (lo hace la
+        # sincronización) sus diagnósticos pasan de las claves viejas a las
+        # nuevas; restar es sumar con signo negativo a renglones que existen
+        mover_aparato = '''
+            INSERT INTO precios_modelos (tipo, marca, modelo, cantidad, suma, suma_cuadrados)
+            SELECT {claves}, {signo}COUNT(*), {signo}SUM(d.valor), {signo}SUM(d.valor * d.valor) {origen}
+            AND d.valor > 0 GROUP BY 1, 2, 3
+            ON CONFLICT (tipo, marca, modelo) DO UPDATE SET cantidad = cantidad + excluded.cantidad,
+                suma = suma + excluded.suma, suma_cuadrados = suma_cuadrados + excluded.suma_cuadrados;
+            INSERT INTO precios_cubetas (tipo, marca, modelo, cubeta, cantidad)
+            SELECT {claves}, {cubeta}, {signo}COUNT(*) {origen}
+            AND d.valor > 0 GROUP BY 1, 2, 3, 4
+            ON CONFLICT (tipo, marca, modelo, cubeta) DO UPDATE SET cantidad = cantidad + excluded.cantidad;
+            INSERT INTO diagnosticos_modelos (tipo, marca, modelo, diagnostico, cantidad)
+            SELECT {claves}, TRIM(d.diagnostico), {signo}COUNT(*) {origen}
+            AND TRIM(COALESCE(d.diagnostico, '')) != '' GROUP BY 1, 2, 3, 4
+            ON CONFLICT (tipo, marca, modelo, diagnostico) DO UPDATE SET cantidad = cantidad + excluded.cantidad;
+        '''
+        origen_aparato = '''FROM diagnosticos d,
+            (SELECT {fila}.tipo AS tipo, {fila}.marca AS marca, {fila}.modelo AS modelo) a, %s
+            WHERE d.aparato_id = new.id''' % NIVELES_PRECIO
+        mover_aparato = ''.join(mover_aparato.format(
+            claves=CLAVES_PRECIO, cubeta=CUBETA_PRECIO.format(valor='d.valor'), signo=signo,
+            origen=origen_aparato.format(fila=fila)) for signo, fila in (('-', 'old'), ('', 'new')))
+        claves_cambiadas = ' OR '.join(
+            "UPPER(TRIM(COALESCE(old.{0}, ''))) != UPPER(TRIM(COALESCE(new.{0}, '')))".format(columna)
+            for columna in ('tipo', 'marca', 'modelo'))
+        for trigger, evento, cuerpo in (
+                ('diagnosticos_precios_ai', 'INSERT ON diagnosticos',
+                 (sumar_precio + sumar_diagnostico).format(fila='new')),
+                ('diagnosticos_precios_au', 'UPDATE OF valor, aparato_id ON diagnosticos',
+                 restar_precio.format(fila='old', valor='old.valor') + sumar_precio.format(fila='new')),
+                ('diagnosticos_textos_au', 'UPDATE OF diagnostico, aparato_id ON diagnosticos',
+                 restar_diagnostico.format(fila='old') + sumar_diagnostico.format(fila='new')),
+                ('diagnosticos_precios_bd', 'DELETE ON diagnosticos WHEN ' + FUERA_DE_ARCHIVO,
+                 'DELETE FROM lineas_diagnostico WHERE diagnostico_id = old.id;'
+                 + restar_precio.format(fila='old', valor='(SELECT valor FROM diagnosticos WHERE id = old.id)')
+                 + restar_diagnostico.format(fila='old')),
+                ('aparatos_precios_au', 'UPDATE OF tipo, marca, modelo ON aparatos WHEN ' + claves_cambiadas,
+                 mover_aparato)):
+            momento = 'BEFORE' if trigger.endswith('_bd') else 'AFTER'
+            self.cursor.execute('CREATE TRIGGER IF NOT EXISTS %s %s %s BEGIN %s END' % (trigger, momento, evento, cuerpo))
+        self.rebuild_precios()
+
+    def create_attachments(self):
+        # Fotos de los aparatos: el archivo está en el directorio de adjuntos
+        # (adjuntos.py) con su SHA-256 como nombre; aquí solo a qué aparato
+        # pertenece. Varias filas pueden compartir hash (la misma foto
+        # cargada dos veces). Al archivar se van con su aparato.
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS adjuntos (
+                id INTEGER PRIMARY KEY,
+                aparato_id INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                nombre TEXT,
+                tamano INTEGER NOT NULL,
+                etapa TEXT NOT NULL,
+                fecha REAL NOT NULL,
+                FOREIGN KEY (aparato_id) REFERENCES aparatos (id)
+            )
+        ''')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_adjuntos_aparato ON adjuntos (aparato_id)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_adjuntos_hash ON adjuntos (hash)')
+        # Un aparato borrado (por la sincronización) se lleva sus filas; los
+        # archivos que quedan sin uso los borra mantenimiento.py
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS aparatos_adjuntos_ad AFTER DELETE ON aparatos WHEN %s BEGIN
+                DELETE FROM adjuntos WHERE aparato_id = old.id;
+            END
+        ''' % FUERA_DE_ARCHIVO)
+
+    def create_notifications(self):
+        # Bandeja de salida de los avisos al cliente: update_estado escribe el
+        # aviso en la misma transacción que el cambio de estado y ColaAvisos
+        # (avisos.py) los envía. proximo_intento es NULL cuando ya no hay
+        # nada que hacer (enviado o fallido); mientras un lote se envía
+        # queda en el futuro, así un envío cortado se retoma al vencer.
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS avisos (
+                id INTEGER PRIMARY KEY,
+                aparato_id INTEGER NOT NULL,
+                estado TEXT NOT NULL,
+                destino TEXT NOT NULL,
+                mensaje TEXT NOT NULL,
+                creado REAL NOT NULL,
+                proximo_intento REAL,
+                intentos INTEGER NOT NULL DEFAULT 0,
+                enviado REAL,
+                error TEXT,
+                FOREIGN KEY (aparato_id) REFERENCES aparatos (id)
+            )
+        ''')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_avisos_aparato ON avisos (aparato_id)')
+        # Solo los pendientes: lo enviado no agranda lo que se recorre
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_avisos_pendientes ON avisos (proximo_intento)
+            WHERE proximo_intento IS NOT NULL
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS aparatos_avisos_ad AFTER DELETE ON aparatos WHEN %s BEGIN
+                DELETE FROM avisos WHERE aparato_id = old.id;
+            END
+        ''' % FUERA_DE_ARCHIVO)
+
+    def create_totals_cleanup(self):
+        # Al borrar un aparato (sincronización) los triggers de diagnósticos
+        # dejaban su renglón de totales en cero. Archivar ya lo borra antes.
+        self.cursor.execute('DELETE FROM totales_aparatos WHERE aparato_id NOT IN (SELECT id FROM aparatos)')
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS aparatos_totales_ad AFTER DELETE ON aparatos BEGIN
+                DELETE FROM totales_aparatos WHERE aparato_id = old.id;
+            END
+        ''')
+
+    def create_revenue_on_delete(self):
+        # Al borrar un diagnóstico, diagnosticos_totales_bd borra antes sus
+        # líneas y diagnosticos_ingresos_au ya resta sus importes; restar
+        # old.valor después los descontaba dos veces. Como en las
+        # estadísticas de precios, se resta antes de borrar y lo que queda.
+        self.cursor.execute('DROP TRIGGER IF EXISTS diagnosticos_ingresos_ad')
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS diagnosticos_ingresos_bd BEFORE DELETE ON diagnosticos
+            WHEN old.fecha IS NOT NULL AND {condicion} BEGIN
+                DELETE FROM lineas_diagnostico WHERE diagnostico_id = old.id;
+                UPDATE ingresos_diarios SET diagnosticos = diagnosticos - 1,
+                    total = total - COALESCE((SELECT valor FROM diagnosticos WHERE id = old.id), 0)
+                WHERE dia = date(old.fecha, 'unixepoch', 'localtime');
+            END
+        '''.format(condicion=FUERA_DE_ARCHIVO))
+
+    def commit(self):
+        # Dentro de transaction() se confirma una sola vez al final
+        if self.nivel_transaccion == 0:
+            self.conn.commit()
+            self.invalidar_tablero()
+            self.notificar_cambios()
+
+    @contextmanager
+    def transaction(self):
+        # Unidad de trabajo: todo lo que se haga dentro se confirma junto
+        # o se deshace junto. Las transacciones anidadas usan savepoints.
+        self.nivel_transaccion += 1
+        savepoint = 'sp_%d' % self.nivel_transaccion
+        if self.nivel_transaccion == 1:
+            if not self.conn.in_transaction:
+                self.conn.execute('BEGIN')
+        else:
+            self.conn.execute('SAVEPOINT ' + savepoint)
+        try:
+            yield self
+        except BaseException:
+            if self.nivel_transaccion == 1:
+                self.conn.rollback()
+                self.cache_detalles.clear()
+                self.cambiados = set()
+            else:
+                self.conn.execute('ROLLBACK TO ' + savepoint)
+                self.cache_detalles.clear()
+                self.conn.execute('RELEASE ' + savepoint)
+            raise
+        else:
+            if self.nivel_transaccion == 1:
+                self.conn.commit()
+                self.invalidar_tablero()
+            else:
+                self.conn.execute('RELEASE ' + savepoint)
+        finally:
+            self.nivel_transaccion -= 1
+        if self.nivel_transaccion == 0:
+            self.notificar_cambios()
+
+    def insert_aparato(self, tipo, marca, modelo, numero_serie, problema, estado, nombre_cliente, telefono_cliente,
+                       aparato_id=None, origen=None, usuario=None):
+        # aparato_id solo se indica al importar órdenes que ya tenían número
+        with self.transaction():
+            cliente_id = self.get_cliente_id(nombre_cliente, telefono_cliente)
+            self.cursor.execute('''
+                INSERT INTO aparatos (id, tipo, marca, modelo, numero_serie, problema, estado, nombre_cliente,
+                                      telefono_cliente, cliente_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (aparato_id, tipo, marca, modelo, numero_serie, problema, estado, nombre_cliente, telefono_cliente,
+                  cliente_id))
+            aparato_id = self.cursor.lastrowid
+            self.registrar_transicion(aparato_id, None, estado, origen, usuario)
+            self.invalidar_detalle(aparato_id)
+        return aparato_id
+
+    def insert_aparatos_many(self, aparatos, origen=None, usuario=None):
+        # aparatos: tuplas (tipo, marca, modelo, numero_serie, problema, estado, nombre_cliente, telefono_cliente)
+        with self.transaction():
+            self.cursor.execute('SELECT COALESCE(MAX(id), 0) FROM aparatos')
+            ultimo_id = self.cursor.fetchone()[0]
+            self.cursor.executemany('''
+                INSERT INTO aparatos (tipo, marca, modelo, numero_serie, problema, estado, nombre_cliente, telefono_cliente)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', aparatos)
+            cantidad = self.cursor.rowcount
+            for aparato_id in range(ultimo_id + 1, ultimo_id + cantidad + 1):
+                self.invalidar_detalle(aparato_id)
+            self.vincular_clientes(ultimo_id)
+            # El ingreso de todo el lote se registra con dos sentencias
+            self.cursor.execute('''
+                INSERT INTO historial_estados (aparato_id, estado_anterior, estado_nuevo, fecha, origen, usuario)
+                SELECT id, NULL, COALESCE(estado, ''), ?, ?, ? FROM aparatos WHERE id > ?
+            ''', (time.time(), origen, usuario, ultimo_id))
+            self.cursor.execute('''
+                INSERT INTO estadisticas_estados (estado, en_cola)
+                SELECT COALESCE(estado, ''), COUNT(*) FROM aparatos WHERE id > ? GROUP BY 1
+                ON CONFLICT (estado) DO UPDATE SET en_cola = en_cola + excluded.en_cola
+            ''', (ultimo_id,))
+            self.cursor.execute('SELECT id FROM aparatos WHERE id > ? AND estado = ?', (ultimo_id, ESTADO_EN_COLA))
+            for (aparato_id,) in self.cursor.fetchall():
+                self.encolar_trabajo(aparato_id)
+        return cantidad
+
+    def insert_diagnostico(self, aparato_id, diagnostico, valor=0, lineas=()):
+        # valor queda como una línea de mano de obra; lineas: tuplas
+        # (tipo, descripcion, cantidad, precio) con tipo de TIPOS_LINEA
+        with self.transaction():
+            self.cursor.execute('''
+                INSERT INTO diagnosticos (aparato_id, diagnostico, valor, fecha)
+                VALUES (?, ?, 0, ?)
+            ''', (aparato_id, diagnostico, time.time()))
+            diagnostico_id = self.cursor.lastrowid
+            if valor:
+                self.insert_linea(aparato_id, 'mano_obra', diagnostico, 1, valor, diagnostico_id)
+            for tipo, descripcion, cantidad, precio in lineas:
+                self.insert_linea(aparato_id, tipo, descripcion, cantidad, precio, diagnostico_id)
+            self.invalidar_detalle(aparato_id)
+        return diagnostico_id
+
+    def insert_linea(self, aparato_id, tipo, descripcion, cantidad, precio, diagnostico_id=None):
+        # Sin diagnostico_id la línea se agrega al último diagnóstico del aparato
+        if tipo not in TIPOS_LINEA:
+            raise ValueError(f"Tipo de línea desconocido: {tipo}")
+        if diagnostico_id is None:
+            self.cursor.execute('SELECT ultimo_diagnostico_id FROM totales_aparatos WHERE aparato_id = ?',
+                                (aparato_id,))
+            fila = self.cursor.fetchone()
+            if fila is None or fila[0] is None:
+                raise ValueError(f"El aparato {aparato_id} no tiene diagnóstico")
+            diagnostico_id = fila[0]
+        importe = cantidad * precio
+        if tipo == 'descuento':
+            importe = -abs(importe)
+        self.cursor.execute('''
+            INSERT INTO lineas_diagnostico (diagnostico_id, aparato_id, tipo, descripcion, cantidad, precio, importe)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (diagnostico_id, aparato_id, tipo, descripcion, cantidad, precio, importe))
+        self.invalidar_detalle(aparato_id)
+        self.commit()
+        return self.cursor.lastrowid
+
+    def rebuild_totales(self):
+        # Recalcula diagnosticos.valor y totales_aparatos desde las líneas,
+        # para cargas que escriben las tablas sin pasar por los triggers.
+        # Solo toca los valores que no coinciden: los triggers de ingresos y
+        # precios corrigen la diferencia y no se anotan cambios de más.
+        with self.transaction():
+            self.cursor.execute('''
+                UPDATE diagnosticos SET valor = (
+                    SELECT COALESCE(SUM(l.importe), 0) FROM lineas_diagnostico l WHERE l.diagnostico_id = diagnosticos.id
+                )
+                WHERE valor IS NOT (
+                    SELECT COALESCE(SUM(l.importe), 0) FROM lineas_diagnostico l WHERE l.diagnostico_id = diagnosticos.id
+                )
+            ''')
+            self.cursor.execute('DELETE FROM totales_aparatos')
+            self.cursor.execute('''
+                INSERT INTO totales_aparatos (aparato_id, cantidad_diagnosticos, ultimo_diagnostico_id,
+                                              repuestos, mano_obra, impuestos, descuentos, total)
+                SELECT d.aparato_id, d.cantidad, d.ultimo, COALESCE(l.repuestos, 0), COALESCE(l.mano_obra, 0),
+                       COALESCE(l.impuestos, 0), COALESCE(l.descuentos, 0), COALESCE(l.total, 0)
+                FROM (SELECT aparato_id, COUNT(*) AS cantidad, MAX(id) AS ultimo FROM diagnosticos GROUP BY 1) d
+                LEFT JOIN (
+                    SELECT aparato_id,
+                           SUM(CASE tipo WHEN 'repuesto' THEN importe ELSE 0 END) AS repuestos,
+                           SUM(CASE tipo WHEN 'mano_obra' THEN importe ELSE 0 END) AS mano_obra,
+                           SUM(CASE tipo WHEN 'impuesto' THEN importe ELSE 0 END) AS impuestos,
+                           SUM(CASE tipo WHEN 'descuento' THEN importe ELSE 0 END) AS descuentos,
+                           SUM(importe) AS total
+                    FROM lineas_diagnostico GROUP BY 1
+                ) l ON l.aparato_id = d.aparato_id
+            ''')
+            self.invalidar_detalle()
+
+    def get_aparato(self, aparato_id):
+        self.cursor.execute('SELECT * FROM aparatos WHERE id = ?', (aparato_id,))
+        return self.cursor.fetchone()
+
+    def get_aparato_id_por_serie(self, numero_serie):
+        # Usa idx_aparatos_numero_serie; si el aparato volvió varias veces
+        # se toma el ingreso más reciente
+        self.cursor.execute('SELECT id FROM aparatos WHERE numero_serie = ? ORDER BY id DESC LIMIT 1',
+                            (numero_serie,))
+        fila = self.cursor.fetchone()
+        return fila[0] if fila else None
+
+    def get_diagnostico(self, aparato_id):
+        # El más reciente, si el aparato tiene varios
+        self.cursor.execute('SELECT * FROM diagnosticos WHERE aparato_id = ? ORDER BY id DESC LIMIT 1', (aparato_id,))
+        return self.cursor.fetchone()
+
+    def get_lineas_aparato(self, aparato_id):
+        # Líneas de todos los diagnósticos del aparato, en orden de carga
+        self.cursor.execute('''
+            SELECT diagnostico_id, tipo, descripcion, cantidad, precio, importe
+            FROM lineas_diagnostico WHERE aparato_id = ? ORDER BY id
+        ''', (aparato_id,))
+        return self.cursor.fetchall()
+
+    def get_aparato_detalle(self, aparato_id):
+        # Una sola consulta por aparato; los totales vienen ya calculados de
+        # totales_aparatos. Se repite desde la caché mientras ningún método
+        # de escritura lo modifique ni otra conexión escriba en la base
+        self.revisar_version_datos()
+        detalle = self.cache_detalles.get(aparato_id)
+        if detalle is not None:
+            self.cache_detalles.move_to_end(aparato_id)
+            return detalle
+        self.cursor.execute('''
+            SELECT a.id, a.tipo, a.marca, a.modelo, a.numero_serie, a.problema, a.estado,
+                   a.nombre_cliente, a.telefono_cliente, a.observaciones,
+                   d.diagnostico, d.valor,
+                   COALESCE(t.cantidad_diagnosticos, 0), COALESCE(t.total, 0),
+                   COALESCE(t.repuestos, 0), COALESCE(t.mano_obra, 0),
+                   COALESCE(t.impuestos, 0), COALESCE(t.descuentos, 0),
+                   (SELECT COUNT(*) FROM adjuntos f WHERE f.aparato_id = a.id)
+            FROM aparatos a
+            LEFT JOIN totales_aparatos t ON t.aparato_id = a.id
+            LEFT JOIN diagnosticos d ON d.id = t.ultimo_diagnostico_id
+            WHERE a.id = ?
+        ''', (aparato_id,))
+        fila = self.cursor.fetchone()
+        if fila is None:
+            return None
+        detalle = DetalleAparato(*fila)
+        self.cache_detalles[aparato_id] = detalle
+        if len(self.cache_detalles) > TAMANO_CACHE_DETALLES:
+            self.cache_detalles.popitem(last=False)
+        return detalle
+
+    def revisar_version_datos(self):
+        # PRAGMA data_version cambia cuando otra conexión confirma algo (la
+        # API, una importación, la sincronización): lo que hay en la caché
+        # pudo quedar viejo
+        version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        if version != self.version_datos:
+            self.version_datos = version
+            self.cache_detalles.clear()
+
+    def invalidar_detalle(self, aparato_id=None):
+        # Lo llaman todos los métodos que modifican un aparato: además de
+        # la caché, anota el cambio para los oyentes
+        if aparato_id is None:
+            self.cache_detalles.clear()
+            self.cambiados = None
+        else:
+            self.cache_detalles.pop(aparato_id, None)
+            if self.cambiados is not None:
+                self.cambiados.add(aparato_id)
+        if not self.conn.in_transaction:
+            # Fuera de una transacción (otra conexión cambió la base)
+            self.notificar_cambios()
+
+    def notificar_cambios(self):
+        if self.cambiados is not None and not self.cambiados:
+            return
+        cambiados, self.cambiados = self.cambiados, set()
+        for oyente in self.oyentes:
+            oyente(frozenset(cambiados) if cambiados is not None else None)
+
+    def registrar_transicion(self, aparato_id, estado_anterior, estado_nuevo, origen=None, usuario=None):
+        # Se llama dentro de la misma transacción que modifica aparatos.estado.
+        # estado_anterior None = el aparato recién ingresa.
+        ahora = time.time()
+        estado_nuevo = estado_nuevo or ''
+        if estado_anterior is not None:
+            self.cursor.execute('SELECT fecha FROM historial_estados WHERE aparato_id = ? ORDER BY id DESC LIMIT 1',
+                                (aparato_id,))
+            fila = self.cursor.fetchone()
+            # Sin historial previo (aparatos anteriores a esta tabla) no se
+            # sabe desde cuándo estaba en el estado: solo se descuenta de la cola
+            self.cursor.execute('''
+                UPDATE estadisticas_estados
+                SET en_cola = en_cola - 1, salidas = salidas + ?, segundos_total = segundos_total + ?
+                WHERE estado = ?
+            ''', (1 if fila else 0, ahora - fila[0] if fila else 0, estado_anterior or ''))
+        self.cursor.execute('''
+            INSERT INTO estadisticas_estados (estado, en_cola) VALUES (?, 1)
+            ON CONFLICT (estado) DO UPDATE SET en_cola = en_cola + 1
+        ''', (estado_nuevo,))
+        self.cursor.execute('''
+            INSERT INTO historial_estados (aparato_id, estado_anterior, estado_nuevo, fecha, origen, usuario)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (aparato_id, estado_anterior, estado_nuevo, ahora, origen, usuario))
+        self.seguir_cola(aparato_id, estado_anterior, estado_nuevo, usuario)
+
+    def seguir_cola(self, aparato_id, estado_anterior, estado_nuevo, usuario=None):
+        # La cola de trabajos acompaña cada cambio de estado, venga de donde
+        # venga (pantallas, API, importación, sincronización)
+        if estado_nuevo == ESTADO_EN_COLA:
+            self.encolar_trabajo(aparato_id)
+        elif estado_nuevo == ESTADO_EN_TRABAJO:
+            # Sin pasar por "tomar siguiente": lo toma quien lo cambió
+            self.cursor.execute('SELECT 1 FROM trabajos WHERE aparato_id = ? AND terminado IS NULL '
+                                'AND tecnico_id IS NULL', (aparato_id,))
+            if self.cursor.fetchone():
+                self.tomar_trabajo(self.get_tecnico_id(usuario or 'Sin asignar'), aparato_id)
+        elif estado_nuevo in ESTADOS_TERMINADOS:
+            self.terminar_trabajo(aparato_id)
+        elif estado_anterior is not None:
+            self.quitar_trabajo(aparato_id)
+
+    def cambiar_estado_fila(self, aparato_id, nuevo_estado, origen, usuario, avisar=False):
+        # avisar: encolar el aviso al cliente del nuevo estado, si tiene; la
+        # sincronización no avisa (ya avisó la sucursal que lo cambió)
+        self.cursor.execute('SELECT estado FROM aparatos WHERE id = ?', (aparato_id,))
+        fila = self.cursor.fetchone()
+        if fila is None:
+            return False
+        if (fila[0] or '') != (nuevo_estado or ''):
+            self.cursor.execute('UPDATE aparatos SET estado = ? WHERE id = ?', (nuevo_estado, aparato_id))
+            self.registrar_transicion(aparato_id, fila[0] or '', nuevo_estado, origen, usuario)
+            if avisar and nuevo_estado in MENSAJES_AVISOS:
+                self.insert_aviso(aparato_id, nuevo_estado)
+        return True
+
+    def update_estado(self, aparato_id, nuevo_estado, origen=None, usuario=None):
+        # origen: pantalla o cliente que hizo el cambio; queda en el historial
+        with self.transaction():
+            self.cambiar_estado_fila(aparato_id, nuevo_estado, origen, usuario, avisar=True)
+            self.invalidar_detalle(aparato_id)
+
+    def update_estado_many(self, cambios, origen=None, usuario=None):
+        # cambios: pares (aparato_id, nuevo_estado)
+        with self.transaction():
+            cantidad = 0
+            for aparato_id, estado in cambios:
+                cantidad += self.cambiar_estado_fila(aparato_id, estado, origen, usuario, avisar=True)
+                self.invalidar_detalle(aparato_id)
+        return cantidad
+
+    def get_historial_estados(self, aparato_id):
+        self.cursor.execute('''
+            SELECT estado_anterior, estado_nuevo, fecha, origen, usuario
+            FROM historial_estados WHERE aparato_id = ? ORDER BY id
+        ''', (aparato_id,))
+        return self.cursor.fetchall()
+
+    def get_estadisticas_estados(self):
+        # (estado, aparatos en cola, salidas, segundos promedio en el estado);
+        # el promedio es None si todavía ningún aparato salió del estado
+        self.cursor.execute('''
+            SELECT estado, en_cola, salidas, segundos_total / NULLIF(salidas, 0)
+            FROM estadisticas_estados ORDER BY en_cola DESC, estado
+        ''')
+        return self.cursor.fetchall()
+
+    def rebuild_estadisticas_estados(self):
+        # Recalcula los totales por estado desde aparatos y el historial, para
+        # cargas masivas que escriben las tablas directamente
+        with self.transaction():
+            self.cursor.execute('DELETE FROM estadisticas_estados')
+            self.cursor.execute('''
+                INSERT INTO estadisticas_estados (estado, en_cola)
+                SELECT COALESCE(estado, ''), COUNT(*) FROM aparatos GROUP BY 1
+            ''')
+            # Cada fila del historial dura hasta la siguiente del mismo aparato
+            self.cursor.execute('''
+                INSERT INTO estadisticas_estados (estado, salidas, segundos_total)
+                SELECT estado_nuevo, COUNT(*), SUM(siguiente - fecha) FROM (
+                    SELECT estado_nuevo, fecha,
+                           LEAD(fecha) OVER (PARTITION BY aparato_id ORDER BY id) AS siguiente
+                    FROM historial_estados
+                )
+                WHERE siguiente IS NOT NULL
+                GROUP BY estado_nuevo
+                ON CONFLICT (estado) DO UPDATE SET salidas = excluded.salidas, segundos_total = excluded.segundos_total
+            ''')
+
+    def update_observaciones(self, aparato_id, observaciones):
+        self.cursor.execute('UPDATE aparatos SET observaciones = ? WHERE id = ?', (observaciones, aparato_id))
+        self.invalidar_detalle(aparato_id)
+        self.commit()
+
+    # Fotos
+
+    def insert_adjunto(self, aparato_id, hash_archivo, nombre, tamano, etapa, fecha=None):
+        if etapa not in ETAPAS_ADJUNTO:
+            raise ValueError(f"Etapa de foto desconocida: {etapa}")
+        self.cursor.execute('''
+            INSERT INTO adjuntos (aparato_id, hash, nombre, tamano, etapa, fecha) VALUES (?, ?, ?, ?, ?, ?)
+        ''', (aparato_id, hash_archivo, nombre, tamano, etapa, time.time() if fecha is None else fecha))
+        adjunto_id = self.cursor.lastrowid
+        self.invalidar_detalle(aparato_id)
+        self.commit()
+        return adjunto_id
+
+    def get_adjuntos_aparato(self, aparato_id):
+        self.cursor.execute('''
+            SELECT id, hash, nombre, tamano, etapa, fecha FROM adjuntos WHERE aparato_id = ? ORDER BY id
+        ''', (aparato_id,))
+        return self.cursor.fetchall()
+
+    def delete_adjunto(self, adjunto_id):
+        # Solo la fila; el archivo lo borra mantenimiento.py cuando ningún
+        # adjunto (tampoco los archivados) lo usa. Devuelve el aparato o None.
+        self.cursor.execute('DELETE FROM adjuntos WHERE id = ? RETURNING aparato_id', (adjunto_id,))
+        fila = self.cursor.fetchone()
+        if fila is None:
+            return None
+        self.invalidar_detalle(fila[0])
+        self.commit()
+        return fila[0]
+
+    # Avisos
+
+    def insert_aviso(self, aparato_id, estado, ahora=None):
+        # El mensaje se arma ahora, con los datos del aparato en este
+        # momento. None si el estado no tiene aviso o no hay teléfono.
+        self.cursor.execute('''
+            SELECT id, tipo, marca, modelo, nombre_cliente, telefono_cliente FROM aparatos WHERE id = ?
+        ''', (aparato_id,))
+        fila = self.cursor.fetchone()
+        if fila is None or estado not in MENSAJES_AVISOS or not normalizar_telefono(fila[5]):
+            return None
+        campos = dict(zip(('id', 'tipo', 'marca', 'modelo', 'nombre_cliente'), (valor or '' for valor in fila)))
+        # Sin dobles espacios cuando falta algún dato
+        mensaje = ' '.join(Template(MENSAJES_AVISOS[estado]).safe_substitute(campos).split())
+        ahora = time.time() if ahora is None else ahora
+        self.cursor.execute('''
+            INSERT INTO avisos (aparato_id, estado, destino, mensaje, creado, proximo_intento)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (aparato_id, estado, normalizar_telefono(fila[5]), mensaje, ahora, ahora))
+        aviso_id = self.cursor.lastrowid
+        self.commit()
+        return aviso_id
+
+    def tomar_avisos(self, limite, ahora=None, reserva=RESERVA_AVISOS, reintentos=REINTENTOS_AVISOS):
+        # Reserva hasta limite avisos vencidos, los más viejos primero, y
+        # cuenta el intento. Los que agotaron los intentos sin respuesta (el
+        # envío se cortó) quedan fallidos.
+        ahora = time.time() if ahora is None else ahora
+        with self.transaction():
+            self.cursor.execute('''
+                UPDATE avisos SET proximo_intento = NULL, error = COALESCE(error, 'sin respuesta del envío')
+                WHERE proximo_intento <= ? AND intentos >= ?
+            ''', (ahora, reintentos))
+            self.cursor.execute('''
+                UPDATE avisos SET proximo_intento = ?, intentos = intentos + 1
+                WHERE id IN (SELECT id FROM avisos WHERE proximo_intento <= ? ORDER BY proximo_intento LIMIT ?)
+                RETURNING id, aparato_id, destino, mensaje, intentos
+            ''', (ahora + reserva, ahora, limite))
+            avisos = sorted(Aviso(*fila) for fila in self.cursor.fetchall())
+        return avisos
+
+    def registrar_envios(self, enviados, fallidos, ahora=None, espera=ESPERA_REINTENTO_AVISO,
+                         reintentos=REINTENTOS_AVISOS):
+        # enviados: ids; fallidos: pares (id, error). Cada fallido vuelve a
+        # intentarse tras espera * 2^(intentos - 1) segundos, con una parte
+        # al azar para que los de un mismo lote no vuelvan juntos
+        ahora = time.time() if ahora is None else ahora
+        with self.transaction():
+            self.cursor.executemany('''
+                UPDATE avisos SET proximo_intento = NULL, enviado = ?, error = NULL WHERE id = ?
+            ''', [(ahora, aviso_id) for aviso_id in enviados])
+            self.cursor.executemany('''
+                UPDATE avisos SET error = ?,
+                    proximo_intento = CASE WHEN intentos >= ? THEN NULL
+                        ELSE ? + ? * (1 << (intentos - 1)) * (0.5 + (abs(random()) % 1000) / 2000.0) END
+                WHERE id = ?
+            ''', [(str(error), reintentos, ahora, espera, aviso_id) for aviso_id, error in fallidos])
+
+    def get_proximo_aviso(self):
+        # Cuándo vence el próximo aviso pendiente (None: no hay)
+        self.cursor.execute('SELECT MIN(proximo_intento) FROM avisos WHERE proximo_intento IS NOT NULL')
+        return self.cursor.fetchone()[0]
+
+    def get_avisos_aparato(self, aparato_id):
+        self.cursor.execute('''
+            SELECT id, estado, destino, mensaje, creado, proximo_intento, intentos, enviado, error
+            FROM avisos WHERE aparato_id = ? ORDER BY id
+        ''', (aparato_id,))
+        return self.cursor.fetchall()
+
+    # Clientes
+
+    def get_cliente_id(self, nombre, telefono):
+        # El cliente con ese teléfono y nombre (normalizados), creado si es
+        # nuevo; None si no hay ni nombre ni teléfono
+        telefono, clave = normalizar_telefono(telefono), normalizar_nombre(nombre)
+        if not telefono and not clave:
+            return None
+        with self.transaction():
+            self.cursor.execute('''
+                INSERT INTO clientes (nombre, telefono, nombre_clave) VALUES (?, ?, ?)
+                ON CONFLICT (telefono, nombre_clave) DO NOTHING
+            ''', (' '.join((nombre or '').split()), telefono, clave))
+            self.cursor.execute('SELECT id FROM clientes WHERE telefono = ? AND nombre_clave = ?', (telefono, clave))
+            return self.cursor.fetchone()[0]
+
+    def vincular_clientes(self, after_id=0):
+        # Asigna cliente a los aparatos que no tienen (id > after_id) con dos
+        # sentencias para todo el lote: crea los clientes que falten, con el
+        # nombre como se escribió en su aparato más reciente, y los enlaza
+        with self.transaction():
+            self.cursor.execute('''
+                INSERT INTO clientes (nombre, telefono, nombre_clave)
+                SELECT nombre, telefono, clave FROM (
+                    SELECT TRIM(COALESCE(nombre_cliente, '')) AS nombre, normalizar_telefono(telefono_cliente) AS telefono,
+                           normalizar_nombre(nombre_cliente) AS clave, MAX(id)
+                    FROM aparatos
+                    WHERE cliente_id IS NULL AND id > ?
+                    GROUP BY 2, 3
+                )
+                WHERE telefono != '' OR clave != ''
+                ON CONFLICT (telefono, nombre_clave) DO NOTHING
+            ''', (after_id,))
+            self.cursor.execute('''
+                UPDATE aparatos SET cliente_id = (
+                    SELECT c.id FROM clientes c
+                    WHERE c.telefono = normalizar_telefono(aparatos.telefono_cliente)
+                      AND c.nombre_clave = normalizar_nombre(aparatos.nombre_cliente)
+                )
+                WHERE cliente_id IS NULL AND id > ?
+            ''', (after_id,))
+            return self.cursor.rowcount
+
+    def buscar_clientes(self, texto, limit=10):
+        # Autocompletar del registro: prefijo del teléfono si se escriben
+        # solo números, si no prefijo del nombre. Con la cantidad de aparatos
+        # de cada uno.
+        if any(c.isalpha() for c in texto):
+            columna, prefijo = 'nombre_clave', normalizar_nombre(texto)
+        else:
+            columna, prefijo = 'telefono', normalizar_telefono(texto)
+        if not prefijo:
+            return []
+        self.cursor.execute('''
+            SELECT c.id, c.nombre, c.telefono, (SELECT COUNT(*) FROM aparatos a WHERE a.cliente_id = c.id)
+            FROM clientes c
+            WHERE c.%s >= ? AND c.%s < ?
+            ORDER BY c.%s
+            LIMIT ?
+        ''' % (columna, columna, columna), (prefijo, fin_de_prefijo(prefijo), limit))
+        return self.cursor.fetchall()
+
+    def get_cliente(self, cliente_id):
+        self.cursor.execute('SELECT id, nombre, telefono FROM clientes WHERE id = ?', (cliente_id,))
+        return self.cursor.fetchone()
+
+    def get_aparatos_cliente(self, cliente_id, limit=100):
+        # Los más recientes primero, por idx_aparatos_cliente
+        self.cursor.execute('''
+            SELECT id, tipo, marca, modelo, estado FROM aparatos
+            WHERE cliente_id = ?
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (cliente_id, limit))
+        return self.cursor.fetchall()
+
+    def get_aparatos_filas(self, ids):
+        # Las filas de la tabla del menú para esos aparatos (los que ya no
+        # existen no vuelven)
+        ids = list(ids)
+        filas = []
+        for desde in range(0, len(ids), 500):
+            lote = ids[desde:desde + 500]
+            self.cursor.execute('SELECT id, tipo, marca FROM aparatos WHERE id IN (%s)' % ', '.join('?' * len(lote)),
+                                lote)
+            filas.extend(self.cursor.fetchall())
+        return filas
+
+    def get_all_aparatos(self):
+        self.cursor.execute('SELECT id, tipo, marca FROM aparatos')
+        return self.cursor.fetchall()       
+
+    def get_aparatos_page(self, after_id=0, limit=100):
+        # Paginación por clave: usa el índice del id, no recorre las filas anteriores
+        self.cursor.execute('''
+            SELECT id, tipo, marca FROM aparatos
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+        ''', (after_id, limit))
+        return self.cursor.fetchall()
+
+    # Cola de trabajos. ahora (segundos) solo lo indica el simulador; por
+    # defecto es la hora actual
+
+    def get_tecnico_id(self, nombre):
+        # Creado si es nuevo
+        with self.transaction():
+            self.cursor.execute('INSERT INTO tecnicos (nombre) VALUES (?) ON CONFLICT (nombre) DO NOTHING', (nombre,))
+            self.cursor.execute('SELECT id FROM tecnicos WHERE nombre = ?', (nombre,))
+            return self.cursor.fetchone()[0]
+
+    def get_politica_trabajos(self):
+        self.cursor.execute("SELECT valor FROM ajustes WHERE clave = 'politica_trabajos'")
+        fila = self.cursor.fetchone()
+        return fila[0] if fila and fila[0] in POLITICAS_TRABAJOS else POLITICA_TRABAJOS_POR_DEFECTO
+
+    def cambiar_politica_trabajos(self, politica):
+        if politica not in POLITICAS_TRABAJOS:
+            raise ValueError(f"Política de trabajos desconocida: {politica}")
+        with self.transaction():
+            self.cursor.execute("UPDATE ajustes SET valor = ? WHERE clave = 'politica_trabajos'", (politica,))
+            self.reordenar_trabajos()
+
+    def reordenar_trabajos(self, condicion='1', parametros=()):
+        # Recalcula clave con la política vigente en los pendientes que
+        # cumplan la condición
+        self.cursor.execute('UPDATE trabajos SET clave = %s WHERE terminado IS NULL AND tecnico_id IS NULL AND %s'
+                            % (POLITICAS_TRABAJOS[self.get_politica_trabajos()], condicion), parametros)
+
+    def estimar_esfuerzo(self, tipo, marca):
+        # Segundos promedio de las reparaciones de ese tipo y marca; con
+        # pocas, los del tipo, y si tampoco, los de todo el taller
+        self.cursor.execute('''
+            SELECT SUM(CASE WHEN marca = ? THEN reparaciones END), SUM(CASE WHEN marca = ? THEN segundos_total END),
+                   SUM(reparaciones), SUM(segundos_total)
+            FROM esfuerzos_modelos WHERE tipo = ?
+        ''', (marca or '', marca or '', tipo or ''))
+        del_modelo, segundos_modelo, del_tipo, segundos_tipo = self.cursor.fetchone()
+        if (del_modelo or 0) >= MINIMO_REPARACIONES:
+            return segundos_modelo / del_modelo
+        if (del_tipo or 0) >= MINIMO_REPARACIONES:
+            return segundos_tipo / del_tipo
+        self.cursor.execute('SELECT reparaciones, segundos_total FROM esfuerzos_modelos WHERE tipo = ? AND marca = ?',
+                            TODO_EL_TALLER)
+        fila = self.cursor.fetchone()
+        if fila and fila[0] >= MINIMO_REPARACIONES:
+            return fila[1] / fila[0]
+        return ESFUERZO_POR_DEFECTO
+
+    def sumar_esfuerzo(self, aparato_id, segundos):
+        self.cursor.execute("SELECT COALESCE(tipo, ''), COALESCE(marca, '') FROM aparatos WHERE id = ?",
+                            (aparato_id,))
+        fila = self.cursor.fetchone()
+        for tipo, marca in ([fila] if fila else []) + [TODO_EL_TALLER]:
+            self.cursor.execute('''
+                INSERT INTO esfuerzos_modelos (tipo, marca, reparaciones, segundos_total) VALUES (?, ?, 1, ?)
+                ON CONFLICT (tipo, marca) DO UPDATE SET
+                    reparaciones = reparaciones + 1, segundos_total = segundos_total + excluded.segundos_total
+            ''', (tipo, marca, segundos))
+
+    def rebuild_esfuerzos(self):
+        # Desde el historial: cada paso por ESTADO_EN_TRABAJO cuenta como una
+        # reparación de lo que duró. Para bases anteriores a la cola y
+        # cargas masivas que escriben las tablas directamente.
+        with self.transaction():
+            self.cursor.execute('DELETE FROM esfuerzos_modelos')
+            self.cursor.execute('''
+                INSERT INTO esfuerzos_modelos (tipo, marca, reparaciones, segundos_total)
+                SELECT COALESCE(a.tipo, ''), COALESCE(a.marca, ''), COUNT(*), SUM(r.siguiente - r.fecha)
+                FROM (
+                    SELECT aparato_id, estado_nuevo, fecha,
+                           LEAD(fecha) OVER (PARTITION BY aparato_id ORDER BY id) AS siguiente
+                    FROM historial_estados
+                ) r
+                JOIN aparatos a ON a.id = r.aparato_id
+                WHERE r.estado_nuevo = ? AND r.siguiente IS NOT NULL
+                GROUP BY 1, 2
+            ''', (ESTADO_EN_TRABAJO,))
+            self.cursor.execute('''
+                INSERT INTO esfuerzos_modelos (tipo, marca, reparaciones, segundos_total)
+                SELECT ?, ?, COALESCE(SUM(reparaciones), 0), COALESCE(SUM(segundos_total), 0) FROM esfuerzos_modelos
+            ''', TODO_EL_TALLER)
+
+    def encolar_trabajo(self, aparato_id, fecha_prometida=None, prioridad=None, ahora=None):
+        # prioridad None: la del cliente. Si el aparato ya pasó por la cola
+        # (se volvió a aprobar) empieza de nuevo. False si no existe.
+        ahora = time.time() if ahora is None else ahora
+        self.cursor.execute('''
+            SELECT a.tipo, a.marca, COALESCE(c.prioridad, 0)
+            FROM aparatos a LEFT JOIN clientes c ON c.id = a.cliente_id
+            WHERE a.id = ?
+        ''', (aparato_id,))
+        fila = self.cursor.fetchone()
+        if fila is None:
+            return False
+        tipo, marca, prioridad_cliente = fila
+        with self.transaction():
+            self.cursor.execute('''
+                INSERT INTO trabajos (aparato_id, prioridad, ingreso, fecha_prometida, esfuerzo, clave)
+                VALUES (?, ?, ?, ?, ?, 0)
+                ON CONFLICT (aparato_id) DO UPDATE SET
+                    prioridad = excluded.prioridad, ingreso = excluded.ingreso,
+                    fecha_prometida = excluded.fecha_prometida, esfuerzo = excluded.esfuerzo,
+                    tecnico_id = NULL, tomado = NULL, terminado = NULL
+            ''', (aparato_id, prioridad_cliente if prioridad is None else prioridad, ahora,
+                  ahora + DIAS_PROMETIDOS * 86400 if fecha_prometida is None else fecha_prometida,
+                  self.estimar_esfuerzo(tipo, marca)))
+            self.reordenar_trabajos('aparato_id = ?', (aparato_id,))
+        return True
+
+    def encolar_pendientes(self):
+        # Los aparatos en ESTADO_EN_COLA sin trabajo (anteriores a la cola o
+        # cargados directamente en las tablas), desde que llegaron al estado
+        with self.transaction():
+            self.cursor.execute('''
+                SELECT a.id, (SELECT MAX(h.fecha) FROM historial_estados h WHERE h.aparato_id = a.id)
+                FROM aparatos a
+                WHERE a.estado = ? AND NOT EXISTS (SELECT 1 FROM trabajos t WHERE t.aparato_id = a.id)
+            ''', (ESTADO_EN_COLA,))
+            pendientes = self.cursor.fetchall()
+            for aparato_id, desde in pendientes:
+                self.encolar_trabajo(aparato_id, ahora=desde)
+        return len(pendientes)
+
+    def quitar_trabajo(self, aparato_id):
+        # Sale de la cola sin terminarse (se revocó la aprobación)
+        with self.transaction():
+            self.cursor.execute('DELETE FROM trabajos WHERE aparato_id = ? AND terminado IS NULL', (aparato_id,))
+            return self.cursor.rowcount > 0
+
+    def tomar_trabajo(self, tecnico_id, aparato_id=None, ahora=None):
+        # El primero de la cola (o ese aparato, si está pendiente) pasa al
+        # técnico; devuelve su id o None si no hay. Es una sola sentencia:
+        # dos mostradores nunca toman el mismo.
+        ahora = time.time() if ahora is None else ahora
+        if aparato_id is None:
+            condicion, parametros = '''aparato_id = (
+                SELECT aparato_id FROM trabajos WHERE terminado IS NULL AND tecnico_id IS NULL
+                ORDER BY clave, aparato_id LIMIT 1
+            )''', ()
+        else:
+            condicion, parametros = 'aparato_id = ? AND terminado IS NULL AND tecnico_id IS NULL', (aparato_id,)
+        with self.transaction():
+            self.cursor.execute('UPDATE trabajos SET tecnico_id = ?, tomado = ? WHERE %s RETURNING aparato_id'
+                                % condicion, (tecnico_id, ahora) + parametros)
+            filas = self.cursor.fetchall()
+        return filas[0][0] if filas else None
+
+    def terminar_trabajo(self, aparato_id, ahora=None):
+        # Lo que tardó desde que se tomó entra en el esfuerzo de su tipo y
+        # marca. False si el aparato no tenía trabajo abierto.
+        ahora = time.time() if ahora is None else ahora
+        with self.transaction():
+            self.cursor.execute('UPDATE trabajos SET terminado = ? WHERE aparato_id = ? AND terminado IS NULL '
+                                'RETURNING tomado', (ahora, aparato_id))
+            filas = self.cursor.fetchall()
+            if filas and filas[0][0] is not None:
+                self.sumar_esfuerzo(aparato_id, ahora - filas[0][0])
+        return bool(filas)
+
+    def get_cola_trabajos(self, limit=50):
+        # Pendientes en el orden en que se van a tomar
+        self.cursor.execute('''
+            SELECT t.aparato_id, a.tipo, a.marca, t.prioridad, t.fecha_prometida, t.esfuerzo
+            FROM trabajos t JOIN aparatos a ON a.id = t.aparato_id
+            WHERE t.terminado IS NULL AND t.tecnico_id IS NULL
+            ORDER BY t.clave, t.aparato_id
+            LIMIT ?
+        ''', (limit,))
+        return self.cursor.fetchall()
+
+    def get_trabajos_tecnico(self, tecnico_id):
+        # Los que el técnico tiene en curso, del más antiguo al más nuevo
+        self.cursor.execute('''
+            SELECT t.aparato_id, a.tipo, a.marca, t.fecha_prometida, t.tomado
+            FROM trabajos t JOIN aparatos a ON a.id = t.aparato_id
+            WHERE t.tecnico_id = ? AND t.terminado IS NULL
+            ORDER BY t.tomado
+        ''', (tecnico_id,))
+        return self.cursor.fetchall()
+
+    def update_prioridad_cliente(self, cliente_id, prioridad):
+        # También reordena los aparatos del cliente que esperan en la cola
+        with self.transaction():
+            self.cursor.execute('UPDATE clientes SET prioridad = ? WHERE id = ?', (prioridad, cliente_id))
+            cantidad = self.cursor.rowcount
+            condicion = 'aparato_id IN (SELECT id FROM aparatos WHERE cliente_id = ?)'
+            self.cursor.execute('UPDATE trabajos SET prioridad = ? WHERE terminado IS NULL AND tecnico_id IS NULL AND '
+                                + condicion, (prioridad, cliente_id))
+            self.reordenar_trabajos(condicion, (cliente_id,))
+        return cantidad
+
+    # Precios sugeridos
+
+    def rebuild_precios(self):
+        # Recalcula las estadísticas de precios desde diagnosticos; después
+        # las mantienen los triggers. Lo ya archivado no está: se pierde
+        with self.transaction():
+            for tabla in ('precios_modelos', 'precios_cubetas', 'diagnosticos_modelos'):
+                self.cursor.execute('DELETE FROM %s' % tabla)
+            origen = 'FROM diagnosticos d JOIN aparatos a ON a.id = d.aparato_id, %s' % NIVELES_PRECIO
+            self.cursor.execute('''
+                INSERT INTO precios_modelos (tipo, marca, modelo, cantidad, suma, suma_cuadrados)
+                SELECT %s, COUNT(*), SUM(d.valor), SUM(d.valor * d.valor) %s
+                WHERE d.valor > 0 GROUP BY 1, 2, 3
+            ''' % (CLAVES_PRECIO, origen))
+            self.cursor.execute('''
+                INSERT INTO precios_cubetas (tipo, marca, modelo, cubeta, cantidad)
+                SELECT %s, %s, COUNT(*) %s
+                WHERE d.valor > 0 GROUP BY 1, 2, 3, 4
+            ''' % (CLAVES_PRECIO, CUBETA_PRECIO.format(valor='d.valor'), origen))
+            self.cursor.execute('''
+                INSERT INTO diagnosticos_modelos (tipo, marca, modelo, diagnostico, cantidad)
+                SELECT %s, TRIM(d.diagnostico), COUNT(*) %s
+                WHERE TRIM(COALESCE(d.diagnostico, '')) != '' GROUP BY 1, 2, 3, 4
+            ''' % (CLAVES_PRECIO, origen))
+
+    def estimar_precio(self, tipo, marca, modelo, diagnosticos=3):
+        # Del nivel más preciso con al menos MINIMO_PRECIOS diagnósticos con
+        # valor, o None si ni el tipo los tiene. Lee unos pocos renglones por
+        # clave primaria: no depende de cuántos diagnósticos haya.
+        self.cursor.execute('''
+            SELECT tipo, marca, modelo, cantidad, suma, suma_cuadrados FROM precios_modelos
+            WHERE tipo = UPPER(TRIM(?1))
+              AND (marca, modelo) IN (VALUES (UPPER(TRIM(?2)), UPPER(TRIM(?3))), (UPPER(TRIM(?2)), '*'), ('*', '*'))
+              AND cantidad >= ?4
+        ''', (tipo or '', marca or '', modelo or '', MINIMO_PRECIOS))
+        filas = self.cursor.fetchall()
+        if not filas:
+            return None
+        tipo, marca, modelo, cantidad, suma, suma_cuadrados = min(filas, key=lambda f: (f[2] == TODOS, f[1] == TODOS))
+        self.cursor.execute('''
+            SELECT cubeta, cantidad FROM precios_cubetas
+            WHERE tipo = ? AND marca = ? AND modelo = ? AND cantidad > 0
+            ORDER BY cubeta
+        ''', (tipo, marca, modelo))
+        p25, mediana, p75 = cuantiles_cubetas(self.cursor.fetchall(), (0.25, 0.5, 0.75))
+        self.cursor.execute('''
+            SELECT diagnostico, cantidad FROM diagnosticos_modelos
+            WHERE tipo = ? AND marca = ? AND modelo = ? AND cantidad > 0
+            ORDER BY cantidad DESC
+            LIMIT ?
+        ''', (tipo, marca, modelo, diagnosticos))
+        promedio = suma / cantidad
+        return EstimacionPrecio(
+            'modelo' if modelo != TODOS else 'marca' if marca != TODOS else 'tipo', cantidad, promedio,
+            max(suma_cuadrados / cantidad - promedio * promedio, 0) ** 0.5, p25, mediana, p75,
+            self.cursor.fetchall())
+
+    # Tablero: agregaciones sobre la conexión de lectura del hilo que las
+    # pide, guardadas TTL_TABLERO segundos o hasta la próxima escritura
+
+    def invalidar_tablero(self):
+        self.generacion_datos += 1
+        self.cache_tablero.clear()
+
+    def consultar_tablero(self, clave, sql, parametros=()):
+        ahora = time.monotonic()
+        guardado = self.cache_tablero.get(clave)
+        if guardado is not None and guardado[0] > ahora and guardado[1] == self.generacion_datos:
+            return guardado[2]
+        generacion = self.generacion_datos
+        filas = self.read_connection().execute(sql, parametros).fetchall()
+        # Si hubo una escritura mientras se calculaba, el resultado no se guarda
+        if generacion == self.generacion_datos:
+            self.cache_tablero[clave] = (ahora + TTL_TABLERO, generacion, filas)
+        return filas
+
+    def get_aparatos_por_estado(self):
+        # (estado, aparatos en cola, segundos promedio en el estado); sale de
+        # estadisticas_estados, una fila por estado
+        return self.consultar_tablero('por_estado', '''
+            SELECT estado, en_cola, segundos_total / NULLIF(salidas, 0)
+            FROM estadisticas_estados WHERE en_cola > 0 OR salidas > 0
+            ORDER BY en_cola DESC, estado
+        ''')
+
+    def get_ingresos_por_periodo(self, periodo='dia', cantidad=None, hasta=None):
+        # (período, diagnósticos, suma de valor) de los últimos `cantidad`
+        # períodos; lee ingresos_diarios, un renglón por día
+        expresion, por_defecto, segundos = PERIODOS_TABLERO[periodo]
+        hasta = time.time() if hasta is None else hasta
+        desde = hasta - (cantidad or por_defecto) * segundos
+        # La clave se redondea al minuto para que el TTL sirva entre llamadas
+        return self.consultar_tablero(('ingresos', periodo, cantidad, int(hasta // 60)), '''
+            SELECT %s AS periodo, SUM(diagnosticos), SUM(total)
+            FROM ingresos_diarios
+            WHERE dia > date(?, 'unixepoch', 'localtime') AND dia <= date(?, 'unixepoch', 'localtime')
+            GROUP BY periodo ORDER BY periodo
+        ''' % expresion, (desde, hasta))
+
+    def get_top_marcas(self, limit=10):
+        return self.get_top_conteos('marca', limit)
+
+    def get_top_tipos(self, limit=10):
+        return self.get_top_conteos('tipo', limit)
+
+    def get_top_conteos(self, campo, limit=10):
+        # Lee conteos_aparatos: una fila por marca o tipo distinto
+        return self.consultar_tablero(('top', campo, limit), '''
+            SELECT valor, cantidad FROM conteos_aparatos
+            WHERE campo = ? AND cantidad > 0
+            ORDER BY cantidad DESC, valor LIMIT ?
+        ''', (campo, limit))
+
+    def get_aparatos_atrasados(self, estados, ingreso_antes_de, limit=50):
+        # Aparatos en alguno de `estados` que ingresaron antes de la fecha
+        # dada, los más antiguos primero. Se filtra por idx_aparatos_estado:
+        # solo se leen los aparatos en curso, no el histórico. Los que
+        # ingresaron antes del historial de estados no tienen fecha y no salen.
+        estados = tuple(estados)
+        if not estados:
+            return []
+        return self.consultar_tablero(('atrasados', estados, int(ingreso_antes_de // 60), limit), '''
+            SELECT a.id, a.tipo, a.marca, a.estado, h.fecha
+            FROM aparatos a
+            JOIN historial_estados h ON h.aparato_id = a.id AND h.estado_anterior IS NULL
+            WHERE a.estado IN (%s) AND h.fecha < ?
+            ORDER BY h.fecha LIMIT ?
+        ''' % ', '.join('?' * len(estados)), estados + (ingreso_antes_de, limit))
+
+    # Columnas exportables de cada tabla, en el orden de la exportación
+    COLUMNAS_EXPORTACION = {
+        'aparatos': ('id', 'tipo', 'marca', 'modelo', 'numero_serie', 'problema', 'estado',
+                     'nombre_cliente', 'telefono_cliente', 'observaciones'),
+        'diagnosticos': ('id', 'aparato_id', 'diagnostico', 'valor'),
+    }
+
+    def iter_tabla(self, tabla, tamano_lote=1000):
+        # Recorre la tabla por lotes con fetchmany: la memoria no depende
+        # del tamaño de la tabla
+        columnas = self.COLUMNAS_EXPORTACION[tabla]
+        cursor = self.read_connection().cursor()
+        cursor.execute('SELECT %s FROM %s ORDER BY id' % (', '.join(columnas), tabla))
+        try:
+            while True:
+                filas = cursor.fetchmany(tamano_lote)
+                if not filas:
+                    break
+                yield from filas
+        finally:
+            cursor.close()
+
+    def search_aparatos(self, texto, limit=100):
+        return buscar_aparatos(self.cursor, texto, limit)
+
+    def read_connection(self):
+        # Conexión de solo lectura propia del hilo que la pide
+        if self.db_path == ':memory:':
+            return self.conn
+        return self.lectores.conexion()
+
+    def close(self):
+        self.lectores.close()
+        self.conn.close()
+
+
+class BuscadorAsincrono:
+    # Ejecuta las búsquedas en un hilo propio con su propia conexión de
+    # lectura. Una búsqueda nueva interrumpe la que esté en curso y solo se
+    # entrega el resultado de la última pedida. Los errores que no son la
+    # interrupción van a al_fallar(texto, error), desde el mismo hilo que
+    # entregar(texto, resultados).
+    def __init__(self, db, entregar, al_fallar, limit=100):
+        self.db = db
+        self.entregar = entregar
+        self.al_fallar = al_fallar
+        self.limit = limit
+        self.condicion = threading.Condition()
+        self.pendiente = None
+        self.generacion = 0
+        self.ocupado = False
+        self.cerrado = False
+        self.conn = None
+        self.hilo = None
+        # Una base en memoria solo existe en la conexión principal, que no
+        # se puede usar desde otro hilo: ahí se busca sin hilo
+        if db.db_path != ':memory:':
+            self.hilo = threading.Thread(target=self.trabajar, name='buscador-aparatos', daemon=True)
+            self.hilo.start()
+
+    def buscar(self, texto):
+        if self.hilo is None:
+            self.ejecutar(self.db.conn.cursor(), None, texto)
+            return
+        with self.condicion:
+            self.generacion += 1
+            self.pendiente = (self.generacion, texto)
+            if self.ocupado:
+                self.conn.interrupt()
+            self.condicion.notify()
+
+    def trabajar(self):
+        self.conn = self.db.read_connection()
+        cursor = self.conn.cursor()
+        while True:
+            with self.condicion:
+                while self.pendiente is None and not self.cerrado:
+                    self.condicion.wait()
+                if self.cerrado:
+                    break
+                generacion, texto = self.pendiente
+                self.pendiente = None
+                self.ocupado = True
+            self.ejecutar(cursor, generacion, texto)
+
+    def ejecutar(self, cursor, generacion, texto):
+        # generacion None: búsqueda sin hilo, siempre vigente
+        resultados = error = None
+        try:
+            resultados = buscar_aparatos(cursor, texto, self.limit)
+        except sqlite3.Error as e:
+            # 'interrupted': la cortó una búsqueda más nueva (o cerrar)
+            if not (isinstance(e, sqlite3.OperationalError) and str(e) == 'interrupted'):
+                error = e
+        with self.condicion:
+            self.ocupado = False
+            vigente = generacion is None or generacion == self.generacion
+        if error is not None:
+            self.al_fallar(texto, error)
+        elif resultados is not None and vigente:
+            self.entregar(texto, resultados)
+
+    def cerrar(self):
+        if self.hilo is None:
+            return
+        with self.condicion:
+            self.cerrado = True
+            if self.ocupado:
+                self.conn.interrupt()
+            self.condicion.notify()
+        self.hilo.join()
@@ -0,0 +1,214 @@
+import os
+import queue
+import threading
+import time
+from string import Template
+
+# Documentos impresos del taller: orden de ingreso, etiqueta del aparato (con
+# código de barras del ID) y factura. Se generan como PDF en un hilo aparte
+# y se dejan en una carpeta de cola (spool) que hace de impresora local.
+
+DIRECTORIO_SPOOL_POR_DEFECTO = 'spool'
+
+# Contenido del código de barras de la etiqueta; lo reconoce el lector del
+# mostrador para abrir el aparato (ver ServicioReparaciones.resolver_codigo)
+PREFIJO_ETIQUETA = 'AP'
+FORMATO_CODIGO_ETIQUETA = PREFIJO_ETIQUETA + '%06d'
+
+PLANTILLAS = {
+    'orden': Template(
+        "ORDEN DE INGRESO\n"
+        "----------------\n"
+        "ID: $id\n"
+        "Cliente: $nombre_cliente\n"
+        "Teléfono: $telefono_cliente\n"
+        "Aparato: $tipo $marca $modelo\n"
+        "Problema: $problema"
+    ),
+    'etiqueta': Template(
+        "ID: $id\n"
+        "$tipo $marca\n"
+        "$modelo"
+    ),
+    'factura': Template(
+        "FACTURA\n"
+        "-------\n"
+        "Cliente: $cliente\n"
+        "Teléfono: $telefono\n"
+        "Aparato: $aparato\n"
+        "Diagnóstico: $diagnostico\n"
+        "\n"
+        "$lineas\n"
+        "\n"
+        "Repuestos: $$$repuestos\n"
+        "Mano de obra: $$$mano_obra\n"
+        "Impuestos: $$$impuestos\n"
+        "Descuentos: $$$descuentos\n"
+        "Total: $$$valor"
+    ),
+}
+
+# (ancho, alto, tamaño de letra) en puntos PDF
+PAGINAS = {
+    'orden': (595, 842, 12),
+    'etiqueta': (200, 110, 9),
+    'factura': (595, 842, 12),
+}
+
+# Anchos de barras y espacios de Code 128; índices 103-105 son los inicios
+# A/B/C y 106 la parada
+CODE128 = (
+    '212222 222122 222221 121223 121322 131222 122213 122312 132212 221213 '
+    '221312 231212 112232 122132 122231 113222 123122 123221 223211 221132 '
+    '221231 213212 223112 312131 311222 321122 321221 312212 322112 322211 '
+    '212123 212321 232121 111323 131123 131321 112313 132113 132311 211313 '
+    '231113 231311 112133 112331 132131 113123 113321 133121 313121 211331 '
+    '231131 213113 213311 213131 311123 311321 331121 312113 312311 332111 '
+    '314111 221411 431111 111224 111422 121124 121421 141122 141221 112214 '
+    '112412 122114 122411 142112 142211 241211 221114 413111 241112 134111 '
+    '111242 121142 121241 114212 124112 124211 411212 421112 421211 212141 '
+    '214121 412121 111143 111341 131141 114113 114311 411113 411311 113141 '
+    '114131 311141 411131 211412 211214 211232 2331112'
+).split()
+INICIO_CODE128_B = 104
+PARADA_CODE128 = 106
+
+# Objetos fijos de todos los PDF: se arman una sola vez
+FUENTE_PDF = b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>'
+CATALOGO_PDF = b'<< /Type /Catalog /Pages 2 0 R >>'
+PAGINAS_PDF = b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>'
+
+
+def codigo_etiqueta(aparato_id):
+    return FORMATO_CODIGO_ETIQUETA % int(aparato_id)
+
+
+def code128_modulos(texto):
+    # Lista de anchos (barra, espacio, barra, ...) en módulos, con el
+    # dígito de control y los márgenes en blanco no incluidos
+    valores = [INICIO_CODE128_B] + [ord(c) - 32 for c in texto]
+    if any(v < 0 or v > 95 for v in valores[1:]):
+        raise ValueError(f"Carácter no imprimible en Code 128 B: {texto!r}")
+    control = (valores[0] + sum(i * v for i, v in enumerate(valores[1:], start=1))) % 103
+    anchos = []
+    for valor in valores + [control, PARADA_CODE128]:
+        anchos.extend(int(a) for a in CODE128[valor])
+    return anchos
+
+
+def escapar_pdf(texto):
+    datos = texto.encode('cp1252', errors='replace')
+    return datos.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def contenido_pagina(lineas, ancho, alto, tamano_letra, codigo=None):
+    margen = 20 if ancho < 300 else 50
+    partes = [b'BT /F1 %d Tf %d TL %d %d Td' % (tamano_letra, tamano_letra + 3, margen, alto - margen - tamano_letra)]
+    for linea in lineas:
+        partes.append(b'(' + escapar_pdf(linea) + b") '")
+    partes.append(b'ET')
+    if codigo:
+        # Código de barras al pie, escalado al ancho disponible
+        anchos = code128_modulos(codigo)
+        modulo = (ancho - 2 * margen) / sum(anchos)
+        x = margen
+        altura_barras = 30
+        for i, ancho_modulos in enumerate(anchos):
+            if i % 2 == 0:
+                partes.append(b'%.2f %d %.2f %d re' % (x, 8, ancho_modulos * modulo, altura_barras))
+            x += ancho_modulos * modulo
+        partes.append(b'f')
+    return b'\n'.join(partes)
+
+
+def generar_pdf(lineas, ancho, alto, tamano_letra, codigo=None):
+    contenido = contenido_pagina(lineas, ancho, alto, tamano_letra, codigo)
+    pagina = b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>' % (ancho, alto)
+    objetos = [CATALOGO_PDF, PAGINAS_PDF, pagina, FUENTE_PDF,
+               b'<< /Length %d >>\nstream\n' % len(contenido) + contenido + b'\nendstream']
+    salida = bytearray(b'%PDF-1.4\n')
+    posiciones = []
+    for numero, objeto in enumerate(objetos, start=1):
+        posiciones.append(len(salida))
+        salida += b'%d 0 obj\n' % numero + objeto + b'\nendobj\n'
+    inicio_xref = len(salida)
+    salida += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objetos) + 1)
+    for posicion in posiciones:
+        salida += b'%010d 00000 n \n' % posicion
+    salida += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objetos) + 1, inicio_xref)
+    return bytes(salida)
+
+
+def texto_lineas(lineas):
+    # Detalle de la factura, una línea del diagnóstico por renglón
+    nombres = {'repuesto': 'Repuesto', 'mano_obra': 'Mano de obra', 'impuesto': 'Impuesto', 'descuento': 'Descuento'}
+    return '\n'.join('%s: %s  %g x $%.2f = $%.2f' % (nombres.get(l['tipo'], l['tipo']), l['descripcion'] or '',
+                                                    l['cantidad'], l['precio'], l['importe'])
+                     for l in lineas)
+
+
+def renderizar(tipo, datos):
+    if tipo == 'factura':
+        datos = dict(datos, lineas=texto_lineas(datos.get('lineas') or ()))
+        for campo in ('repuestos', 'mano_obra', 'impuestos', 'descuentos', 'valor'):
+            if isinstance(datos.get(campo), (int, float)):
+                datos[campo] = '%.2f' % datos[campo]
+    texto = PLANTILLAS[tipo].safe_substitute({k: '' if v is None else v for k, v in datos.items()})
+    ancho, alto, tamano_letra = PAGINAS[tipo]
+    codigo = codigo_etiqueta(datos['id']) if tipo == 'etiqueta' else None
+    return generar_pdf(texto.split('\n'), ancho, alto, tamano_letra, codigo)
+
+
+class ColaImpresion:
+    # Los pedidos de impresión vuelven de inmediato; un hilo los genera y
+    # los deja en el spool. al_terminar(ruta, error) se llama desde ese hilo.
+    def __init__(self, directorio=None):
+        if directorio is None:
+            directorio = os.environ.get('REPARACIONES_SPOOL', DIRECTORIO_SPOOL_POR_DEFECTO)
+        self.directorio = directorio
+        self.pedidos = queue.Queue()
+        self.secuencia = 0
+        self.hilo = threading.Thread(target=self.trabajar, name='cola-impresion', daemon=True)
+        self.hilo.start()
+
+    def encolar(self, tipo, datos, al_terminar=None):
+        if tipo not in PLANTILLAS:
+            raise ValueError(f"Tipo de documento desconocido: {tipo}")
+        self.pedidos.put((tipo, dict(datos), al_terminar))
+
+    def trabajar(self):
+        while True:
+            pedido = self.pedidos.get()
+            if pedido is None:
+                self.pedidos.task_done()
+                break
+            tipo, datos, al_terminar = pedido
+            ruta = error = None
+            try:
+                ruta = self.guardar(tipo, datos.get('id'), renderizar(tipo, datos))
+            except Exception as e:
+                error = e
+                print(f"No se pudo imprimir {tipo}: {e}")
+            if al_terminar:
+                al_terminar(ruta, error)
+            self.pedidos.task_done()
+
+    def guardar(self, tipo, aparato_id, pdf):
+        os.makedirs(self.directorio, exist_ok=True)
+        self.secuencia += 1
+        nombre = '%s_%s_%s_%d-%04d.pdf' % (time.strftime('%Y%m%d-%H%M%S'), tipo, aparato_id,
+                                           os.getpid(), self.secuencia)
+        ruta = os.path.join(self.directorio, nombre)
+        # Escribir aparte y renombrar: la "impresora" nunca ve un archivo a medias
+        temporal = ruta + '.tmp'
+        with open(temporal, 'wb') as archivo:
+            archivo.write(pdf)
+        os.replace(temporal, ruta)
+        return ruta
+
+    def esperar(self):
+        self.pedidos.join()
+
+    def cerrar(self):
+        self.pedidos.put(None)
+        self.hilo.join()
@@ -0,0 +1,149 @@
+import argparse
+import csv
+import json
+import sys
+from contextlib import nullcontext
+
+from database import DatabaseManager
+from servicio import DatosInvalidos, leer_id, leer_valor
+
+# Importación y exportación masiva de aparatos y diagnósticos en CSV o JSONL.
+# Los archivos se procesan por lotes, sin cargarlos completos en memoria.
+#
+#   python importar_exportar.py importar aparatos historico.csv
+#   python importar_exportar.py importar diagnosticos diagnosticos.jsonl
+#   python importar_exportar.py exportar aparatos salida.csv
+#   python importar_exportar.py exportar diagnosticos -   (a la salida estándar)
+
+CAMPOS_APARATO = ('tipo', 'marca', 'modelo', 'numero_serie', 'problema', 'estado',
+                  'nombre_cliente', 'telefono_cliente')
+TAMANO_LOTE = 1000
+
+
+def detectar_formato(ruta, formato):
+    if formato:
+        return formato
+    return 'jsonl' if ruta.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def leer_registros(archivo, formato):
+    # Genera (número de línea, registro) sin leer el archivo completo
+    if formato == 'csv':
+        lector = csv.DictReader(archivo)
+        for registro in lector:
+            yield lector.line_num, registro
+    else:
+        for numero, linea in enumerate(archivo, start=1):
+            if not linea.strip():
+                continue
+            try:
+                registro = json.loads(linea)
+            except ValueError as e:
+                yield numero, DatosInvalidos(f"JSON inválido: {e}")
+                continue
+            yield numero, registro
+
+
+def texto(registro, campo):
+    valor = registro.get(campo)
+    return '' if valor is None else str(valor).strip()
+
+
+def importar_aparato(db, registro):
+    aparato_id = leer_id(texto(registro, 'id')) if texto(registro, 'id') else None
+    aparato_id = db.insert_aparato(*(texto(registro, c) for c in CAMPOS_APARATO), aparato_id=aparato_id,
+                                   origen='importacion')
+    # Un diagnóstico en la misma fila se guarda junto con el aparato
+    if texto(registro, 'diagnostico') or texto(registro, 'valor'):
+        db.insert_diagnostico(aparato_id, texto(registro, 'diagnostico'), leer_valor(texto(registro, 'valor') or 0))
+
+
+def importar_diagnostico(db, registro):
+    aparato_id = leer_id(texto(registro, 'aparato_id'))
+    if db.get_aparato(aparato_id) is None:
+        raise DatosInvalidos(f"Aparato {aparato_id} no existe")
+    db.insert_diagnostico(aparato_id, texto(registro, 'diagnostico'), leer_valor(texto(registro, 'valor') or 0))
+
+
+IMPORTADORES = {'aparatos': importar_aparato, 'diagnosticos': importar_diagnostico}
+
+
+def importar(db, tabla, archivo, formato, tamano_lote=TAMANO_LOTE, errores=sys.stderr, progreso=sys.stderr):
+    # Cada lote es una transacción; cada fila, un savepoint dentro de ella,
+    # así una fila con errores no deshace las demás
+    importador = IMPORTADORES[tabla]
+    registros = leer_registros(archivo, formato)
+    importadas = fallidas = 0
+    terminado = False
+    while not terminado:
+        with db.transaction():
+            for _ in range(tamano_lote):
+                siguiente = next(registros, None)
+                if siguiente is None:
+                    terminado = True
+                    break
+                numero, registro = siguiente
+                try:
+                    if isinstance(registro, Exception):
+                        raise registro
+                    if not isinstance(registro, dict):
+                        raise DatosInvalidos("El registro debe ser un objeto")
+                    with db.transaction():
+                        importador(db, registro)
+                    importadas += 1
+                except Exception as e:
+                    fallidas += 1
+                    print(f"Línea {numero}: {e}", file=errores)
+        print(f"{importadas} filas importadas, {fallidas} con errores", file=progreso)
+    return importadas, fallidas
+
+
+def exportar(db, tabla, archivo, formato, tamano_lote=TAMANO_LOTE):
+    columnas = db.COLUMNAS_EXPORTACION[tabla]
+    escritor = csv.writer(archivo) if formato == 'csv' else None
+    if escritor:
+        escritor.writerow(columnas)
+    cantidad = 0
+    for fila in db.iter_tabla(tabla, tamano_lote):
+        if escritor:
+            escritor.writerow(fila)
+        else:
+            archivo.write(json.dumps(dict(zip(columnas, fila)), ensure_ascii=False) + '\n')
+        cantidad += 1
+    return cantidad
+
+
+def abrir(ruta, modo):
+    if ruta == '-':
+        return nullcontext(sys.stdin if modo == 'r' else sys.stdout)
+    return open(ruta, modo, encoding='utf-8', newline='')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Importar y exportar aparatos y diagnósticos')
+    parser.add_argument('--db', default=None, help='Ruta de la base (por defecto REPARACIONES_DB o reparaciones.db)')
+    parser.add_argument('--formato', choices=('csv', 'jsonl'), default=None,
+                        help='Por defecto se deduce de la extensión del archivo')
+    parser.add_argument('--lote', type=int, default=TAMANO_LOTE, help='Filas por transacción')
+    parser.add_argument('accion', choices=('importar', 'exportar'))
+    parser.add_argument('tabla', choices=tuple(IMPORTADORES))
+    parser.add_argument('archivo', help="Ruta del archivo, o '-' para entrada/salida estándar")
+    args = parser.parse_args(argv)
+
+    db = DatabaseManager(args.db)
+    formato = detectar_formato(args.archivo, args.formato)
+    try:
+        if args.accion == 'importar':
+            with abrir(args.archivo, 'r') as archivo:
+                _, fallidas = importar(db, args.tabla, archivo, formato, args.lote)
+            return 1 if fallidas else 0
+        with abrir(args.archivo, 'w') as archivo:
+            cantidad = exportar(db, args.tabla, archivo, formato, args.lote)
+        print(f"{cantidad} filas exportadas", file=sys.stderr)
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
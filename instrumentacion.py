@@ -0,0 +1,295 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+# Mediciones del camino caliente: cada sentencia SQL (tiempo, filas y
+# cuántas sentencias ejecutó SQLite por ella), cada botón de Kivy (tiempo en el hilo principal)
+# y los cuadros que tardan más de la cuenta. Se activa con la variable
+# REPARACIONES_INSTRUMENTAR=1; se le pueden agregar "traza" (cuenta las
+# sentencias con el trace callback de sqlite3, caro en búsquedas FTS5) y
+# "panel" (lo muestra en pantalla), p. ej. REPARACIONES_INSTRUMENTAR=traza,panel.
+# Apagada no se envuelve nada y no cuesta nada.
+
+UMBRAL_CONSULTA = 0.050     # segundos; más que esto va al registro de lentas
+UMBRAL_MANEJADOR = 0.050
+UMBRAL_CUADRO = 0.100       # un cuadro así se nota como tirón
+ARCHIVO_LOG_POR_DEFECTO = 'lento.log'
+TAMANO_LOG = 1024 * 1024    # bytes por archivo antes de rotar
+ARCHIVOS_LOG = 3            # lento.log.1 ... lento.log.3
+INTERVALO_PANEL = 0.5
+
+# Eventos de Kivy que se miden como manejadores, por clase
+EVENTOS_MEDIDOS = ('on_press', 'on_release', 'on_text_validate')
+
+ACTIVA = None
+
+
+def opciones_entorno():
+    valor = os.environ.get('REPARACIONES_INSTRUMENTAR', '')
+    return {opcion.strip() for opcion in valor.split(',') if opcion.strip()}
+
+
+def instrumentacion_entorno():
+    # Una sola por proceso, compartida por todas las conexiones; el resumen
+    # se imprime al salir (aplicación, API o importación)
+    global ACTIVA
+    opciones = opciones_entorno()
+    if ACTIVA is None and opciones:
+        ACTIVA = Instrumentacion(
+            umbral_consulta=float(os.environ.get('REPARACIONES_UMBRAL_MS', UMBRAL_CONSULTA * 1000)) / 1000,
+            archivo_log=os.environ.get('REPARACIONES_LOG_LENTO', ARCHIVO_LOG_POR_DEFECTO),
+            contar_sentencias='traza' in opciones)
+        atexit.register(lambda: print(ACTIVA.resumen()))
+    return ACTIVA
+
+
+def crear_log(archivo):
+    log = logging.getLogger('reparaciones.lento.%s' % os.path.abspath(archivo))
+    if not log.handlers:
+        manejador = RotatingFileHandler(archivo, maxBytes=TAMANO_LOG, backupCount=ARCHIVOS_LOG, encoding='utf-8')
+        manejador.setFormatter(logging.Formatter('%(asctime)s %(threadName)s %(message)s'))
+        log.addHandler(manejador)
+        log.setLevel(logging.INFO)
+        log.propagate = False
+    return log
+
+
+class Instrumentacion:
+    def __init__(self, umbral_consulta=UMBRAL_CONSULTA, umbral_manejador=UMBRAL_MANEJADOR,
+                 umbral_cuadro=UMBRAL_CUADRO, archivo_log=None, contar_sentencias=False):
+        self.umbral_consulta = umbral_consulta
+        self.umbral_manejador = umbral_manejador
+        self.umbral_cuadro = umbral_cuadro
+        self.log = crear_log(archivo_log) if archivo_log else None
+        self.contar_sentencias = contar_sentencias
+        self.lock = threading.Lock()
+        # sql -> [veces, segundos, máximo, filas]; la clave es el texto tal
+        # cual, se normaliza solo al armar el resumen
+        self.sentencias = {}
+        # Ejecuciones medidas por CursorMedido (siempre)
+        self.llamadas = 0
+        # nombre -> [veces, segundos, máximo]
+        self.manejadores = {}
+        # Según el trace callback de sqlite3: incluye triggers, cada fila de
+        # executemany y las internas de FTS5 (empiezan con "--"). Solo con
+        # contar_sentencias ("traza")
+        self.ejecutadas = 0
+        self.internas = 0
+        self.cuadros_lentos = 0
+        self.peor_cuadro = 0.0
+        self.ultimo_manejador = None
+
+    def registrar_lento(self, mensaje, *args):
+        if self.log is not None:
+            self.log.info(mensaje, *args)
+
+    # SQL
+
+    def contar_sentencia(self, sql):
+        # Se llama muchas veces por consulta (una búsqueda FTS5 pasa por
+        # decenas de sentencias internas): sin lock, los contadores son
+        # orientativos
+        self.ejecutadas += 1
+        if sql.startswith('--'):
+            self.internas += 1
+
+    def medir_sentencia(self, sql, segundos, filas, nueva):
+        # nueva=False suma el tiempo y las filas de un fetch a la misma ejecución
+        with self.lock:
+            datos = self.sentencias.get(sql)
+            if datos is None:
+                datos = self.sentencias[sql] = [0, 0.0, 0.0, 0]
+            if nueva:
+                datos[0] += 1
+                self.llamadas += 1
+            datos[1] += segundos
+            datos[3] += filas
+            if segundos > datos[2]:
+                datos[2] = segundos
+
+    def conectar(self, conn):
+        conn.instrumentacion = self
+        if self.contar_sentencias:
+            conn.set_trace_callback(self.contar_sentencia)
+        return conn
+
+    # Interfaz
+
+    def medir_manejador(self, nombre, segundos):
+        with self.lock:
+            datos = self.manejadores.get(nombre)
+            if datos is None:
+                datos = self.manejadores[nombre] = [0, 0.0, 0.0]
+            datos[0] += 1
+            datos[1] += segundos
+            if segundos > datos[2]:
+                datos[2] = segundos
+            self.ultimo_manejador = nombre
+        if segundos > self.umbral_manejador:
+            self.registrar_lento('manejador %.1f ms %s', segundos * 1000, nombre)
+
+    def medir_cuadro(self, dt):
+        if dt > self.peor_cuadro:
+            self.peor_cuadro = dt
+        if dt > self.umbral_cuadro:
+            self.cuadros_lentos += 1
+            self.registrar_lento('cuadro %.1f ms (último manejador: %s)', dt * 1000, self.ultimo_manejador)
+
+    def resumen(self, limite=10):
+        with self.lock:
+            sentencias = sorted(self.sentencias.items(), key=lambda s: s[1][1], reverse=True)[:limite]
+            manejadores = sorted(self.manejadores.items(), key=lambda m: m[1][1], reverse=True)[:limite]
+            lineas = ['SQL: %d llamadas' % self.llamadas]
+            if self.contar_sentencias:
+                lineas[0] += ', %d sentencias ejecutadas por SQLite (%d internas)' % (self.ejecutadas, self.internas)
+            for sql, (veces, segundos, maximo, filas) in sentencias:
+                lineas.append('  %6d x %9.1f ms  máx %7.1f ms  %8d filas  %s' % (
+                    veces, segundos * 1000, maximo * 1000, filas, ' '.join(sql.split())[:90]))
+            lineas.append('Manejadores (cuadros lentos: %d, peor %.1f ms)' % (self.cuadros_lentos, self.peor_cuadro * 1000))
+            for nombre, (veces, segundos, maximo) in manejadores:
+                lineas.append('  %6d x %9.1f ms  máx %7.1f ms  %s' % (veces, segundos * 1000, maximo * 1000, nombre))
+        return '\n'.join(lineas)
+
+
+class CursorMedido(sqlite3.Cursor):
+    # La instrumentación sale de la conexión (ConexionMedida)
+    sql = None
+
+    def execute(self, sql, parametros=()):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, parametros)
+        finally:
+            self.medir(sql, time.perf_counter() - inicio, max(self.rowcount, 0), True)
+
+    def executemany(self, sql, filas):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, filas)
+        finally:
+            self.medir(sql, time.perf_counter() - inicio, max(self.rowcount, 0), True)
+
+    def fetchone(self):
+        inicio = time.perf_counter()
+        fila = super().fetchone()
+        self.medir(self.sql, time.perf_counter() - inicio, fila is not None, False)
+        return fila
+
+    def fetchmany(self, size=None):
+        inicio = time.perf_counter()
+        filas = super().fetchmany(self.arraysize if size is None else size)
+        self.medir(self.sql, time.perf_counter() - inicio, len(filas), False)
+        return filas
+
+    def fetchall(self):
+        inicio = time.perf_counter()
+        filas = super().fetchall()
+        self.medir(self.sql, time.perf_counter() - inicio, len(filas), False)
+        return filas
+
+    def medir(self, sql, segundos, filas, nueva):
+        if sql is None:
+            return
+        instrumentacion = self.connection.instrumentacion
+        if nueva:
+            self.sql = sql
+            self.segundos = segundos
+            self.avisado = False
+        else:
+            self.segundos += segundos
+        instrumentacion.medir_sentencia(sql, segundos, filas, nueva)
+        # Una ejecución lenta se registra una vez, con lo que lleva hasta ahí
+        if self.segundos > instrumentacion.umbral_consulta and not self.avisado:
+            self.avisado = True
+            instrumentacion.registrar_lento('consulta %.1f ms %s', self.segundos * 1000, ' '.join(sql.split()))
+
+
+class ConexionMedida(sqlite3.Connection):
+    # sqlite3.connect(..., factory=ConexionMedida): todos los cursores, también
+    # los de conn.execute(), son CursorMedido
+    instrumentacion = None
+
+    def cursor(self, factory=CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, filas):
+        return self.cursor().executemany(sql, filas)
+
+
+def conectar(instrumentacion, *args, **kwargs):
+    # sqlite3.connect con o sin instrumentación
+    if instrumentacion is None:
+        return sqlite3.connect(*args, **kwargs)
+    return instrumentacion.conectar(sqlite3.connect(*args, factory=ConexionMedida, **kwargs))
+
+
+# Kivy: se importa recién al instalar para que la base y la API no dependan
+# de la interfaz
+
+def medir_eventos(instrumentacion, clase, eventos=EVENTOS_MEDIDOS):
+    original = clase.dispatch
+
+    def dispatch(self, event_type, *args, **kwargs):
+        if event_type not in eventos:
+            return original(self, event_type, *args, **kwargs)
+        inicio = time.perf_counter()
+        try:
+            return original(self, event_type, *args, **kwargs)
+        finally:
+            instrumentacion.medir_manejador(nombre_manejador(self, event_type), time.perf_counter() - inicio)
+
+    clase.dispatch = dispatch
+
+
+def nombre_manejador(widget, evento):
+    # "pantalla/texto del botón evento", para reconocerlo en el registro
+    from kivy.uix.screenmanager import Screen
+    pantalla = widget.parent
+    while pantalla is not None and not isinstance(pantalla, Screen):
+        pantalla = pantalla.parent
+    texto = getattr(widget, 'text', '') if evento != 'on_text_validate' else type(widget).__name__
+    return '%s/%s %s' % (pantalla.name if pantalla is not None else '-', texto[:40], evento)
+
+
+def instalar_en_kivy(instrumentacion, panel=False):
+    from kivy.clock import Clock
+    from kivy.uix.button import Button
+    from kivy.uix.textinput import TextInput
+
+    medir_eventos(instrumentacion, Button)
+    medir_eventos(instrumentacion, TextInput)
+    # Llamado en cada cuadro: dt es lo que tardó el cuadro anterior
+    Clock.schedule_interval(lambda dt: instrumentacion.medir_cuadro(dt), 0)
+    if panel:
+        mostrar_panel(instrumentacion)
+
+
+def mostrar_panel(instrumentacion):
+    # Una línea de texto al pie de la ventana con lo último medido
+    from kivy.clock import Clock
+    from kivy.core.window import Window
+    from kivy.uix.label import Label
+
+    etiqueta = Label(size_hint=(None, None), size=(Window.width, 24), pos=(0, 0),
+                     font_size=12, color=(1, 1, 0, 1), halign='left', valign='middle')
+    etiqueta.bind(size=etiqueta.setter('text_size'))
+    Window.bind(width=etiqueta.setter('width'))
+    Window.add_widget(etiqueta)
+
+    def actualizar(dt):
+        i = instrumentacion
+        sql = 'SQL %d' % i.llamadas
+        if i.contar_sentencias:
+            sql += ' (%d ejecutadas, %d internas)' % (i.ejecutadas, i.internas)
+        etiqueta.text = '%s | cuadros lentos %d, peor %.0f ms | último: %s' % (
+            sql, i.cuadros_lentos, i.peor_cuadro * 1000, i.ultimo_manejador or '-')
+
+    Clock.schedule_interval(actualizar, INTERVALO_PANEL)
+    return etiqueta
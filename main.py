@@ -1,5 +1,12 @@
-import sqlite3
+import os
+import threading
+import time
+
+# Referencia para la traza de arranque: incluye el tiempo de importar Kivy
+INICIO_PROCESO = time.perf_counter()
+
 from kivy.app import App
+from kivy.clock import Clock
 from kivy.uix.screenmanager import ScreenManager, Screen
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.label import Label
@@ -7,99 +14,429 @@ from kivy.uix.textinput import TextInput
 from kivy.uix.button import Button
 from kivy.uix.spinner import Spinner
 from kivy.uix.gridlayout import GridLayout
-from kivy.uix.scrollview import ScrollView
 from kivy.uix.image import Image
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.uix.behaviors import ButtonBehavior
+from kivy.uix.popup import Popup
+from kivy.uix.filechooser import FileChooserListView
+from kivy.properties import NumericProperty, StringProperty
+from kivy.metrics import dp
+
+from adjuntos import ColaMiniaturas, EXTENSIONES_IMAGEN, LADO_MINIATURA, LADO_VISTA
+from avisos import ColaAvisos
+from database import DatabaseManager, BuscadorAsincrono
+from almacen import AlmacenAparatos
+from servicio import ServicioReparaciones, ErrorServicio, leer_lineas
+from documentos import ColaImpresion
+from instrumentacion import instalar_en_kivy, opciones_entorno
+from mantenimiento import Mantenimiento
+
+class FilaAparato(RecycleDataViewBehavior, BoxLayout):
+    # Fila reutilizable de la tabla: la RecycleView solo crea las visibles
+    aparato_id = NumericProperty(0)
+    tipo = StringProperty('')
+    marca = StringProperty('')
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.tabla = None
+        lbl_id = Label()
+        lbl_tipo = Label()
+        lbl_marca = Label()
+        self.bind(aparato_id=lambda x, v: setattr(lbl_id, 'text', str(v)))
+        self.bind(tipo=lbl_tipo.setter('text'))
+        self.bind(marca=lbl_marca.setter('text'))
+        self.add_widget(lbl_id)
+        self.add_widget(lbl_tipo)
+        self.add_widget(lbl_marca)
+        btn = Button(text='Seleccionar')
+        btn.bind(on_press=self.seleccionar)
+        self.add_widget(btn)
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.tabla = rv
+        return super().refresh_view_attrs(rv, index, data)
+
+    def seleccionar(self, instance):
+        if self.tabla and self.tabla.on_seleccionar:
+            self.tabla.on_seleccionar(self.aparato_id)
+
+
+class TablaAparatos(RecycleView):
+    ALTO_FILA = 40
+
+    def __init__(self, on_seleccionar=None, on_cargar_mas=None, **kwargs):
+        super().__init__(**kwargs)
+        self.on_seleccionar = on_seleccionar
+        self.on_cargar_mas = on_cargar_mas
+        layout = RecycleBoxLayout(orientation='vertical', size_hint_y=None,
+                                  default_size=(None, self.ALTO_FILA), default_size_hint=(1, None))
+        layout.bind(minimum_height=layout.setter('height'))
+        layout.bind(height=self.restaurar_posicion)
+        self.add_widget(layout)
+        # viewclass se guarda en el layout: antes de agregarlo se pierde
+        self.viewclass = FilaAparato
+        self.distancia_desde_arriba = None
+
+    def reemplazar_filas(self, filas):
+        self.distancia_desde_arriba = None
+        self.data = filas
+        self.scroll_y = 1
+
+    def agregar_filas(self, filas):
+        # Guardar la posición actual para que la vista no salte al crecer el contenido
+        sobrante = self.layout_manager.height - self.height
+        self.distancia_desde_arriba = (1 - self.scroll_y) * max(sobrante, 0)
+        self.data.extend(filas)
+
+    def aplicar_diferencias(self, cambiadas, borradas):
+        # cambiadas: id -> fila nueva de las que ya están en la tabla. Se
+        # reemplaza cada una en su lugar; la RecycleView solo redibuja esas
+        for indice, fila in enumerate(self.data):
+            nueva = cambiadas.get(fila['aparato_id'])
+            if nueva is not None:
+                self.data[indice] = nueva
+        if borradas:
+            self.data = [fila for fila in self.data if fila['aparato_id'] not in borradas]
+
+    def restaurar_posicion(self, instance, altura):
+        if self.distancia_desde_arriba is None:
+            return
+        sobrante = altura - self.height
+        if sobrante > 0:
+            self.scroll_y = 1 - self.distancia_desde_arriba / sobrante
+        self.distancia_desde_arriba = None
+
+    def on_scroll_y(self, instance, valor):
+        # Pedir la siguiente página al acercarse al final
+        if valor <= 0.05 and self.data and self.on_cargar_mas:
+            self.on_cargar_mas()
+
+
+class FotoMiniatura(RecycleDataViewBehavior, ButtonBehavior, Image):
+    # Foto reutilizable de la tira; la miniatura la genera la cola de
+    # miniaturas (adjuntos.py) y se muestra cuando llega
+    adjunto_id = NumericProperty(0)
+    hash = StringProperty('')
+    nombre = StringProperty('')
+    etapa = StringProperty('')
+
+    def __init__(self, **kwargs):
+        super().__init__(nocache=True, fit_mode='contain', **kwargs)
+        self.tira = None
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.tira = rv
+        resultado = super().refresh_view_attrs(rv, index, data)
+        hash_archivo = self.hash
+        self.source = rv.miniaturas.pedir(
+            hash_archivo, LADO_MINIATURA,
+            lambda ruta, error: Clock.schedule_once(lambda dt: self.mostrar(hash_archivo, ruta))) or ''
+        return resultado
+
+    def mostrar(self, hash_archivo, ruta):
+        # La vista pudo reciclarse para otra foto mientras se generaba
+        if ruta and self.hash == hash_archivo:
+            self.source = ruta
+
+    def on_press(self):
+        if self.tira is not None:
+            self.tira.abrir(self.hash, self.nombre)
+
+
+class TiraFotos(RecycleView):
+    LADO = 96
+
+    def __init__(self, miniaturas, **kwargs):
+        super().__init__(do_scroll_y=False, size_hint_y=None, height=dp(self.LADO), **kwargs)
+        self.miniaturas = miniaturas
+        layout = RecycleBoxLayout(orientation='horizontal', size_hint_x=None, spacing=dp(4),
+                                  default_size=(dp(self.LADO), dp(self.LADO)), default_size_hint=(None, None))
+        layout.bind(minimum_width=layout.setter('width'))
+        self.add_widget(layout)
+        self.viewclass = FotoMiniatura
+
+    def mostrar(self, fotos):
+        self.data = [{'adjunto_id': adjunto_id, 'hash': hash_archivo, 'nombre': nombre or '', 'etapa': etapa}
+                     for adjunto_id, hash_archivo, nombre, tamano, etapa, fecha in fotos]
+
+    def abrir(self, hash_archivo, nombre):
+        # Tampoco al abrirla se decodifica el original: se pide una versión
+        # de LADO_VISTA a la misma cola
+        imagen = Image(nocache=True, fit_mode='contain')
+        imagen.source = self.miniaturas.pedir(
+            hash_archivo, LADO_VISTA,
+            lambda ruta, error: Clock.schedule_once(lambda dt: setattr(imagen, 'source', ruta or ''))) or ''
+        Popup(title=nombre, content=imagen, size_hint=(0.9, 0.9)).open()
+
+
+def elegir_imagen(al_elegir):
+    # Selector de archivos de imagen; al_elegir(ruta) con el elegido
+    selector = FileChooserListView(path=os.path.expanduser('~'),
+                                   filters=['*' + extension for extension in EXTENSIONES_IMAGEN]
+                                   + ['*' + extension.upper() for extension in EXTENSIONES_IMAGEN])
+    contenido = BoxLayout(orientation='vertical')
+    contenido.add_widget(selector)
+    botones = BoxLayout(size_hint_y=None, height=40)
+    contenido.add_widget(botones)
+    popup = Popup(title='Elegir foto', content=contenido, size_hint=(0.9, 0.9))
+
+    def elegir(*args):
+        if selector.selection:
+            popup.dismiss()
+            al_elegir(selector.selection[0])
+
+    selector.bind(on_submit=elegir)
+    botones.add_widget(Button(text='Agregar', on_press=elegir))
+    botones.add_widget(Button(text='Cancelar', on_press=popup.dismiss))
+    popup.open()
+    return popup
+
+
+def avisar_impresion(ruta, error):
+    # Llamado desde el hilo de la cola de impresión
+    if error is None:
+        print(f"Documento enviado a la impresora: {ruta}")
+
+
+def texto_estimacion(estimacion):
+    if estimacion is None:
+        return 'Sin precios anteriores para sugerir'
+    texto = (f"Sugerido: {estimacion.mediana:.2f} (entre {estimacion.p25:.2f} y {estimacion.p75:.2f}, "
+             f"{estimacion.cantidad} diagnósticos por {estimacion.nivel})")
+    if estimacion.diagnosticos:
+        texto += '\nFrecuentes: ' + '; '.join(d for d, _ in estimacion.diagnosticos)
+    return texto
+
+
+def texto_aviso(avisos):
+    # El último aviso al cliente (filas de ServicioReparaciones.avisos)
+    if not avisos:
+        return 'Aviso al cliente: ninguno'
+    _, estado, destino, _, _, proximo_intento, intentos, enviado, error = avisos[-1]
+    if enviado is not None:
+        return f"Aviso al cliente ({estado}): enviado a {destino} el {time.strftime('%d/%m %H:%M', time.localtime(enviado))}"
+    if proximo_intento is None:
+        return f"Aviso al cliente ({estado}): no se pudo enviar a {destino} ({error})"
+    texto = f"Aviso al cliente ({estado}): pendiente para {destino}"
+    return texto + (f", {intentos} intentos ({error})" if error else '')
+
+
+class PantallaFlujo(Screen):
+    # Pantallas que trabajan sobre el aparato seleccionado: lo muestran
+    # desde el almacén (AlmacenAparatos) cada vez que cambia, sin consultar
+    # la base por su cuenta
+    def __init__(self, **kwargs):
+        self.almacen = kwargs.pop('almacen')
+        self.miniaturas = kwargs.pop('miniaturas', None)  # Cola de miniaturas (adjuntos.py)
+        super().__init__(**kwargs)
+        self.tira_fotos = None
+
+    def agregar_fotos(self, layout, etapa=None):
+        # Tira con las fotos del aparato y, con etapa, el botón para sumar una
+        self.tira_fotos = TiraFotos(self.miniaturas)
+        layout.add_widget(self.tira_fotos)
+        if etapa is not None:
+            layout.add_widget(Button(text='Agregar foto', on_press=lambda x: elegir_imagen(
+                lambda ruta: self.adjuntar_foto(ruta, etapa))))
+
+    def adjuntar_foto(self, ruta, etapa):
+        # La tira se actualiza sola: el almacén avisa que cambió el aparato
+        try:
+            self.servicio.adjuntar_foto(self.aparato_id.text, ruta, etapa)
+        except ErrorServicio as e:
+            print(f"No se pudo agregar la foto: {e}")
+
+    def seguir_seleccion(self):
+        # Al final del __init__ de cada pantalla, con los widgets ya creados
+        self.almacen.bind(seleccionado=lambda almacen, detalle: self.al_seleccionar(detalle))
+        if self.almacen.seleccionado is not None:
+            self.al_seleccionar(self.almacen.seleccionado)
+
+    def al_seleccionar(self, detalle):
+        if self.tira_fotos is not None:
+            self.tira_fotos.mostrar(self.servicio.fotos(detalle.id) if detalle is not None and detalle.fotos else [])
+        if detalle is None:
+            self.info_aparato.text = "Aparato no encontrado"
+            return
+        self.aparato_id.text = str(detalle.id)
+        self.mostrar_aparato(detalle)
+
+    def buscar_aparato(self, instance):
+        try:
+            aparato = self.servicio.resolver_codigo(self.aparato_id.text)
+        except ErrorServicio:
+            self.info_aparato.text = "Aparato no encontrado"
+            return
+        self.almacen.seleccionar(aparato.id)
+
+
+class TrazaInicio:
+    # Tiempo de cada fase del arranque, desde el inicio del proceso
+    def __init__(self, inicio):
+        self.inicio = inicio
+        self.anterior = inicio
+        self.fases = []
+
+    def marcar(self, fase):
+        ahora = time.perf_counter()
+        self.fases.append((fase, ahora - self.anterior))
+        self.anterior = ahora
+
+    def reporte(self):
+        lineas = ['Inicio %-24s %8.1f ms' % (fase, duracion * 1000) for fase, duracion in self.fases]
+        lineas.append('Inicio %-24s %8.1f ms' % ('total', (self.anterior - self.inicio) * 1000))
+        return '\n'.join(lineas)
+
+
+def logo_reducido(ruta, lado, directorio_cache):
+    # Decodifica el logo una sola vez y guarda una copia del tamaño en que se
+    # muestra; los arranques siguientes cargan directamente la copia pequeña
+    destino = os.path.join(directorio_cache, 'logo_%d.png' % lado)
+    if os.path.exists(destino) and os.path.getmtime(destino) >= os.path.getmtime(ruta):
+        return destino
+    try:
+        from kivy.core.image import Image as CoreImage
+        from kivy.graphics import Fbo, ClearColor, ClearBuffers, Rectangle
+        original = CoreImage(ruta).texture
+        escala = min(lado / original.width, lado / original.height, 1)
+        tamano = (max(1, int(original.width * escala)), max(1, int(original.height * escala)))
+        fbo = Fbo(size=tamano)
+        with fbo:
+            ClearColor(0, 0, 0, 0)
+            ClearBuffers()
+            Rectangle(texture=original, size=tamano)
+        fbo.draw()
+        os.makedirs(directorio_cache, exist_ok=True)
+        fbo.texture.save(destino)
+        return destino
+    except Exception as e:
+        print(f"No se pudo reducir el logo: {e}")
+        return ruta
+
+
+class ScreenManagerPerezoso(ScreenManager):
+    # Las pantallas registradas se construyen la primera vez que se usan
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.fabricas = {}
 
-class DatabaseManager:
-    def __init__(self):
-        self.conn = sqlite3.connect('reparaciones.db')
-        self.cursor = self.conn.cursor()
-        self.create_tables()
-
-    def create_tables(self):
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS aparatos (
-                id INTEGER PRIMARY KEY,
-                tipo TEXT,
-                marca TEXT,
-                modelo TEXT,
-                numero_serie TEXT,
-                problema TEXT,
-                estado TEXT,
-                nombre_cliente TEXT,
-                telefono_cliente TEXT,
-                observaciones TEXT            
-            )
-        ''')
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS diagnosticos (
-                id INTEGER PRIMARY KEY,
-                aparato_id INTEGER,
-                diagnostico TEXT,
-                valor REAL,
-                FOREIGN KEY (aparato_id) REFERENCES aparatos (id)
-            )
-        ''')
-        self.conn.commit()
-
-    def insert_aparato(self, tipo, marca, modelo, numero_serie, problema, estado, nombre_cliente, telefono_cliente):
-        self.cursor.execute('''
-            INSERT INTO aparatos (tipo, marca, modelo, numero_serie, problema, estado, nombre_cliente, telefono_cliente)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (tipo, marca, modelo, numero_serie, problema, estado, nombre_cliente, telefono_cliente))
-        self.conn.commit()
-        return self.cursor.lastrowid
-
-    def insert_diagnostico(self, aparato_id, diagnostico, valor):
-        self.cursor.execute('''
-            INSERT INTO diagnosticos (aparato_id, diagnostico, valor)
-            VALUES (?, ?, ?)
-        ''', (aparato_id, diagnostico, valor))
-        self.conn.commit()
-
-    def get_aparato(self, aparato_id):
-        self.cursor.execute('SELECT * FROM aparatos WHERE id = ?', (aparato_id,))
-        return self.cursor.fetchone()
-
-    def get_diagnostico(self, aparato_id):
-        self.cursor.execute('SELECT * FROM diagnosticos WHERE aparato_id = ?', (aparato_id,))
-        return self.cursor.fetchone()
-
-    def update_estado(self, aparato_id, nuevo_estado):
-        self.cursor.execute('UPDATE aparatos SET estado = ? WHERE id = ?', (nuevo_estado, aparato_id))
-        self.conn.commit()
-
-    def update_observaciones(self, aparato_id, observaciones):
-        self.cursor.execute('UPDATE aparatos SET observaciones = ? WHERE id = ?', (observaciones, aparato_id))
-        self.conn.commit() 
-
-    def get_all_aparatos(self):
-        self.cursor.execute('SELECT id, tipo, marca FROM aparatos')
-        return self.cursor.fetchall()       
-
-    def close(self):
-        self.conn.close()
+    def registrar(self, nombre, fabrica):
+        self.fabricas[nombre] = fabrica
+
+    def has_screen(self, name):
+        return name in self.fabricas or super().has_screen(name)
+
+    def get_screen(self, name):
+        if name in self.fabricas:
+            self.add_widget(self.fabricas.pop(name)())
+        return super().get_screen(name)
 
 
 class GestionApp(App):
     def build(self):
+        self.traza = TrazaInicio(INICIO_PROCESO)
+        self.traza.marcar('importaciones')
         self.db = DatabaseManager()
-        sm = ScreenManager()
-        sm.add_widget(MenuPrincipalScreen(name='menu', db=self.db))
-        sm.add_widget(RegistroScreen(name='registro', db=self.db))
-        sm.add_widget(DiagnosticoScreen(name='diagnostico', db=self.db))
-        sm.add_widget(AprobacionScreen(name='aprobacion', db=self.db))
-        sm.add_widget(ReparacionScreen(name='reparacion', db=self.db))
-        sm.add_widget(EntregaFacturacionScreen(name='entrega_facturacion', db=self.db))
+        self.servicio = ServicioReparaciones(self.db)
+        self.impresion = ColaImpresion()
+        self.miniaturas = ColaMiniaturas(self.servicio.adjuntos)
+        self.traza.marcar('base de datos')
+        # Aparato seleccionado y filas del menú, compartidos por las pantallas
+        self.almacen = AlmacenAparatos(self.db)
+        sm = ScreenManagerPerezoso()
+        sm.add_widget(MenuPrincipalScreen(name='menu', db=self.db, almacen=self.almacen))
+        sm.registrar('registro', lambda: RegistroScreen(name='registro', servicio=self.servicio, impresion=self.impresion, miniaturas=self.miniaturas))
+        sm.registrar('diagnostico', lambda: DiagnosticoScreen(name='diagnostico', servicio=self.servicio, almacen=self.almacen, miniaturas=self.miniaturas))
+        sm.registrar('aprobacion', lambda: AprobacionScreen(name='aprobacion', servicio=self.servicio, almacen=self.almacen))
+        sm.registrar('reparacion', lambda: ReparacionScreen(name='reparacion', servicio=self.servicio, almacen=self.almacen, miniaturas=self.miniaturas))
+        sm.registrar('entrega_facturacion', lambda: EntregaFacturacionScreen(name='entrega_facturacion', servicio=self.servicio, impresion=self.impresion, almacen=self.almacen, miniaturas=self.miniaturas))
+        sm.registrar('tablero', lambda: TableroScreen(name='tablero', servicio=self.servicio))
+        self.traza.marcar('pantalla menú')
+        # Avisos a los clientes: se envían en segundo plano y cada commit
+        # despierta la cola por si dejó alguno
+        self.avisos = None
+        if self.db.db_path != ':memory:':
+            self.avisos = ColaAvisos(self.db.db_path)
+            self.db.oyentes.append(self.avisos.despertar)
+        self.mantenimiento = None
+        if os.environ.get('REPARACIONES_MANTENIMIENTO', '1') != '0' and self.db.db_path != ':memory:':
+            self.mantenimiento = Mantenimiento(self.db.db_path, al_terminar=self.mantenimiento_terminado,
+                                              adjuntos=self.servicio.adjuntos)
         return sm
+
+    def on_start(self):
+        self.root_window.bind(on_flip=self.primer_cuadro)
+
+    def primer_cuadro(self, window):
+        self.root_window.unbind(on_flip=self.primer_cuadro)
+        self.traza.marcar('ventana y primer cuadro')
+        # El logo y la lista se cargan después de mostrar la primera imagen
+        Clock.schedule_once(self.cargar_menu)
+
+    def cargar_menu(self, dt):
+        self.root.get_screen('menu').cargar_contenido()
+        self.traza.marcar('logo y lista')
+        print(self.traza.reporte())
+        # Después del arranque, para que la carga inicial no cuente como tirón
+        if self.db.instrumentacion is not None:
+            instalar_en_kivy(self.db.instrumentacion,
+                             panel='panel' in opciones_entorno())
+        # Mantenimiento en los ratos sin uso; cualquier toque o tecla lo frena
+        if self.mantenimiento is not None:
+            self.root_window.bind(on_touch_down=self.mantenimiento.actividad,
+                                  on_key_down=self.mantenimiento.actividad)
+            self.mantenimiento.iniciar()
+        if self.avisos is not None:
+            self.avisos.iniciar()
+        if os.environ.get('REPARACIONES_SALIR_TRAS_INICIO'):
+            self.stop()
+
+    def mantenimiento_terminado(self, tarea, resultado):
+        print(f"Mantenimiento: {tarea} {resultado}")
+        if tarea == 'archivar' and resultado['archivados']:
+            Clock.schedule_once(self.quitar_archivados)
+
+    def quitar_archivados(self, dt):
+        # Los aparatos archivados desaparecen de las cachés y, por el
+        # almacén, del menú
+        self.db.invalidar_tablero()
+        self.db.invalidar_detalle()
+
+    def abrir_aparato(self, codigo):
+        # Lectura de la etiqueta (o ID / número de serie + Enter): abre el
+        # aparato en todas las pantallas del flujo de una vez
+        inicio = time.perf_counter()
+        try:
+            aparato = self.servicio.resolver_codigo(codigo)
+        except ErrorServicio as e:
+            print(f"Código no reconocido: {e}")
+            return None
+        # Las pantallas del flujo lo muestran desde el almacén
+        self.almacen.seleccionar(aparato.id)
+        print(f"Aparato {aparato.id} abierto en {(time.perf_counter() - inicio) * 1000:.1f} ms")
+        return aparato
     
     def on_stop(self):
+        if self.mantenimiento is not None:
+            self.mantenimiento.cerrar()
+        if self.avisos is not None:
+            self.avisos.cerrar()
+        self.root.get_screen('menu').buscador.cerrar()
+        self.impresion.cerrar()
+        self.miniaturas.cerrar()
         self.db.close()
 
 
 class MenuPrincipalScreen(Screen):
+    TAMANO_PAGINA = 200
+    ESPERA_BUSQUEDA = 0.25
+
     def __init__(self, **kwargs):
         self.db = kwargs.pop('db')
+        self.almacen = kwargs.pop('almacen')
         super().__init__(**kwargs)
 
         ##layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
@@ -113,10 +450,10 @@ class MenuPrincipalScreen(Screen):
         # Layout principal
         main_layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
         
-        # Logo de la empresa
-        logo = Image(source='logo.png', size_hint=(None, None), size=(100, 100))
-        logo.pos_hint = {'center_x': 0.5}
-        main_layout.add_widget(logo)
+        # Logo de la empresa (se carga en cargar_contenido)
+        self.logo = Image(size_hint=(None, None), size=(100, 100))
+        self.logo.pos_hint = {'center_x': 0.5}
+        main_layout.add_widget(self.logo)
         
         main_layout.add_widget(Label(text='Menú Principal', font_size=24, size_hint_y=None, height=50))
         
@@ -128,18 +465,29 @@ class MenuPrincipalScreen(Screen):
         search_button.bind(on_press=self.search_aparatos)
         search_layout.add_widget(search_button)
         main_layout.add_widget(search_layout)
-        
-        # Tabla de aparatos
-        self.tabla_aparatos = GridLayout(cols=4, spacing=5, size_hint_y=None)
-        self.tabla_aparatos.bind(minimum_height=self.tabla_aparatos.setter('height'))
+
+        # Búsqueda mientras se escribe: espera una pausa al teclear y
+        # consulta en segundo plano para no bloquear la interfaz
+        self.buscador = BuscadorAsincrono(self.db, self.recibir_resultados, self.busqueda_fallida,
+                                          limit=self.TAMANO_PAGINA)
+        self.disparar_busqueda = Clock.create_trigger(self.search_aparatos, self.ESPERA_BUSQUEDA)
+        self.search_input.bind(text=self.al_escribir_busqueda)
         
         # Encabezados de la tabla
+        encabezados = GridLayout(cols=4, spacing=5, size_hint_y=None, height=30)
         for header in ['ID', 'Tipo', 'Marca', 'Seleccionar']:
-            self.tabla_aparatos.add_widget(Label(text=header, bold=True))
-        
-        scroll_view = ScrollView(size_hint=(1, None), size=(self.width, 200))
-        scroll_view.add_widget(self.tabla_aparatos)
-        main_layout.add_widget(scroll_view)
+            encabezados.add_widget(Label(text=header, bold=True))
+        main_layout.add_widget(encabezados)
+
+        # Tabla de aparatos (virtualizada y paginada)
+        self.tabla_aparatos = TablaAparatos(on_seleccionar=self.seleccionar_aparato,
+                                            on_cargar_mas=self.cargar_pagina,
+                                            size_hint=(1, None), size=(self.width, 200))
+        main_layout.add_widget(self.tabla_aparatos)
+        # Después de cada escritura llegan solo las filas que cambiaron
+        self.ultimo_id = 0
+        self.hay_mas_paginas = True
+        self.almacen.bind(on_filas=self.aplicar_cambios, on_recargar=self.recargar)
         
         # Botones de navegación
         buttons_layout = GridLayout(cols=2, spacing=10, size_hint_y=None)
@@ -151,7 +499,8 @@ class MenuPrincipalScreen(Screen):
             ('Diagnóstico', 'diagnostico'),
             ('Aprobación', 'aprobacion'),
             ('Reparación', 'reparacion'),
-            ('Entrega y Facturación', 'entrega_facturacion')
+            ('Entrega y Facturación', 'entrega_facturacion'),
+            ('Tablero', 'tablero')
         ]
         
     ##    for text, screen in buttons:
@@ -174,43 +523,79 @@ class MenuPrincipalScreen(Screen):
         main_layout.add_widget(buttons_layout)
         
         self.add_widget(main_layout)
+
+    def cargar_contenido(self):
+        directorio_cache = os.path.join(App.get_running_app().user_data_dir, 'cache')
+        self.logo.source = logo_reducido('logo.png', int(dp(100)), directorio_cache)
         self.actualizar_lista_aparatos()
-    
+
+    def fila_tabla(self, aparato):
+        return {'aparato_id': aparato[0], 'tipo': aparato[1] or '', 'marca': aparato[2] or ''}
+
     def actualizar_lista_aparatos(self):
-        self.tabla_aparatos.clear_widgets()
-        # Añadir encabezados
-        for header in ['ID', 'Tipo', 'Marca', 'Seleccionar']:
-            self.tabla_aparatos.add_widget(Label(text=header, bold=True))
-        
-        aparatos = self.db.get_all_aparatos()
-        for aparato in aparatos:
-            self.tabla_aparatos.add_widget(Label(text=str(aparato[0])))
-            self.tabla_aparatos.add_widget(Label(text=aparato[1]))
-            self.tabla_aparatos.add_widget(Label(text=aparato[2]))
-            btn = Button(text='Seleccionar')
-            btn.bind(on_press=lambda x, id=aparato[0]: self.seleccionar_aparato(id))
-            self.tabla_aparatos.add_widget(btn)
+        self.ultimo_id = 0
+        self.hay_mas_paginas = True
+        self.tabla_aparatos.reemplazar_filas([])
+        self.almacen.mostrar([])
+        self.cargar_pagina()
+
+    def cargar_pagina(self):
+        if not self.hay_mas_paginas:
+            return
+        aparatos = self.db.get_aparatos_page(self.ultimo_id, self.TAMANO_PAGINA)
+        self.hay_mas_paginas = len(aparatos) == self.TAMANO_PAGINA
+        if aparatos:
+            self.ultimo_id = aparatos[-1][0]
+            self.tabla_aparatos.agregar_filas([self.fila_tabla(a) for a in aparatos])
+            self.almacen.mostrar(aparatos, agregar=True)
+
+    def aplicar_cambios(self, almacen, cambiadas, borradas):
+        presentes = {aparato_id: self.fila_tabla(fila) for aparato_id, fila in
+                     ((fila[0], fila) for fila in cambiadas) if aparato_id in almacen.filas}
+        self.tabla_aparatos.aplicar_diferencias(presentes, set(borradas))
+        # Los nuevos van al final de la lista completa; con páginas por
+        # cargar llegan solos al hacer scroll, y no entran en una búsqueda
+        nuevas = [fila for fila in cambiadas if fila[0] not in almacen.filas and fila[0] > self.ultimo_id]
+        if nuevas and not self.hay_mas_paginas and not self.search_input.text.strip():
+            self.ultimo_id = nuevas[-1][0]
+            self.tabla_aparatos.agregar_filas([self.fila_tabla(fila) for fila in nuevas])
+            almacen.mostrar(nuevas, agregar=True)
+
+    def recargar(self, almacen):
+        self.search_aparatos(None)
+
+    def al_escribir_busqueda(self, instance, texto):
+        # Reiniciar la espera con cada tecla
+        self.disparar_busqueda.cancel()
+        self.disparar_busqueda()
 
     def search_aparatos(self, instance):
-        busqueda = self.search_input.text.lower()
-        self.tabla_aparatos.clear_widgets()
-        # Añadir encabezados
-        for header in ['ID', 'Tipo', 'Marca', 'Seleccionar']:
-            self.tabla_aparatos.add_widget(Label(text=header, bold=True))
-        
-        aparatos = self.db.get_all_aparatos()
-        for aparato in aparatos:
-            if busqueda in str(aparato[0]).lower() or busqueda in aparato[1].lower() or busqueda in aparato[2].lower():
-                self.tabla_aparatos.add_widget(Label(text=str(aparato[0])))
-                self.tabla_aparatos.add_widget(Label(text=aparato[1]))
-                self.tabla_aparatos.add_widget(Label(text=aparato[2]))
-                btn = Button(text='Seleccionar')
-                btn.bind(on_press=lambda x, id=aparato[0]: self.seleccionar_aparato(id))
-                self.tabla_aparatos.add_widget(btn)
+        self.disparar_busqueda.cancel()
+        busqueda = self.search_input.text.strip()
+        if not busqueda:
+            self.buscador.buscar('')
+            self.actualizar_lista_aparatos()
+            return
+        self.buscador.buscar(busqueda)
+
+    def recibir_resultados(self, busqueda, aparatos):
+        # Llamado desde el hilo del buscador: pasar al hilo de la interfaz
+        Clock.schedule_once(lambda dt: self.mostrar_resultados(busqueda, aparatos))
+
+    def busqueda_fallida(self, busqueda, error):
+        # También desde el hilo del buscador; la lista queda como estaba
+        print(f"No se pudo buscar {busqueda!r}: {error}")
+
+    def mostrar_resultados(self, busqueda, aparatos):
+        if not busqueda or busqueda != self.search_input.text.strip():
+            return
+        # Los resultados de búsqueda se muestran completos, sin paginación por scroll
+        self.hay_mas_paginas = False
+        self.tabla_aparatos.reemplazar_filas([self.fila_tabla(a) for a in aparatos])
+        self.almacen.mostrar(aparatos)
 
     def seleccionar_aparato(self, aparato_id):
-        for screen_name in ['diagnostico', 'aprobacion', 'reparacion', 'entrega_facturacion']:
-            self.manager.get_screen(screen_name).aparato_id.text = str(aparato_id)
+        self.almacen.seleccionar(aparato_id)
         print(f"Aparato {aparato_id} seleccionado")
 
     def change_screen(self, screen_name):
@@ -218,9 +603,15 @@ class MenuPrincipalScreen(Screen):
 
 
 class RegistroScreen(Screen):
+    ESPERA_SUGERENCIAS = 0.15
+    SUGERENCIAS = 4
+
     def __init__(self, **kwargs):
-        self.db = kwargs.pop('db')  # Base de datos
+        self.servicio = kwargs.pop('servicio')  # Flujo de trabajo (servicio.py)
+        self.impresion = kwargs.pop('impresion')  # Cola de documentos (documentos.py)
+        self.miniaturas = kwargs.pop('miniaturas')  # Cola de miniaturas (adjuntos.py)
         super().__init__(**kwargs)
+        self.ultimo_id = None
         layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
         layout.add_widget(Label(text='Registro de Aparatos'))
         # Aquí añadiremos más widgets para el registro
@@ -232,6 +623,12 @@ class RegistroScreen(Screen):
         layout.add_widget(self.marca)
         self.modelo = TextInput(multiline=False, hint_text='Modelo')
         layout.add_widget(self.modelo)
+        # Precio orientativo para decirle al cliente al recibir el aparato
+        self.precio_estimado = Label(text='')
+        layout.add_widget(self.precio_estimado)
+        self.disparar_precio = Clock.create_trigger(self.estimar_precio, self.ESPERA_SUGERENCIAS)
+        for campo in (self.tipo, self.marca, self.modelo):
+            campo.bind(text=self.al_escribir_aparato)
         self.numero_serie = TextInput(multiline=False, hint_text='Número de serie')
         layout.add_widget(self.numero_serie)
         self.problema = TextInput(multiline=True, hint_text='Descripción del problema')
@@ -244,10 +641,27 @@ class RegistroScreen(Screen):
         layout.add_widget(self.nombre_cliente)
         self.telefono_cliente = TextInput(multiline=False, hint_text='Teléfono del cliente')
         layout.add_widget(self.telefono_cliente)
-        
+
+        # Clientes ya registrados que coinciden con lo escrito en el nombre o
+        # el teléfono; al elegir uno se completan los dos campos
+        self.sugerencias = BoxLayout(orientation='vertical', size_hint_y=None, height=0)
+        layout.add_widget(self.sugerencias)
+        self.aparatos_cliente = Label(size_hint_y=None, height=0, halign='left', valign='middle')
+        self.aparatos_cliente.bind(size=self.aparatos_cliente.setter('text_size'))
+        layout.add_widget(self.aparatos_cliente)
+        self.completando = False
+        self.campo_sugerido = None
+        self.disparar_sugerencias = Clock.create_trigger(self.sugerir_clientes, self.ESPERA_SUGERENCIAS)
+        self.nombre_cliente.bind(text=self.al_escribir_cliente)
+        self.telefono_cliente.bind(text=self.al_escribir_cliente)
+
+        # Fotos del aparato recién guardado, tal como llegó
+        self.tira_fotos = TiraFotos(self.miniaturas)
+        layout.add_widget(self.tira_fotos)
 
         # Botones
         layout.add_widget(Button(text='Guardar información', on_press=self.guardar_info))
+        layout.add_widget(Button(text='Agregar foto', on_press=self.agregar_foto))
         layout.add_widget(Button(text='Imprimir Orden', on_press=self.imprimir_orden))
         layout.add_widget(Button(text='Imprimir Etiqueta', on_press=self.imprimir_etiqueta))
         layout.add_widget(Button(text='Ir a Diagnóstico', on_press=self.ir_a_diagnostico))
@@ -258,34 +672,90 @@ class RegistroScreen(Screen):
     def volver_menu(self, instance):
         self.manager.current = 'menu'    
 
+    def al_escribir_cliente(self, instance, texto):
+        if self.completando:
+            return
+        self.campo_sugerido = instance
+        self.aparatos_cliente.text = ''
+        self.aparatos_cliente.height = 0
+        self.disparar_sugerencias.cancel()
+        self.disparar_sugerencias()
+
+    def sugerir_clientes(self, dt):
+        # Búsqueda por prefijo en los índices de clientes: menos de un
+        # milisegundo, se hace en el hilo de la interfaz
+        texto = self.campo_sugerido.text.strip() if self.campo_sugerido else ''
+        clientes = self.servicio.buscar_clientes(texto, self.SUGERENCIAS) if len(texto) >= 2 else []
+        self.sugerencias.clear_widgets()
+        for cliente_id, nombre, telefono, aparatos in clientes:
+            boton = Button(text=f"{nombre}  {telefono}  ({aparatos} aparatos)", size_hint_y=None, height=40)
+            boton.bind(on_press=lambda x, c=(cliente_id, nombre, telefono): self.elegir_cliente(*c))
+            self.sugerencias.add_widget(boton)
+        self.sugerencias.height = 40 * len(clientes)
+
+    def al_escribir_aparato(self, instance, texto):
+        self.disparar_precio.cancel()
+        self.disparar_precio()
+
+    def estimar_precio(self, dt):
+        # Unas pocas filas por clave primaria: se hace en el hilo de la interfaz
+        tipo = self.tipo.text.strip()
+        if not tipo:
+            self.precio_estimado.text = ''
+            return
+        self.precio_estimado.text = texto_estimacion(
+            self.servicio.estimar_precio(tipo, self.marca.text, self.modelo.text))
+
+    def elegir_cliente(self, cliente_id, nombre, telefono):
+        self.completando = True
+        self.nombre_cliente.text = nombre
+        self.telefono_cliente.text = telefono
+        self.completando = False
+        self.sugerencias.clear_widgets()
+        self.sugerencias.height = 0
+        _, aparatos = self.servicio.aparatos_de_cliente(cliente_id, limit=5)
+        self.aparatos_cliente.text = 'Aparatos del cliente: ' + ', '.join(
+            f"#{aparato_id} {tipo} {marca} ({estado})" for aparato_id, tipo, marca, modelo, estado in aparatos)
+        self.aparatos_cliente.height = 30
+
     def guardar_info(self, instance):
-        aparato_id = self.db.insert_aparato(
+        aparato_id = self.servicio.registrar_aparato(
             self.tipo.text, self.marca.text, self.modelo.text, self.numero_serie.text,
-            self.problema.text, self.estado.text, self.nombre_cliente.text, self.telefono_cliente.text
+            self.problema.text, self.estado.text, self.nombre_cliente.text, self.telefono_cliente.text,
+            origen=self.name
         )
+        self.ultimo_id = aparato_id
+        self.tira_fotos.mostrar([])
         print(f"Aparato guardado con ID: {aparato_id}")   
 
+    def agregar_foto(self, instance):
+        if self.ultimo_id is None:
+            print("Guarde el aparato antes de agregar fotos")
+            return
+        elegir_imagen(self.adjuntar_foto)
+
+    def adjuntar_foto(self, ruta):
+        try:
+            self.servicio.adjuntar_foto(self.ultimo_id, ruta, 'ingreso')
+        except ErrorServicio as e:
+            print(f"No se pudo agregar la foto: {e}")
+            return
+        self.tira_fotos.mostrar(self.servicio.fotos(self.ultimo_id))
+
+    def imprimir(self, tipo):
+        # Se imprime el último aparato guardado; el PDF se genera en segundo plano
+        if self.ultimo_id is None:
+            print("Guarde el aparato antes de imprimir")
+            return
+        aparato = self.servicio.consultar(self.ultimo_id)
+        self.impresion.encolar(tipo, aparato._asdict(), al_terminar=avisar_impresion)
+        print(f"Imprimiendo {tipo} del aparato {self.ultimo_id}")
+
     def imprimir_orden(self, instance):
-        orden = f"""
-        ORDEN DE INGRESO
-        ----------------
-        ID: {self.db.last_inserted_id}
-        Cliente: {self.nombre_cliente.text}
-        Teléfono: {self.telefono_cliente.text}
-        Aparato: {self.tipo.text} {self.marca.text} {self.modelo.text}
-        Problema: {self.problema.text}
-        """
-        print("Imprimiendo orden de ingreso:")
-        print(orden)
+        self.imprimir('orden')
 
     def imprimir_etiqueta(self, instance):
-        etiqueta = f"""
-        ID: {self.db.last_inserted_id}
-        {self.tipo.text} {self.marca.text}
-        {self.modelo.text}
-        """
-        print("Imprimiendo etiqueta:")
-        print(etiqueta)
+        self.imprimir('etiqueta')
 
     def ir_a_diagnostico(self, instance):
         self.manager.current = 'diagnostico'
@@ -293,9 +763,9 @@ class RegistroScreen(Screen):
     __init__ 
 
 
-class DiagnosticoScreen(Screen):
+class DiagnosticoScreen(PantallaFlujo):
     def __init__(self, **kwargs):
-        self.db = kwargs.pop('db')  # Base de datos
+        self.servicio = kwargs.pop('servicio')  # Flujo de trabajo (servicio.py)
         super().__init__(**kwargs)
         layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
         layout.add_widget(Label(text='Diagnóstico y Precio'))
@@ -320,7 +790,9 @@ class DiagnosticoScreen(Screen):
 
         # Campos para buscar aparat
 
-        self.aparato_id = TextInput(multiline=False, hint_text='ID del aparato')
+        self.aparato_id = TextInput(multiline=False, hint_text='ID, etiqueta o número de serie',
+                                    text_validate_unfocus=False)
+        self.aparato_id.bind(on_text_validate=self.escanear)
         layout.add_widget(self.aparato_id)
         layout.add_widget(Button(text='Buscar aparato', on_press=self.buscar_aparato))
         
@@ -328,6 +800,8 @@ class DiagnosticoScreen(Screen):
 
         self.info_aparato = TextInput(multiline=True, readonly=True)
         layout.add_widget(self.info_aparato)
+        # Fotos de cómo llegó el aparato
+        self.agregar_fotos(layout, 'ingreso')
         
         # Campo para el diagnóstico
 
@@ -338,6 +812,17 @@ class DiagnosticoScreen(Screen):
 
         self.valor = TextInput(multiline=False, hint_text='Valor de la reparación')
         layout.add_widget(self.valor)
+
+        # Precio sugerido según lo cobrado por aparatos parecidos
+        self.estimacion = None
+        self.sugerencia = Label(text='')
+        layout.add_widget(self.sugerencia)
+        layout.add_widget(Button(text='Usar precio sugerido', on_press=self.usar_sugerencia))
+
+        # Repuestos, impuestos y descuentos, uno por renglón
+        self.lineas = TextInput(multiline=True,
+                                hint_text='Ítems: tipo; descripción; cantidad; precio (repuesto, mano_obra, impuesto, descuento)')
+        layout.add_widget(self.lineas)
         
         # Botón para guardar
         layout.add_widget(Button(text='Guardar diagnóstico y precio', on_press=self.guardar_diagnostico))
@@ -346,17 +831,30 @@ class DiagnosticoScreen(Screen):
         layout.add_widget(Button(text='Volver al Menú Principal', on_press=self.volver_menu))
         
         self.add_widget(layout)
+        self.seguir_seleccion()
 
     def volver_menu(self, instance):
         self.manager.current = 'menu'    
 
-    def buscar_aparato(self, instance):
-        aparato_id = int(self.aparato_id.text)
-        aparato = self.db.get_aparato(aparato_id)
-        if aparato:
-            self.info_aparato.text = f"Tipo: {aparato[1]}\nMarca: {aparato[2]}\nModelo: {aparato[3]}\nProblema: {aparato[5]}"
-        else:
-            self.info_aparato.text = "Aparato no encontrado"
+    def on_enter(self):
+        # Listo para leer una etiqueta apenas se entra a la pantalla
+        self.aparato_id.focus = True
+
+    def escanear(self, instance):
+        App.get_running_app().abrir_aparato(self.aparato_id.text)
+
+    def mostrar_aparato(self, aparato):
+        self.info_aparato.text = f"Tipo: {aparato.tipo}\nMarca: {aparato.marca}\nModelo: {aparato.modelo}\nProblema: {aparato.problema}"
+        self.estimacion = self.servicio.estimar_precio_aparato(aparato.id)
+        self.sugerencia.text = texto_estimacion(self.estimacion)
+
+    def usar_sugerencia(self, instance):
+        # La mediana como valor y, si no escribió nada, el diagnóstico más común
+        if self.estimacion is None:
+            return
+        self.valor.text = '%.2f' % self.estimacion.mediana
+        if not self.diagnostico.text.strip() and self.estimacion.diagnosticos:
+            self.diagnostico.text = self.estimacion.diagnosticos[0][0]
 
         # Metodo del boton anterior
     #def guardar_diagnostico(self, instance):
@@ -364,8 +862,12 @@ class DiagnosticoScreen(Screen):
         #print("Diagnóstico guardado")    
 
     def guardar_diagnostico(self, instance):
-        aparato_id = int(self.aparato_id.text)
-        self.db.insert_diagnostico(aparato_id, self.diagnostico.text, float(self.valor.text))
+        try:
+            self.servicio.registrar_diagnostico(self.aparato_id.text, self.diagnostico.text, self.valor.text,
+                                                leer_lineas(self.lineas.text))
+        except ErrorServicio as e:
+            print(f"No se pudo guardar el diagnóstico: {e}")
+            return
         print("Diagnóstico guardado")            
 
     def volver_a_registro(self, instance):
@@ -378,9 +880,9 @@ class DiagnosticoScreen(Screen):
     __init__     
 
 
-class AprobacionScreen(Screen):
+class AprobacionScreen(PantallaFlujo):
     def __init__(self, **kwargs):
-        self.db = kwargs.pop('db')  # Base de datos
+        self.servicio = kwargs.pop('servicio')  # Flujo de trabajo (servicio.py)
         super().__init__(**kwargs)
         layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
         layout.add_widget(Label(text='Aprobación del Cliente'))
@@ -406,7 +908,9 @@ class AprobacionScreen(Screen):
 
         # Campo y Botón de búsqueda
 
-        self.aparato_id = TextInput(multiline=False, hint_text='ID del aparato')
+        self.aparato_id = TextInput(multiline=False, hint_text='ID, etiqueta o número de serie',
+                                    text_validate_unfocus=False)
+        self.aparato_id.bind(on_text_validate=self.escanear)
         layout.add_widget(self.aparato_id)
         layout.add_widget(Button(text='Buscar', on_press=self.buscar_aparato))
         
@@ -434,6 +938,7 @@ class AprobacionScreen(Screen):
         layout.add_widget(Button(text='Volver al Menú Principal', on_press=self.volver_menu))
 
         self.add_widget(layout)
+        self.seguir_seleccion()
     
     ##def buscar_aparato(self, instance):
         # Aquí iría la lógica para buscar el aparato
@@ -446,18 +951,25 @@ class AprobacionScreen(Screen):
     def volver_menu(self, instance):
         self.manager.current = 'menu'
 
-    def buscar_aparato(self, instance):
-        aparato_id = int(self.aparato_id.text)
-        aparato = self.db.get_aparato(aparato_id)
-        diagnostico = self.db.get_diagnostico(aparato_id)
-        if aparato and diagnostico:
-            self.info_aparato.text = f"Tipo: {aparato[1]}\nMarca: {aparato[2]}\nModelo: {aparato[3]}\nDiagnóstico: {diagnostico[2]}\nValor: {diagnostico[3]}"
-        else:
+    def on_enter(self):
+        # Listo para leer una etiqueta apenas se entra a la pantalla
+        self.aparato_id.focus = True
+
+    def escanear(self, instance):
+        App.get_running_app().abrir_aparato(self.aparato_id.text)
+
+    def mostrar_aparato(self, aparato):
+        if not aparato.cantidad_diagnosticos:
             self.info_aparato.text = "Información no encontrada"
+            return
+        self.info_aparato.text = f"Tipo: {aparato.tipo}\nMarca: {aparato.marca}\nModelo: {aparato.modelo}\nDiagnóstico: {aparato.diagnostico}\nValor: {aparato.valor}"
 
     def aprobar(self, instance):
-        aparato_id = int(self.aparato_id.text)
-        self.db.update_estado(aparato_id, self.estado.text)
+        try:
+            self.servicio.aprobar(self.aparato_id.text, self.estado.text, origen=self.name)
+        except ErrorServicio as e:
+            print(f"No se pudo actualizar el estado: {e}")
+            return
         print("Estado actualizado")
 
     def ir_a_estado_reparacion(self, instance):
@@ -469,9 +981,9 @@ class AprobacionScreen(Screen):
     __init__    
 
 
-class ReparacionScreen(Screen):
+class ReparacionScreen(PantallaFlujo):
     def __init__(self, **kwargs):
-        self.db = kwargs.pop('db')   # Base de datos
+        self.servicio = kwargs.pop('servicio')  # Flujo de trabajo (servicio.py)
         super().__init__(**kwargs)
         layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
         layout.add_widget(Label(text='Estado de Reparación'))
@@ -496,12 +1008,21 @@ class ReparacionScreen(Screen):
         ##self.observaciones = TextInput(multiline=True)
         ##layout.add_widget(self.observaciones)
 
-        self.aparato_id = TextInput(multiline=False, hint_text='ID del aparato')
+        self.aparato_id = TextInput(multiline=False, hint_text='ID, etiqueta o número de serie',
+                                    text_validate_unfocus=False)
+        self.aparato_id.bind(on_text_validate=self.escanear)
         layout.add_widget(self.aparato_id)
         layout.add_widget(Button(text='Buscar', on_press=self.buscar_aparato))
+
+        # Cola de trabajos: el técnico toma el siguiente aparato aprobado
+        self.tecnico = TextInput(multiline=False, hint_text='Técnico')
+        layout.add_widget(self.tecnico)
+        layout.add_widget(Button(text='Tomar siguiente trabajo', on_press=self.tomar_siguiente))
         
         self.info_aparato = TextInput(multiline=True, readonly=True)
         layout.add_widget(self.info_aparato)
+        # Fotos de cómo quedó, junto a las del ingreso
+        self.agregar_fotos(layout, 'reparado')
         
         self.observaciones = TextInput(multiline=True, hint_text='Observaciones finales')
         layout.add_widget(self.observaciones)
@@ -516,20 +1037,38 @@ class ReparacionScreen(Screen):
         layout.add_widget(Button(text='Volver al Menú Principal', on_press=self.volver_menu))
 
         self.add_widget(layout)
+        self.seguir_seleccion()
 
-    def buscar_aparato(self, instance):
-        aparato_id = int(self.aparato_id.text)
-        aparato = self.db.get_aparato(aparato_id)
-        diagnostico = self.db.get_diagnostico(aparato_id)
-        if aparato and diagnostico:
-            self.info_aparato.text = f"Tipo: {aparato[1]}\nMarca: {aparato[2]}\nModelo: {aparato[3]}\nEstado: {aparato[6]}\nDiagnóstico: {diagnostico[2]}\nValor: {diagnostico[3]}"
-        else:
+    def on_enter(self):
+        # Listo para leer una etiqueta apenas se entra a la pantalla
+        self.aparato_id.focus = True
+
+    def escanear(self, instance):
+        App.get_running_app().abrir_aparato(self.aparato_id.text)
+
+    def mostrar_aparato(self, aparato):
+        if not aparato.cantidad_diagnosticos:
             self.info_aparato.text = "Información no encontrada"
+            return
+        self.info_aparato.text = f"Tipo: {aparato.tipo}\nMarca: {aparato.marca}\nModelo: {aparato.modelo}\nEstado: {aparato.estado}\nDiagnóstico: {aparato.diagnostico}\nValor: {aparato.valor}"
+
+    def tomar_siguiente(self, instance):
+        try:
+            aparato = self.servicio.tomar_siguiente(self.tecnico.text, origen=self.name)
+        except ErrorServicio as e:
+            print(f"No se pudo tomar un trabajo: {e}")
+            return
+        if aparato is None:
+            print("No hay trabajos en cola")
+            return
+        self.almacen.seleccionar(aparato.id)
 
     def marcar_listo(self, instance):
-        # Aquí iría la lógica para marcar el aparato como listo
-        aparato_id = int(self.aparato_id.text)
-        self.db.update_estado(aparato_id, "Listo")
+        try:
+            self.servicio.marcar_listo(self.aparato_id.text, self.observaciones.text, origen=self.name)
+        except ErrorServicio as e:
+            print(f"No se pudo marcar como listo: {e}")
+            return
         print("Aparato marcado como listo")            
 
     def ir_a_entrega_facturacion(self, instance):
@@ -544,9 +1083,10 @@ class ReparacionScreen(Screen):
     __init__    
 
 
-class EntregaFacturacionScreen(Screen):
+class EntregaFacturacionScreen(PantallaFlujo):
     def __init__(self, **kwargs):
-        self.db = kwargs.pop('db')   # Base de datos
+        self.servicio = kwargs.pop('servicio')  # Flujo de trabajo (servicio.py)
+        self.impresion = kwargs.pop('impresion')  # Cola de documentos (documentos.py)
         super().__init__(**kwargs)
         layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
         layout.add_widget(Label(text='Entrega y Facturación'))
@@ -581,57 +1121,63 @@ class EntregaFacturacionScreen(Screen):
         
         ##layout.add_widget(grid)
 
-        self.aparato_id = TextInput(multiline=False, hint_text='ID del aparato')
+        self.aparato_id = TextInput(multiline=False, hint_text='ID, etiqueta o número de serie',
+                                    text_validate_unfocus=False)
+        self.aparato_id.bind(on_text_validate=self.escanear)
         layout.add_widget(self.aparato_id)
         layout.add_widget(Button(text='Buscar', on_press=self.buscar_aparato))
         
         self.info_aparato = TextInput(multiline=True, readonly=True)
         layout.add_widget(self.info_aparato)
+        self.agregar_fotos(layout)
         
         # Botones
         layout.add_widget(Button(text='Facturar', on_press=self.facturar))
         layout.add_widget(Button(text='Imprimir factura', on_press=self.imprimir_factura))
+        layout.add_widget(Button(text='Entregar al cliente', on_press=self.entregar))
         layout.add_widget(Button(text='Volver a Estado de Reparación', on_press=self.volver_a_estado_reparacion))
         layout.add_widget(Button(text='Volver al Menú Principal', on_press=self.volver_menu))
 
         self.add_widget(layout)
+        self.seguir_seleccion()
 
     def volver_menu(self, instance):
         self.manager.current = 'menu'    
 
-    def buscar_aparato(self, instance):
-        aparato_id = int(self.aparato_id.text)
-        aparato = self.db.get_aparato(aparato_id)
-        diagnostico = self.db.get_diagnostico(aparato_id)
-        if aparato and diagnostico:
-            self.info_aparato.text = f"Tipo: {aparato[1]}\nMarca: {aparato[2]}\nModelo: {aparato[3]}\nEstado: {aparato[6]}\nCliente: {aparato[7]}\nTeléfono: {aparato[8]}\nDiagnóstico: {diagnostico[2]}\nValor: {diagnostico[3]}"
-        else:
-            self.info_aparato.text = "Información no encontrada"    
+    def on_enter(self):
+        # Listo para leer una etiqueta apenas se entra a la pantalla
+        self.aparato_id.focus = True
+
+    def escanear(self, instance):
+        App.get_running_app().abrir_aparato(self.aparato_id.text)
+
+    def mostrar_aparato(self, aparato):
+        if not aparato.cantidad_diagnosticos:
+            self.info_aparato.text = "Información no encontrada"
+            return
+        self.info_aparato.text = f"Tipo: {aparato.tipo}\nMarca: {aparato.marca}\nModelo: {aparato.modelo}\nEstado: {aparato.estado}\nCliente: {aparato.nombre_cliente}\nTeléfono: {aparato.telefono_cliente}\nDiagnóstico: {aparato.diagnostico}\nRepuestos: {aparato.repuestos:.2f}  Mano de obra: {aparato.mano_obra:.2f}\nImpuestos: {aparato.impuestos:.2f}  Descuentos: {aparato.descuentos:.2f}\nTotal: {aparato.total:.2f}\n{texto_aviso(self.servicio.avisos(aparato.id))}"
     
     def facturar(self, instance):
-        aparato_id = int(self.aparato_id.text)
-        aparato = self.db.get_aparato(aparato_id)
-        diagnostico = self.db.get_diagnostico(aparato_id)
-        if aparato and diagnostico:
-            factura = f"""
-            FACTURA
-            -------
-            Cliente: {aparato[7]}
-            Teléfono: {aparato[8]}
-            Aparato: {aparato[1]} {aparato[2]} {aparato[3]}
-            Diagnóstico: {diagnostico[2]}
-            Valor: ${diagnostico[3]}
-            """
-            self.factura_actual = factura
-            print("Factura generada")
-        else:
+        try:
+            datos = self.servicio.facturar(self.aparato_id.text)
+        except ErrorServicio:
             print("No se pudo generar la factura")
+            return
+        self.factura_actual = dict(datos, id=datos['aparato_id'])
+        print("Factura generada")
+
+    def entregar(self, instance):
+        try:
+            self.servicio.entregar(self.aparato_id.text, origen='entrega_facturacion')
+        except ErrorServicio as e:
+            print(f"No se pudo entregar: {e}")
+            return
+        print("Aparato entregado")
 
     def imprimir_factura(self, instance):
         if hasattr(self, 'factura_actual'):
-            # En un entorno real, aquí enviarías la factura a una impresora
-            print("Imprimiendo factura:")
-            print(self.factura_actual)
+            self.impresion.encolar('factura', self.factura_actual, al_terminar=avisar_impresion)
+            print("Imprimiendo factura")
         else:
             print("No hay factura para imprimir")
      
@@ -641,5 +1187,77 @@ class EntregaFacturacionScreen(Screen):
     __init__    
 
 
+class TableroScreen(Screen):
+    PERIODOS = {'Por día': 'dia', 'Por semana': 'semana', 'Por mes': 'mes'}
+
+    def __init__(self, **kwargs):
+        self.servicio = kwargs.pop('servicio')  # Flujo de trabajo (servicio.py)
+        super().__init__(**kwargs)
+        layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
+        layout.add_widget(Label(text='Tablero del taller', size_hint_y=None, height=40))
+
+        controles = BoxLayout(size_hint_y=None, height=50, spacing=10)
+        self.periodo = Spinner(text='Por día', values=list(self.PERIODOS))
+        self.periodo.bind(text=lambda *args: self.actualizar(None))
+        controles.add_widget(self.periodo)
+        controles.add_widget(Button(text='Actualizar', on_press=self.actualizar))
+        layout.add_widget(controles)
+
+        self.resumen = TextInput(multiline=True, readonly=True)
+        layout.add_widget(self.resumen)
+        layout.add_widget(Button(text='Volver al Menú Principal', size_hint_y=None, height=50,
+                                 on_press=self.volver_menu))
+        self.add_widget(layout)
+        self.calculando = False
+
+    def volver_menu(self, instance):
+        self.manager.current = 'menu'
+
+    def on_enter(self):
+        self.actualizar(None)
+
+    def actualizar(self, instance):
+        # Las consultas corren en otro hilo; con la caché del tablero la
+        # respuesta suele llegar en el mismo cuadro
+        if self.calculando:
+            return
+        self.calculando = True
+        periodo = self.PERIODOS[self.periodo.text]
+        threading.Thread(target=self.calcular, args=(periodo,), daemon=True).start()
+
+    def calcular(self, periodo):
+        try:
+            datos, error = self.servicio.tablero(periodo), None
+        except Exception as e:
+            datos, error = None, e
+        Clock.schedule_once(lambda dt: self.mostrar(datos, error))
+
+    def mostrar(self, datos, error):
+        self.calculando = False
+        if error is not None:
+            self.resumen.text = f"No se pudo cargar el tablero: {error}"
+            return
+        lineas = ['APARATOS POR ESTADO']
+        for estado, en_cola, promedio in datos['por_estado']:
+            tiempo = f"{promedio / 3600:.1f} h promedio" if promedio is not None else "sin salidas"
+            lineas.append(f"  {estado or '(sin estado)'}: {en_cola}  ({tiempo})")
+        lineas.append('')
+        lineas.append('INGRESOS')
+        for periodo, cantidad, total in datos['ingresos']:
+            lineas.append(f"  {periodo}: ${total:,.2f}  ({cantidad} diagnósticos)")
+        lineas.append('')
+        lineas.append('MARCAS MÁS FRECUENTES')
+        lineas.extend(f"  {marca}: {cantidad}" for marca, cantidad in datos['top_marcas'])
+        lineas.append('')
+        lineas.append('TIPOS MÁS FRECUENTES')
+        lineas.extend(f"  {tipo}: {cantidad}" for tipo, cantidad in datos['top_tipos'])
+        lineas.append('')
+        lineas.append('REPARACIONES ATRASADAS')
+        for aparato_id, tipo, marca, estado, ingreso in datos['atrasados']:
+            dias = (time.time() - ingreso) / 86400
+            lineas.append(f"  {aparato_id} {tipo} {marca} - {estado}, hace {dias:.0f} días")
+        self.resumen.text = '\n'.join(lineas)
+
+
 if __name__ == '__main__':
     GestionApp().run()
\ No newline at end of file
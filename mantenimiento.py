@@ -0,0 +1,351 @@
+import argparse
+import glob
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from adjuntos import DirectorioAdjuntos
+from database import ARCHIVANDO, ESPERA_BLOQUEO, DatabaseManager, configurar_conexion
+from servicio import ESTADO_ENTREGADO
+
+# Mantenimiento de la base en segundo plano: estadísticas del planificador
+# (PRAGMA optimize / ANALYZE), vacuum incremental, respaldos en caliente con
+# la API de backup de sqlite3, archivo de los aparatos entregados hace
+# tiempo en una base aparte y limpieza de las fotos que ya nadie usa. Corre
+# en un hilo con su propia conexión, solo cuando la aplicación lleva un rato
+# sin uso, y cada tarea avanza por pasos cortos: si el usuario vuelve, se
+# detiene después del paso en curso y se retoma en el próximo rato libre.
+#
+#   python mantenimiento.py [--db RUTA] [--vacuum-completo] [optimizar compactar respaldar archivar limpiar_adjuntos]
+
+ESPERA_INACTIVIDAD = 60.0          # segundos sin tocar la aplicación
+REVISION = 5.0                     # cada cuánto revisa el hilo si hay algo que hacer
+# Segundos entre corridas de cada tarea, en el orden en que conviene
+# correrlas: lo archivado deja páginas libres para compactar, y el respaldo
+# sale más chico después
+INTERVALOS = {
+    'archivar': 24 * 3600,
+    'limpiar_adjuntos': 24 * 3600,
+    'compactar': 24 * 3600,
+    'optimizar': 6 * 3600,
+    'respaldar': 24 * 3600,
+}
+ESTADOS_ARCHIVABLES = (ESTADO_ENTREGADO,)
+DIAS_ARCHIVO = 30                  # entregados hace más de esto salen de la base de trabajo
+LOTE_ARCHIVO = 500                 # aparatos por transacción al archivar
+PAGINAS_POR_PASO = 1024            # de vacuum incremental y de backup
+RESPALDOS_GUARDADOS = 7
+LIMITE_ANALISIS = 1000             # PRAGMA analysis_limit: ANALYZE por muestreo
+DIRECTORIO_RESPALDOS_POR_DEFECTO = 'respaldos'
+# Una foto recién copiada puede estar todavía por registrarse en la base
+ANTIGUEDAD_ADJUNTOS_SIN_USO = 24 * 3600
+
+# Tablas que se mudan a la base de archivo, con la columna del aparato
+TABLAS_ARCHIVO = (
+    ('aparatos', 'id'),
+    ('diagnosticos', 'aparato_id'),
+    ('lineas_diagnostico', 'aparato_id'),
+    ('historial_estados', 'aparato_id'),
+    ('adjuntos', 'aparato_id'),
+    ('avisos', 'aparato_id'),
+)
+
+
+class Interrumpido(Exception):
+    pass
+
+
+def ruta_archivo(db_path):
+    raiz, extension = os.path.splitext(db_path)
+    return raiz + '_archivo' + (extension or '.db')
+
+
+class Mantenimiento:
+    def __init__(self, db_path, directorio_respaldos=None, archivo=None, dias_archivo=DIAS_ARCHIVO,
+                 inactividad=ESPERA_INACTIVIDAD, al_terminar=None, adjuntos=None, vacuum_completo=False):
+        if directorio_respaldos is None:
+            directorio_respaldos = os.environ.get('REPARACIONES_RESPALDOS', DIRECTORIO_RESPALDOS_POR_DEFECTO)
+        self.db_path = db_path
+        self.directorio_respaldos = directorio_respaldos
+        self.archivo = archivo or ruta_archivo(db_path)
+        self.dias_archivo = dias_archivo
+        self.adjuntos = adjuntos or DirectorioAdjuntos()
+        self.inactividad = inactividad
+        self.vacuum_completo = vacuum_completo
+        # al_terminar(tarea, resultado) se llama desde el hilo de mantenimiento
+        self.al_terminar = al_terminar
+        self.ultima_actividad = time.monotonic()
+        self.cerrado = False
+        self.despertar = threading.Event()
+        self.conn = None
+        self.hilo = None
+
+    # Hilo
+
+    def iniciar(self):
+        self.hilo = threading.Thread(target=self.trabajar, name='mantenimiento', daemon=True)
+        self.hilo.start()
+
+    def actividad(self, *args):
+        # Lo llama la interfaz en cada toque o tecla
+        self.ultima_actividad = time.monotonic()
+
+    def inactiva(self):
+        return time.monotonic() - self.ultima_actividad >= self.inactividad
+
+    def revisar(self):
+        # Entre paso y paso: se corta si el usuario volvió o se cierra la app
+        if self.cerrado or not self.inactiva():
+            raise Interrumpido()
+
+    def trabajar(self):
+        while not self.cerrado:
+            self.despertar.wait(REVISION)
+            if self.cerrado or not self.inactiva():
+                continue
+            for tarea in self.pendientes():
+                try:
+                    self.ejecutar(tarea, self.revisar)
+                except Interrumpido:
+                    break
+                except sqlite3.Error as e:
+                    print(f"Mantenimiento: {tarea} falló: {e}")
+        if self.conn is not None:
+            self.conn.close()
+
+    def cerrar(self):
+        self.cerrado = True
+        self.despertar.set()
+        if self.hilo is not None:
+            self.hilo.join()
+
+    # Tareas
+
+    def conexion(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.db_path, timeout=ESPERA_BLOQUEO, isolation_level=None,
+                                        check_same_thread=False)
+            configurar_conexion(self.conn)
+        return self.conn
+
+    def ultima_corrida(self, tarea):
+        fila = self.conexion().execute('SELECT valor FROM ajustes WHERE clave = ?',
+                                       ('mantenimiento_' + tarea,)).fetchone()
+        return fila[0] if fila else 0
+
+    def pendientes(self):
+        ahora = time.time()
+        return [tarea for tarea, intervalo in INTERVALOS.items() if ahora - self.ultima_corrida(tarea) >= intervalo]
+
+    def ejecutar(self, tarea, revisar=None):
+        # Corre una tarea completa (revisar=None: sin interrupciones, desde la
+        # línea de comandos o un benchmark) y anota cuándo terminó
+        revisar = revisar or (lambda: None)
+        inicio = time.perf_counter()
+        resultado = getattr(self, tarea)(revisar)
+        self.conexion().execute('INSERT OR REPLACE INTO ajustes (clave, valor) VALUES (?, ?)',
+                                ('mantenimiento_' + tarea, time.time()))
+        resultado['segundos'] = round(time.perf_counter() - inicio, 3)
+        if self.al_terminar:
+            self.al_terminar(tarea, resultado)
+        return resultado
+
+    def optimizar(self, revisar):
+        # Sin estadísticas previas optimize no analiza nada: la primera vez ANALYZE
+        conn = self.conexion()
+        conn.execute('PRAGMA analysis_limit = %d' % LIMITE_ANALISIS)
+        tenia = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+        conn.execute('PRAGMA optimize' if tenia else 'ANALYZE')
+        return {'analisis': 'optimize' if tenia else 'analyze'}
+
+    def compactar(self, revisar):
+        conn = self.conexion()
+        libres = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            # Bases creadas antes del vacuum incremental: hace falta un VACUUM
+            # completo, una sola vez, para poder hacerlo por pasos de ahí en
+            # adelante. Reescribe toda la base con el bloqueo de escritura
+            # tomado, así que en segundo plano solo se avisa; se corre a pedido
+            # (python mantenimiento.py --vacuum-completo compactar).
+            if not self.vacuum_completo:
+                return {'paginas_liberadas': 0, 'paginas_libres': libres, 'falta_vacuum_completo': True}
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+            return {'paginas_liberadas': libres, 'vacuum_completo': True}
+        liberadas = 0
+        while libres > 0:
+            revisar()
+            # incremental_vacuum libera una página por cada paso de la
+            # sentencia y execute() da uno solo; executescript la corre entera
+            conn.executescript('PRAGMA incremental_vacuum(%d)' % PAGINAS_POR_PASO)
+            restantes = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            liberadas += libres - restantes
+            libres = restantes
+        # Devuelve al disco el WAL que quedó grande
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return {'paginas_liberadas': liberadas, 'vacuum_completo': False}
+
+    def respaldar(self, revisar):
+        # Copia consistente con la API de backup, por pasos; si otra conexión
+        # escribe en el medio, sqlite3 reinicia la copia sola
+        os.makedirs(self.directorio_respaldos, exist_ok=True)
+        nombre = os.path.splitext(os.path.basename(self.db_path))[0]
+        ruta = os.path.join(self.directorio_respaldos, '%s-%s.db' % (nombre, time.strftime('%Y%m%d-%H%M%S')))
+        temporal = ruta + '.tmp'
+        destino = sqlite3.connect(temporal)
+        try:
+            try:
+                self.conexion().backup(destino, pages=PAGINAS_POR_PASO, progress=lambda *args: revisar())
+            finally:
+                destino.close()
+            os.replace(temporal, ruta)
+        except BaseException:
+            # Interrumpido o fallido: la copia a medias no sirve
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+        respaldos = sorted(glob.glob(os.path.join(self.directorio_respaldos, nombre + '-*.db')))
+        for viejo in respaldos[:-RESPALDOS_GUARDADOS]:
+            os.remove(viejo)
+        return {'ruta': ruta, 'bytes': os.path.getsize(ruta)}
+
+    def preparar_archivo(self, conn):
+        conn.execute('ATTACH DATABASE ? AS archivo', (self.archivo,))
+        for tabla, _ in TABLAS_ARCHIVO:
+            conn.execute('CREATE TABLE IF NOT EXISTS archivo.%s AS SELECT * FROM main.%s WHERE 0' % (tabla, tabla))
+            conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS archivo.idx_%s_id ON %s (id)' % (tabla, tabla))
+            # Columnas agregadas a la base de trabajo después de crear el archivo
+            existentes = {fila[1] for fila in conn.execute('PRAGMA archivo.table_info(%s)' % tabla)}
+            for fila in conn.execute('PRAGMA main.table_info(%s)' % tabla).fetchall():
+                if fila[1] not in existentes:
+                    conn.execute('ALTER TABLE archivo.%s ADD COLUMN %s' % (tabla, fila[1]))
+        conn.execute('CREATE INDEX IF NOT EXISTS archivo.idx_archivo_diagnosticos_aparato ON diagnosticos (aparato_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS archivo.idx_archivo_adjuntos_hash ON adjuntos (hash)')
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS lote_archivo (id INTEGER PRIMARY KEY)')
+
+    def archivar(self, revisar):
+        # Por lotes: cada lote se copia a la base de archivo y se borra de la
+        # de trabajo en una transacción. INSERT OR REPLACE en el archivo hace
+        # que repetir un lote interrumpido no duplique nada.
+        conn = self.conexion()
+        self.preparar_archivo(conn)
+        limite = time.time() - self.dias_archivo * 86400
+        estados = ', '.join('?' * len(ESTADOS_ARCHIVABLES))
+        archivados = 0
+        try:
+            while True:
+                revisar()
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    conn.execute('DELETE FROM lote_archivo')
+                    conn.execute('''
+                        INSERT INTO lote_archivo (id)
+                        SELECT a.id FROM aparatos a
+                        WHERE a.estado IN (%s)
+                          AND COALESCE((SELECT MAX(h.fecha) FROM historial_estados h WHERE h.aparato_id = a.id), 0) < ?
+                        LIMIT ?
+                    ''' % estados, ESTADOS_ARCHIVABLES + (limite, LOTE_ARCHIVO))
+                    cantidad = conn.execute('SELECT COUNT(*) FROM lote_archivo').fetchone()[0]
+                    if cantidad:
+                        self.mover_lote(conn)
+                    conn.execute('COMMIT')
+                except BaseException:
+                    conn.execute('ROLLBACK')
+                    raise
+                archivados += cantidad
+                if cantidad < LOTE_ARCHIVO:
+                    break
+        finally:
+            conn.execute('DETACH DATABASE archivo')
+        return {'archivados': archivados, 'archivo': self.archivo}
+
+    def mover_lote(self, conn):
+        for tabla, columna in TABLAS_ARCHIVO:
+            columnas = ', '.join(fila[1] for fila in conn.execute('PRAGMA main.table_info(%s)' % tabla))
+            conn.execute('INSERT OR REPLACE INTO archivo.%s (%s) SELECT %s FROM main.%s WHERE %s IN lote_archivo'
+                         % (tabla, columnas, columnas, tabla, columna))
+        # Salen de la cola de su estado; promedios e ingresos no cambian
+        for estado, cantidad in conn.execute('''
+                SELECT COALESCE(estado, ''), COUNT(*) FROM aparatos WHERE id IN lote_archivo GROUP BY 1
+                ''').fetchall():
+            conn.execute('UPDATE estadisticas_estados SET en_cola = en_cola - ? WHERE estado = ?', (cantidad, estado))
+        conn.execute('DELETE FROM cambios WHERE tabla = ? AND fila_id IN lote_archivo', ('aparatos',))
+        conn.execute('''DELETE FROM cambios WHERE tabla = 'diagnosticos'
+                        AND fila_id IN (SELECT id FROM diagnosticos WHERE aparato_id IN lote_archivo)''')
+        conn.execute('''DELETE FROM cambios WHERE tabla = 'lineas_diagnostico'
+                        AND fila_id IN (SELECT id FROM lineas_diagnostico WHERE aparato_id IN lote_archivo)''')
+        # Con la marca puesta no corren los triggers de ingresos, conteos,
+        # precios y sincronización (ver DatabaseManager.create_archive_support)
+        conn.execute('INSERT INTO ajustes (clave, valor) VALUES (?, 1)', (ARCHIVANDO,))
+        # Los totales primero: los triggers de diagnósticos ya no tienen qué actualizar
+        conn.execute('DELETE FROM totales_aparatos WHERE aparato_id IN lote_archivo')
+        for tabla, columna in reversed(TABLAS_ARCHIVO):
+            conn.execute('DELETE FROM main.%s WHERE %s IN lote_archivo' % (tabla, columna))
+        conn.execute('DELETE FROM ajustes WHERE clave = ?', (ARCHIVANDO,))
+
+    def limpiar_adjuntos(self, revisar):
+        # Borra los archivos de fotos que no usa ningún adjunto, ni de la
+        # base de trabajo ni de la de archivo. Una carpeta del directorio
+        # (las dos primeras cifras del hash) por paso.
+        conn = self.conexion()
+        bases = ['main']
+        con_archivo = os.path.exists(self.archivo)
+        if con_archivo:
+            conn.execute('ATTACH DATABASE ? AS archivo', (self.archivo,))
+            if conn.execute("SELECT 1 FROM archivo.sqlite_master WHERE name = 'adjuntos'").fetchone():
+                bases.append('archivo')
+        limite = time.time() - ANTIGUEDAD_ADJUNTOS_SIN_USO
+        borrados = liberados = 0
+        try:
+            for carpeta in sorted(glob.glob(os.path.join(self.adjuntos.directorio, '[0-9a-f][0-9a-f]'))):
+                revisar()
+                prefijo = os.path.basename(carpeta)
+                candidatos = {prefijo + nombre: os.path.join(carpeta, nombre) for nombre in os.listdir(carpeta)
+                              if os.path.getmtime(os.path.join(carpeta, nombre)) < limite}
+                if not candidatos:
+                    continue
+                en_uso = set()
+                lista = ','.join('?' * len(candidatos))
+                for base in bases:
+                    en_uso.update(fila[0] for fila in conn.execute(
+                        'SELECT DISTINCT hash FROM %s.adjuntos WHERE hash IN (%s)' % (base, lista), list(candidatos)))
+                for hash_archivo in candidatos.keys() - en_uso:
+                    liberados += os.path.getsize(candidatos[hash_archivo])
+                    self.adjuntos.borrar(hash_archivo)
+                    borrados += 1
+            # Copias interrumpidas
+            for temporal in glob.glob(os.path.join(self.adjuntos.directorio, '*.tmp')):
+                if os.path.getmtime(temporal) < limite:
+                    os.remove(temporal)
+        finally:
+            if con_archivo:
+                conn.execute('DETACH DATABASE archivo')
+        return {'borrados': borrados, 'bytes': liberados}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Mantenimiento de la base de reparaciones')
+    parser.add_argument('--db', default=None, help='Ruta de la base (por defecto REPARACIONES_DB o reparaciones.db)')
+    parser.add_argument('--respaldos', default=None, help='Carpeta de respaldos')
+    parser.add_argument('--adjuntos', default=None, help='Carpeta de las fotos de los aparatos')
+    parser.add_argument('--dias-archivo', type=int, default=DIAS_ARCHIVO)
+    parser.add_argument('--vacuum-completo', action='store_true',
+                        help='Permite a compactar hacer el VACUUM completo que necesitan las bases viejas')
+    parser.add_argument('tareas', nargs='*', choices=list(INTERVALOS), default=list(INTERVALOS))
+    args = parser.parse_args(argv)
+
+    # Abrir con DatabaseManager aplica las migraciones pendientes
+    db = DatabaseManager(args.db)
+    db.close()
+    mantenimiento = Mantenimiento(db.db_path, args.respaldos, dias_archivo=args.dias_archivo,
+                                  adjuntos=DirectorioAdjuntos(args.adjuntos), vacuum_completo=args.vacuum_completo)
+    for tarea in args.tareas:
+        print(f"{tarea}: {mantenimiento.ejecutar(tarea)}")
+    mantenimiento.conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
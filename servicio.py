@@ -0,0 +1,308 @@
+import getpass
+import os
+import time
+
+from adjuntos import DirectorioAdjuntos, EXTENSIONES_IMAGEN
+from database import (DatabaseManager, PERIODOS_TABLERO, TIPOS_LINEA, ESTADO_EN_COLA, ESTADO_EN_TRABAJO,
+                      ESTADO_LISTO, ESTADO_ENTREGADO, ESTADOS_TERMINADOS, POLITICAS_TRABAJOS, ETAPAS_ADJUNTO)
+from documentos import PREFIJO_ETIQUETA
+
+# Flujo de trabajo del taller sin dependencias de la interfaz: lo usan las
+# pantallas de Kivy y la API HTTP (api.py)
+
+ESTADO_RECIBIDO = 'Recibido'
+ESTADOS_APROBACION = ('Revisado', ESTADO_EN_COLA, ESTADO_EN_TRABAJO)
+DIAS_ATRASO = 7
+
+
+class ErrorServicio(Exception):
+    pass
+
+
+class AparatoNoEncontrado(ErrorServicio):
+    pass
+
+
+class ClienteNoEncontrado(ErrorServicio):
+    pass
+
+
+class FotoNoEncontrada(ErrorServicio):
+    pass
+
+
+class DatosInvalidos(ErrorServicio):
+    pass
+
+
+def leer_id(valor):
+    try:
+        return int(str(valor).strip())
+    except ValueError:
+        raise DatosInvalidos(f"ID de aparato inválido: {valor!r}")
+
+
+def leer_valor(valor):
+    try:
+        return float(str(valor).strip().replace(',', '.'))
+    except ValueError:
+        raise DatosInvalidos(f"Valor inválido: {valor!r}")
+
+
+def leer_linea(linea):
+    # (tipo, descripcion, cantidad, precio); acepta cadenas como las que
+    # llegan de la pantalla o de la API
+    try:
+        tipo, descripcion, cantidad, precio = linea
+    except (TypeError, ValueError):
+        raise DatosInvalidos(f"Línea inválida: {linea!r}")
+    tipo = str(tipo).strip().lower().replace(' ', '_')
+    if tipo not in TIPOS_LINEA:
+        raise DatosInvalidos(f"Tipo de línea inválido: {tipo!r} (use {', '.join(TIPOS_LINEA)})")
+    return tipo, str(descripcion).strip(), leer_valor(cantidad), leer_valor(precio)
+
+
+def leer_lineas(texto):
+    # Una línea por ítem: "tipo; descripción; cantidad; precio"
+    return [leer_linea([campo.strip() for campo in renglon.split(';')])
+            for renglon in texto.splitlines() if renglon.strip()]
+
+
+def leer_tecnico(valor):
+    nombre = ' '.join(str(valor or '').split())
+    if not nombre:
+        raise DatosInvalidos("Debe indicar el técnico")
+    return nombre
+
+
+def usuario_sistema():
+    try:
+        return getpass.getuser()
+    except Exception:
+        return None
+
+
+class ServicioReparaciones:
+    def __init__(self, db=None, usuario=None, adjuntos=None):
+        self.db = db if db is not None else DatabaseManager()
+        # Directorio de los archivos de fotos (adjuntos.py)
+        self.adjuntos = adjuntos or DirectorioAdjuntos()
+        # Queda en el historial de estados junto con la pantalla o el cliente
+        self.usuario = usuario or usuario_sistema()
+
+    # Registro
+
+    def registrar_aparato(self, tipo, marca, modelo, numero_serie, problema, estado,
+                          nombre_cliente, telefono_cliente, origen=None, usuario=None):
+        return self.db.insert_aparato(tipo, marca, modelo, numero_serie, problema,
+                                      estado or ESTADO_RECIBIDO, nombre_cliente, telefono_cliente,
+                                      origen=origen, usuario=usuario or self.usuario)
+
+    # Clientes
+
+    def buscar_clientes(self, texto, limit=10):
+        return self.db.buscar_clientes(texto.strip(), limit)
+
+    def aparatos_de_cliente(self, cliente_id, limit=100):
+        cliente = self.db.get_cliente(leer_id(cliente_id))
+        if cliente is None:
+            raise ClienteNoEncontrado(f"Cliente {cliente_id} no encontrado")
+        return cliente, self.db.get_aparatos_cliente(cliente[0], limit)
+
+    # Consultas
+
+    def consultar(self, aparato_id):
+        aparato = self.db.get_aparato_detalle(leer_id(aparato_id))
+        if aparato is None:
+            raise AparatoNoEncontrado(f"Aparato {aparato_id} no encontrado")
+        return aparato
+
+    def resolver_codigo(self, codigo):
+        # Acepta lo que entrega el lector del mostrador: el código de la
+        # etiqueta (AP000123), un ID escrito a mano o un número de serie
+        codigo = str(codigo).strip()
+        if not codigo:
+            raise DatosInvalidos("Código vacío")
+        numero = codigo[len(PREFIJO_ETIQUETA):] if codigo.upper().startswith(PREFIJO_ETIQUETA) else codigo
+        # isdigit() acepta '²' y otros dígitos que int() no lee; más de 18
+        # cifras no entran en un INTEGER de SQLite (será un número de serie)
+        if numero.isascii() and numero.isdecimal() and len(numero) <= 18:
+            aparato = self.db.get_aparato_detalle(int(numero))
+            if aparato is not None:
+                return aparato
+        aparato_id = self.db.get_aparato_id_por_serie(codigo)
+        if aparato_id is None:
+            raise AparatoNoEncontrado(f"Ningún aparato con código o número de serie {codigo!r}")
+        return self.db.get_aparato_detalle(aparato_id)
+
+    def consultar_diagnosticado(self, aparato_id):
+        aparato = self.consultar(aparato_id)
+        if not aparato.cantidad_diagnosticos:
+            raise DatosInvalidos(f"El aparato {aparato.id} no tiene diagnóstico")
+        return aparato
+
+    def historial(self, aparato_id):
+        aparato = self.consultar(aparato_id)
+        return self.db.get_historial_estados(aparato.id)
+
+    def avisos(self, aparato_id):
+        # Avisos al cliente del aparato y en qué quedó cada uno (avisos.py)
+        aparato = self.consultar(aparato_id)
+        return self.db.get_avisos_aparato(aparato.id)
+
+    def estadisticas_estados(self):
+        return self.db.get_estadisticas_estados()
+
+    def tablero(self, periodo='dia', dias_atraso=DIAS_ATRASO):
+        # Puede llamarse desde otro hilo: todas las consultas van por la
+        # conexión de lectura y quedan en la caché del tablero
+        if periodo not in PERIODOS_TABLERO:
+            raise DatosInvalidos(f"Período inválido: {periodo!r} (use {', '.join(PERIODOS_TABLERO)})")
+        por_estado = self.db.get_aparatos_por_estado()
+        en_curso = [fila[0] for fila in por_estado if fila[1] and fila[0] not in ESTADOS_TERMINADOS]
+        return {
+            'por_estado': por_estado,
+            'ingresos': self.db.get_ingresos_por_periodo(periodo),
+            'top_marcas': self.db.get_top_marcas(),
+            'top_tipos': self.db.get_top_tipos(),
+            'atrasados': self.db.get_aparatos_atrasados(en_curso, time.time() - dias_atraso * 86400),
+        }
+
+    def listar(self, after_id=0, limit=100):
+        return self.db.get_aparatos_page(after_id, limit)
+
+    def buscar(self, texto, limit=100):
+        return self.db.search_aparatos(texto, limit)
+
+    # Diagnóstico
+
+    def registrar_diagnostico(self, aparato_id, diagnostico, valor, lineas=()):
+        # valor es la mano de obra del diagnóstico; puede quedar vacío si
+        # el detalle viene en lineas
+        aparato = self.consultar(aparato_id)
+        lineas = [leer_linea(linea) for linea in lineas]
+        valor = leer_valor(valor) if str(valor).strip() or not lineas else 0
+        return self.db.insert_diagnostico(aparato.id, diagnostico, valor, lineas)
+
+    def agregar_linea(self, aparato_id, tipo, descripcion, cantidad, precio):
+        # Se suma al último diagnóstico del aparato
+        aparato = self.consultar_diagnosticado(aparato_id)
+        return self.db.insert_linea(aparato.id, *leer_linea((tipo, descripcion, cantidad, precio)))
+
+    def estimar_precio(self, tipo, marca='', modelo=''):
+        # Sugerencia para el diagnóstico según lo cobrado antes; None si no
+        # hay suficientes diagnósticos ni del tipo
+        if not str(tipo or '').strip():
+            raise DatosInvalidos("Falta el tipo de aparato")
+        return self.db.estimar_precio(tipo, marca, modelo)
+
+    def estimar_precio_aparato(self, aparato_id):
+        aparato = self.consultar(aparato_id)
+        return self.db.estimar_precio(aparato.tipo, aparato.marca, aparato.modelo)
+
+    # Aprobación y reparación
+
+    def cambiar_estado(self, aparato_id, estado, origen=None, usuario=None):
+        aparato = self.consultar(aparato_id)
+        if not estado:
+            raise DatosInvalidos("Debe indicar el estado")
+        usuario = usuario or self.usuario
+        self.db.update_estado(aparato.id, estado, origen, usuario)
+
+    def aprobar(self, aparato_id, estado, origen=None, usuario=None):
+        if estado not in ESTADOS_APROBACION:
+            raise DatosInvalidos(f"Estado de aprobación inválido: {estado!r}")
+        self.cambiar_estado(aparato_id, estado, origen, usuario)
+
+    def marcar_listo(self, aparato_id, observaciones=None, origen=None, usuario=None):
+        aparato = self.consultar(aparato_id)
+        with self.db.transaction():
+            if observaciones:
+                self.db.update_observaciones(aparato.id, observaciones)
+            self.db.update_estado(aparato.id, ESTADO_LISTO, origen, usuario or self.usuario)
+
+    def guardar_observaciones(self, aparato_id, observaciones):
+        aparato = self.consultar(aparato_id)
+        self.db.update_observaciones(aparato.id, observaciones)
+
+    # Cola de trabajos
+
+    def tomar_siguiente(self, tecnico, origen=None):
+        # El técnico toma el primer aparato de la cola; None si está vacía
+        tecnico = leer_tecnico(tecnico)
+        with self.db.transaction():
+            aparato_id = self.db.tomar_trabajo(self.db.get_tecnico_id(tecnico))
+            if aparato_id is None:
+                return None
+            self.db.update_estado(aparato_id, ESTADO_EN_TRABAJO, origen, tecnico)
+        return self.db.get_aparato_detalle(aparato_id)
+
+    def cola_trabajos(self, limit=50):
+        return self.db.get_cola_trabajos(limit)
+
+    def trabajos_de(self, tecnico):
+        return self.db.get_trabajos_tecnico(self.db.get_tecnico_id(leer_tecnico(tecnico)))
+
+    def cambiar_politica(self, politica):
+        if politica not in POLITICAS_TRABAJOS:
+            raise DatosInvalidos(f"Política inválida: {politica!r} (use {', '.join(POLITICAS_TRABAJOS)})")
+        self.db.cambiar_politica_trabajos(politica)
+
+    def prioridad_cliente(self, cliente_id, prioridad):
+        try:
+            prioridad = int(str(prioridad).strip())
+        except ValueError:
+            raise DatosInvalidos(f"Prioridad inválida: {prioridad!r}")
+        if not self.db.update_prioridad_cliente(leer_id(cliente_id), prioridad):
+            raise ClienteNoEncontrado(f"Cliente {cliente_id} no encontrado")
+
+    # Fotos
+
+    def adjuntar_foto(self, aparato_id, ruta, etapa=ETAPAS_ADJUNTO[0]):
+        # Copia la imagen al directorio de adjuntos (una vez por contenido)
+        aparato = self.consultar(aparato_id)
+        if etapa not in ETAPAS_ADJUNTO:
+            raise DatosInvalidos(f"Etapa inválida: {etapa!r} (use {', '.join(ETAPAS_ADJUNTO)})")
+        ruta = str(ruta or '').strip()
+        if not os.path.isfile(ruta):
+            raise DatosInvalidos(f"No existe el archivo {ruta!r}")
+        if not ruta.lower().endswith(EXTENSIONES_IMAGEN):
+            raise DatosInvalidos(f"No es una imagen ({', '.join(EXTENSIONES_IMAGEN)}): {ruta!r}")
+        hash_archivo, tamano, _ = self.adjuntos.guardar(ruta)
+        return self.db.insert_adjunto(aparato.id, hash_archivo, os.path.basename(ruta), tamano, etapa)
+
+    def fotos(self, aparato_id):
+        aparato = self.consultar(aparato_id)
+        return self.db.get_adjuntos_aparato(aparato.id)
+
+    def quitar_foto(self, adjunto_id):
+        if self.db.delete_adjunto(leer_id(adjunto_id)) is None:
+            raise FotoNoEncontrada(f"Foto {adjunto_id} no encontrada")
+
+    # Entrega y facturación
+
+    def entregar(self, aparato_id, origen=None, usuario=None):
+        # Solo lo que está listo; pasado un tiempo lo archiva mantenimiento.py
+        aparato = self.consultar(aparato_id)
+        if aparato.estado != ESTADO_LISTO:
+            raise DatosInvalidos(f"El aparato {aparato.id} no está listo para entregar ({aparato.estado})")
+        self.db.update_estado(aparato.id, ESTADO_ENTREGADO, origen, usuario or self.usuario)
+
+    def facturar(self, aparato_id):
+        # Los totales salen del renglón precalculado del aparato; las líneas
+        # solo se listan
+        aparato = self.consultar_diagnosticado(aparato_id)
+        campos = ('diagnostico_id', 'tipo', 'descripcion', 'cantidad', 'precio', 'importe')
+        return {
+            'aparato_id': aparato.id,
+            'cliente': aparato.nombre_cliente,
+            'telefono': aparato.telefono_cliente,
+            'aparato': f"{aparato.tipo} {aparato.marca} {aparato.modelo}",
+            'diagnostico': aparato.diagnostico,
+            'lineas': [dict(zip(campos, fila)) for fila in self.db.get_lineas_aparato(aparato.id)],
+            'repuestos': aparato.repuestos,
+            'mano_obra': aparato.mano_obra,
+            'impuestos': aparato.impuestos,
+            'descuentos': aparato.descuentos,
+            'valor': aparato.total,
+        }
@@ -0,0 +1,318 @@
+import argparse
+import gzip
+import json
+import sys
+import time
+
+from database import DatabaseManager, TABLAS_SINCRONIZADAS
+
+# Sincronización entre sucursales sin red: cada una exporta a un archivo
+# (paquete) las filas que cambiaron desde el último envío a la otra, y la otra
+# lo importa. El paquete es JSON por líneas comprimido con gzip: un
+# encabezado y una línea por fila cambiada o borrada, así que su tamaño
+# depende de los cambios y no del tamaño de la base.
+#
+# Reglas de conflicto, las mismas en todas las sucursales para que converjan:
+#   - Cada fila se compara entera por (fecha del último cambio, sucursal
+#     autora): gana la más reciente y, a igual fecha, la sucursal mayor.
+#   - Un borrado es un cambio más: gana si es más reciente que la última
+#     modificación, y una modificación posterior revive la fila.
+#   - Las líneas de diagnóstico no se modifican, solo se agregan o borran;
+#     diagnosticos.valor y los totales se recalculan en cada base.
+#   - Los ids locales no viajan: las referencias usan el id global
+#     "sucursal-id" de la fila.
+#
+#   python sincronizacion.py sucursal
+#   python sincronizacion.py exportar --para ID_OTRA_SUCURSAL paquete.json.gz
+#   python sincronizacion.py importar paquete.json.gz
+
+FORMATO_PAQUETE = 1
+
+# Columnas que viajan de cada tabla; las terminadas en _uid son referencias
+# a otra tabla sincronizada y se traducen al id local al importar
+COLUMNAS = {
+    'aparatos': ('tipo', 'marca', 'modelo', 'numero_serie', 'problema', 'estado',
+                 'nombre_cliente', 'telefono_cliente', 'observaciones'),
+    'diagnosticos': ('aparato_uid', 'diagnostico', 'fecha'),
+    'lineas_diagnostico': ('diagnostico_uid', 'aparato_uid', 'tipo', 'descripcion', 'cantidad', 'precio', 'importe'),
+}
+# Cómo se leen al exportar: expresión SQL de cada columna
+EXPRESIONES = {
+    'aparatos': {},
+    'diagnosticos': {'aparato_uid': "COALESCE(p.uid, :sucursal || '-' || p.id)"},
+    'lineas_diagnostico': {'diagnostico_uid': "COALESCE(d.uid, :sucursal || '-' || d.id)",
+                           'aparato_uid': "COALESCE(p.uid, :sucursal || '-' || p.id)"},
+}
+UNIONES = {
+    'aparatos': '',
+    'diagnosticos': 'JOIN aparatos p ON p.id = t.aparato_id',
+    'lineas_diagnostico': 'JOIN diagnosticos d ON d.id = t.diagnostico_id JOIN aparatos p ON p.id = t.aparato_id',
+}
+REFERENCIAS = {'aparato_uid': 'aparatos', 'diagnostico_uid': 'diagnosticos'}
+
+
+class ErrorSincronizacion(Exception):
+    pass
+
+
+def sucursal_de(db):
+    db.cursor.execute("SELECT valor FROM ajustes WHERE clave = 'sucursal'")
+    return db.cursor.fetchone()[0]
+
+
+def version_actual(db):
+    db.cursor.execute("SELECT valor FROM ajustes WHERE clave = 'version_cambios'")
+    return db.cursor.fetchone()[0]
+
+
+def filas_cambiadas(db, tabla, sucursal, desde, para):
+    # (uid, fecha, autor, valores...) de las filas vivas cambiadas después de
+    # `desde`, salvo las que llegaron justamente de `para`
+    columnas = ', '.join(EXPRESIONES[tabla].get(c, 't.' + c) for c in COLUMNAS[tabla])
+    cursor = db.conn.cursor()
+    cursor.execute('''
+        SELECT COALESCE(t.uid, :sucursal || '-' || t.id), c.fecha, COALESCE(c.autor, :sucursal), %s
+        FROM cambios c JOIN %s t ON t.id = c.fila_id %s
+        WHERE c.version > :desde AND c.tabla = :tabla AND COALESCE(c.recibido_de, '') != :para
+        ORDER BY c.version
+    ''' % (columnas, tabla, UNIONES[tabla]), {'sucursal': sucursal, 'desde': desde, 'tabla': tabla, 'para': para or ''})
+    return cursor
+
+
+def filas_borradas(db, tabla, sucursal, desde, para):
+    cursor = db.conn.cursor()
+    cursor.execute('''
+        SELECT uid, fecha, COALESCE(autor, :sucursal) FROM borrados
+        WHERE version > :desde AND tabla = :tabla AND COALESCE(recibido_de, '') != :para
+        ORDER BY version
+    ''', {'sucursal': sucursal, 'desde': desde, 'tabla': tabla, 'para': para or ''})
+    return cursor
+
+
+def exportar(db, archivo, para=None, desde=None):
+    # Escribe en `archivo` (binario) los cambios que `para` todavía no
+    # recibió. Sin `para` exporta todo lo registrado desde `desde` (o todo).
+    sucursal = sucursal_de(db)
+    if desde is None:
+        desde = 0
+        if para is not None:
+            db.cursor.execute('SELECT enviado FROM sincronizaciones WHERE sucursal = ?', (para,))
+            fila = db.cursor.fetchone()
+            desde = fila[0] if fila else 0
+    hasta = version_actual(db)
+    encabezado = {'formato': FORMATO_PAQUETE, 'sucursal': sucursal, 'para': para, 'desde': desde,
+                  'hasta': hasta, 'columnas': COLUMNAS}
+    cantidad = 0
+    with gzip.open(archivo, 'wt', encoding='utf-8') as salida:
+        salida.write(json.dumps(encabezado) + '\n')
+        # Primero altas y cambios de padres a hijos, después borrados de
+        # hijos a padres: el orden en que se aplican al importar
+        for tabla in TABLAS_SINCRONIZADAS:
+            for fila in filas_cambiadas(db, tabla, sucursal, desde, para):
+                salida.write(json.dumps([tabla, 0] + list(fila), ensure_ascii=False, separators=(',', ':')) + '\n')
+                cantidad += 1
+        for tabla in reversed(TABLAS_SINCRONIZADAS):
+            for fila in filas_borradas(db, tabla, sucursal, desde, para):
+                salida.write(json.dumps([tabla, 1] + list(fila), ensure_ascii=False, separators=(',', ':')) + '\n')
+                cantidad += 1
+    if para is not None:
+        with db.transaction():
+            db.cursor.execute('''
+                INSERT INTO sincronizaciones (sucursal, enviado, fecha) VALUES (?, ?, ?)
+                ON CONFLICT (sucursal) DO UPDATE SET enviado = excluded.enviado, fecha = excluded.fecha
+            ''', (para, hasta, time.time()))
+    return cantidad
+
+
+class Aplicador:
+    # Aplica las filas de un paquete de `origen` sobre db, dentro de la
+    # transacción de importar()
+    def __init__(self, db, origen):
+        self.db = db
+        self.origen = origen
+        self.sucursal = sucursal_de(db)
+        self.prefijo = self.sucursal + '-'
+        self.resultado = {'aplicados': 0, 'descartados': 0, 'iguales': 0, 'sin_referencia': 0}
+
+    def id_local(self, tabla, uid):
+        # Id de la fila viva con ese id global, o None
+        if uid.startswith(self.prefijo):
+            # Propia: con su id, o con uid si al revivirla su id ya estaba ocupado
+            self.db.cursor.execute('SELECT id FROM %s WHERE id = ? AND uid IS NULL UNION ALL SELECT id FROM %s WHERE uid = ?'
+                                   % (tabla, tabla), (int(uid[len(self.prefijo):]), uid))
+        else:
+            self.db.cursor.execute('SELECT id FROM %s WHERE uid = ?' % tabla, (uid,))
+        fila = self.db.cursor.fetchone()
+        return fila[0] if fila else None
+
+    def version_local(self, tabla, fila_id, uid):
+        # (fecha, autor) del último cambio local de la fila, o de su borrado
+        if fila_id is not None:
+            self.db.cursor.execute('SELECT fecha, COALESCE(autor, ?) FROM cambios WHERE tabla = ? AND fila_id = ?',
+                                   (self.sucursal, tabla, fila_id))
+        else:
+            self.db.cursor.execute('SELECT fecha, COALESCE(autor, ?) FROM borrados WHERE tabla = ? AND uid = ?',
+                                   (self.sucursal, tabla, uid))
+        fila = self.db.cursor.fetchone()
+        return tuple(fila) if fila else None
+
+    def aplicar(self, tabla, borrado, uid, fecha, autor, valores):
+        fila_id = self.id_local(tabla, uid)
+        local = self.version_local(tabla, fila_id, uid)
+        if local is not None and (fecha, autor) <= local:
+            self.resultado['iguales' if (fecha, autor) == local else 'descartados'] += 1
+            return
+        if borrado:
+            if fila_id is not None:
+                self.borrar(tabla, fila_id)
+            self.anotar_borrado(tabla, uid, fecha, autor)
+        else:
+            valores = dict(zip(COLUMNAS[tabla], valores))
+            for columna, referida in REFERENCIAS.items():
+                if columna in valores:
+                    valores[columna] = self.id_local(referida, valores[columna])
+                    if valores[columna] is None:
+                        self.resultado['sin_referencia'] += 1
+                        return
+            if fila_id is None:
+                fila_id = self.insertar(tabla, uid, valores)
+                self.db.cursor.execute('DELETE FROM borrados WHERE tabla = ? AND uid = ?', (tabla, uid))
+            else:
+                self.actualizar(tabla, fila_id, valores)
+            self.db.cursor.execute('UPDATE cambios SET fecha = ?, autor = ?, recibido_de = ? WHERE tabla = ? AND fila_id = ?',
+                                   (fecha, self.autor_local(autor), self.origen, tabla, fila_id))
+        self.resultado['aplicados'] += 1
+
+    def autor_local(self, autor):
+        return None if autor == self.sucursal else autor
+
+    def anotar_borrado(self, tabla, uid, fecha, autor):
+        self.db.cursor.execute('''
+            INSERT INTO borrados (tabla, uid, version, fecha, autor, recibido_de)
+            VALUES (?, ?, (SELECT valor FROM ajustes WHERE clave = 'version_cambios'), ?, ?, ?)
+            ON CONFLICT (tabla, uid) DO UPDATE SET fecha = excluded.fecha, autor = excluded.autor,
+                recibido_de = excluded.recibido_de
+        ''', (tabla, uid, fecha, self.autor_local(autor), self.origen))
+
+    def insertar(self, tabla, uid, valores):
+        # Las filas propias que vuelven (borradas aquí y revividas en otra
+        # sucursal) recuperan su id; las ajenas guardan su uid
+        fila_id = None
+        if uid.startswith(self.prefijo):
+            self.db.cursor.execute('SELECT 1 FROM %s WHERE id = ?' % tabla, (int(uid[len(self.prefijo):]),))
+            if self.db.cursor.fetchone() is None:
+                fila_id, uid = int(uid[len(self.prefijo):]), None
+        if tabla == 'aparatos':
+            self.db.cursor.execute('''
+                INSERT INTO aparatos (id, uid, tipo, marca, modelo, numero_serie, problema, estado,
+                                      nombre_cliente, telefono_cliente, observaciones)
+                VALUES (:id, :uid, :tipo, :marca, :modelo, :numero_serie, :problema, :estado,
+                        :nombre_cliente, :telefono_cliente, :observaciones)
+            ''', dict(valores, id=fila_id, uid=uid))
+            fila_id = self.db.cursor.lastrowid
+            self.db.registrar_transicion(fila_id, None, valores['estado'], 'sincronizacion', self.origen)
+            return fila_id
+        elif tabla == 'diagnosticos':
+            # valor lo completan los triggers de las líneas que llegan después
+            self.db.cursor.execute('''
+                INSERT INTO diagnosticos (id, uid, aparato_id, diagnostico, valor, fecha)
+                VALUES (:id, :uid, :aparato_uid, :diagnostico, 0, :fecha)
+            ''', dict(valores, id=fila_id, uid=uid))
+        else:
+            self.db.cursor.execute('''
+                INSERT INTO lineas_diagnostico (id, uid, diagnostico_id, aparato_id, tipo, descripcion,
+                                                cantidad, precio, importe)
+                VALUES (:id, :uid, :diagnostico_uid, :aparato_uid, :tipo, :descripcion, :cantidad, :precio, :importe)
+            ''', dict(valores, id=fila_id, uid=uid))
+        return self.db.cursor.lastrowid
+
+    def actualizar(self, tabla, fila_id, valores):
+        if tabla == 'aparatos':
+            # El cliente se vuelve a deducir al final de importar
+            self.db.cursor.execute('''
+                UPDATE aparatos SET tipo = :tipo, marca = :marca, modelo = :modelo, numero_serie = :numero_serie,
+                    problema = :problema, nombre_cliente = :nombre_cliente, telefono_cliente = :telefono_cliente,
+                    observaciones = :observaciones, cliente_id = NULL
+                WHERE id = :id
+            ''', dict(valores, id=fila_id))
+            # El estado pasa por el historial y las estadísticas como cualquier cambio
+            self.db.cambiar_estado_fila(fila_id, valores['estado'], 'sincronizacion', self.origen)
+        elif tabla == 'diagnosticos':
+            self.db.cursor.execute('UPDATE diagnosticos SET aparato_id = ?, diagnostico = ? WHERE id = ?',
+                                   (valores['aparato_uid'], valores['diagnostico'], fila_id))
+        # Las líneas no cambian: una versión nueva de la misma línea no trae nada
+
+    def borrar(self, tabla, fila_id):
+        if tabla == 'aparatos':
+            self.db.cursor.execute('SELECT estado FROM aparatos WHERE id = ?', (fila_id,))
+            estado = self.db.cursor.fetchone()[0]
+            self.db.cursor.execute('UPDATE estadisticas_estados SET en_cola = en_cola - 1 WHERE estado = ?',
+                                   (estado or '',))
+        # Los triggers de diagnosticos borran sus líneas y corrigen los totales
+        self.db.cursor.execute('DELETE FROM %s WHERE id = ?' % tabla, (fila_id,))
+
+
+def importar(db, archivo):
+    # Aplica un paquete de exportar(); todo o nada. Importar dos veces el
+    # mismo paquete no cambia nada.
+    with gzip.open(archivo, 'rt', encoding='utf-8') as entrada:
+        encabezado = json.loads(entrada.readline())
+        if encabezado.get('formato') != FORMATO_PAQUETE or encabezado.get('columnas') != {
+                tabla: list(columnas) for tabla, columnas in COLUMNAS.items()}:
+            raise ErrorSincronizacion('Paquete de un formato desconocido')
+        origen = encabezado['sucursal']
+        if origen == sucursal_de(db):
+            raise ErrorSincronizacion('El paquete es de esta misma sucursal')
+        aplicador = Aplicador(db, origen)
+        with db.transaction():
+            for linea in entrada:
+                tabla, borrado, uid, fecha, autor, *valores = json.loads(linea)
+                if tabla not in COLUMNAS:
+                    raise ErrorSincronizacion(f"Tabla desconocida en el paquete: {tabla}")
+                aplicador.aplicar(tabla, borrado, uid, fecha, autor, valores)
+            db.cursor.execute('''
+                INSERT INTO sincronizaciones (sucursal, recibido, fecha) VALUES (?, ?, ?)
+                ON CONFLICT (sucursal) DO UPDATE SET recibido = MAX(recibido, excluded.recibido), fecha = excluded.fecha
+            ''', (origen, encabezado['hasta'], time.time()))
+            # Los aparatos nuevos o modificados se enlazan con los clientes de esta base
+            db.vincular_clientes()
+            db.invalidar_detalle()
+    return dict(aplicador.resultado, sucursal=origen)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sincronizar sucursales con paquetes de cambios')
+    parser.add_argument('--db', default=None, help='Ruta de la base (por defecto REPARACIONES_DB o reparaciones.db)')
+    acciones = parser.add_subparsers(dest='accion', required=True)
+    acciones.add_parser('sucursal', help='Muestra el identificador de esta sucursal')
+    exportacion = acciones.add_parser('exportar', help='Escribe un paquete con los cambios')
+    exportacion.add_argument('--para', default=None, help='Sucursal destino: solo lo que aún no se le envió')
+    exportacion.add_argument('--desde', type=int, default=None, help='Versión desde la cual exportar (0 = todo)')
+    exportacion.add_argument('archivo')
+    importacion = acciones.add_parser('importar', help='Aplica un paquete de otra sucursal')
+    importacion.add_argument('archivo')
+    args = parser.parse_args(argv)
+
+    db = DatabaseManager(args.db)
+    try:
+        if args.accion == 'sucursal':
+            print(sucursal_de(db))
+        elif args.accion == 'exportar':
+            cantidad = exportar(db, args.archivo, args.para, args.desde)
+            print(f"{cantidad} cambios exportados a {args.archivo}", file=sys.stderr)
+        else:
+            try:
+                resultado = importar(db, args.archivo)
+            except ErrorSincronizacion as e:
+                print(e, file=sys.stderr)
+                return 1
+            print('Sucursal {sucursal}: {aplicados} cambios aplicados, {descartados} descartados por ser '
+                  'más viejos, {iguales} ya estaban, {sin_referencia} sin aparato o diagnóstico'.format(**resultado),
+                  file=sys.stderr)
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
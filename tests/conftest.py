@@ -0,0 +1,10 @@
+import pytest
+
+from database import DatabaseManager
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'reparaciones.db'))
+    yield db
+    db.close()
@@ -0,0 +1,39 @@
+import pytest
+
+from adjuntos import DirectorioAdjuntos
+from api import Rutas
+from servicio import ServicioReparaciones
+
+
+@pytest.fixture
+def rutas(db, tmp_path):
+    db.insert_aparato('TV', 'Sony', 'X1', 'SN1', 'No enciende', 'Recibido', 'Ana', '555')
+    return Rutas(ServicioReparaciones(db, 'prueba', DirectorioAdjuntos(str(tmp_path / 'adjuntos'))))
+
+
+@pytest.mark.parametrize('ruta', [
+    '/aparatos?after_id=-1',
+    '/aparatos?limit=0',
+    '/aparatos?limit=-5',
+    '/buscar?q=sony&limit=0',
+    '/tablero?dias_atraso=-1',
+    '/aparatos?after_id=uno',
+])
+def test_enteros_fuera_de_rango(rutas, ruta):
+    estado, respuesta = rutas.atender('GET', ruta, None)
+    assert estado == 400 and 'error' in respuesta
+
+
+def test_enteros_validos(rutas):
+    assert rutas.atender('GET', '/aparatos?after_id=0&limit=5000', None)[0] == 200
+    assert rutas.atender('GET', '/tablero?dias_atraso=0', None)[0] == 200
+
+
+def test_lote_no_se_anida(rutas):
+    estado, respuestas = rutas.atender('POST', '/lote', [
+        {'metodo': 'GET', 'ruta': '/aparatos/1'},
+        {'metodo': 'POST', 'ruta': '/lote', 'cuerpo': [{'metodo': 'GET', 'ruta': '/aparatos/1'}]},
+        {'metodo': 'POST', 'ruta': '/lote?x=1', 'cuerpo': []},
+    ])
+    assert estado == 200
+    assert [respuesta['estado'] for respuesta in respuestas] == [200, 400, 400]
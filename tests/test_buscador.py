@@ -0,0 +1,36 @@
+import threading
+
+from database import BuscadorAsincrono, DatabaseManager
+
+
+def test_entrega_resultados_y_errores_al_que_llama(db):
+    db.insert_aparato('TV', 'Sony', 'X1', 'SN1', 'No enciende', 'Recibido', 'Ana', '555')
+    recibidos, fallas, listo = [], [], threading.Event()
+    buscador = BuscadorAsincrono(db, lambda texto, filas: (recibidos.append((texto, filas)), listo.set()),
+                                 lambda texto, error: (fallas.append((texto, error)), listo.set()))
+    buscador.buscar('sony')
+    assert listo.wait(5)
+    assert [(texto, [fila[0] for fila in filas]) for texto, filas in recibidos] == [('sony', [1])]
+
+    # Un error que no es la interrupción va a al_fallar, no a la salida
+    listo.clear()
+    db.conn.execute('DROP TABLE aparatos_fts')
+    db.conn.commit()
+    buscador.buscar('sony')
+    assert listo.wait(5)
+    buscador.cerrar()
+    assert len(recibidos) == 1 and [texto for texto, _ in fallas] == ['sony']
+
+
+def test_base_en_memoria_busca_sin_hilo():
+    db = DatabaseManager(':memory:')
+    db.insert_aparato('TV', 'Sony', 'X1', 'SN1', 'No enciende', 'Recibido', 'Ana', '555')
+    recibidos, fallas = [], []
+    buscador = BuscadorAsincrono(db, lambda texto, filas: recibidos.append(texto),
+                                 lambda texto, error: fallas.append(texto))
+    buscador.buscar('sony')
+    db.conn.execute('DROP TABLE aparatos_fts')
+    buscador.buscar('sony')
+    buscador.cerrar()
+    db.close()
+    assert (recibidos, fallas) == (['sony'], ['sony'])
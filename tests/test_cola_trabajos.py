@@ -0,0 +1,96 @@
+import io
+
+import importar_exportar
+import sincronizacion
+from database import DatabaseManager, ESTADO_EN_COLA, ESTADO_EN_TRABAJO, ESTADO_LISTO
+from servicio import ServicioReparaciones
+
+
+def aparato(estado, serie='SN1'):
+    return ('TV', 'Sony', 'X1', serie, 'No enciende', estado, 'Ana', '555')
+
+
+def en_cola(db):
+    return [fila[0] for fila in db.get_cola_trabajos()]
+
+
+def trabajo(db, aparato_id):
+    return db.conn.execute('SELECT tecnico_id, terminado FROM trabajos WHERE aparato_id = ?',
+                           (aparato_id,)).fetchone()
+
+
+def test_insert_aparato_aprobado_entra_en_la_cola(db):
+    aparato_id = db.insert_aparato(*aparato(ESTADO_EN_COLA))
+    db.insert_aparato(*aparato('Recibido', 'SN2'))
+    assert en_cola(db) == [aparato_id]
+
+
+def test_insert_aparatos_many_encola_solo_los_aprobados(db):
+    db.insert_aparatos_many([aparato('Recibido', 'SN1'), aparato(ESTADO_EN_COLA, 'SN2'),
+                             aparato(ESTADO_EN_COLA, 'SN3')])
+    assert sorted(en_cola(db)) == [2, 3]
+
+
+def test_update_estado_encola_y_quita(db):
+    aparato_id = db.insert_aparato(*aparato('Revisado'))
+    db.update_estado(aparato_id, ESTADO_EN_COLA)
+    assert en_cola(db) == [aparato_id]
+    # Se revoca la aprobación
+    db.update_estado(aparato_id, 'Revisado')
+    assert en_cola(db) == []
+    assert trabajo(db, aparato_id) is None
+
+
+def test_update_estado_many_encola(db):
+    db.insert_aparatos_many([aparato('Revisado', 'SN%d' % i) for i in range(3)])
+    assert db.update_estado_many([(1, ESTADO_EN_COLA), (3, ESTADO_EN_COLA)]) == 2
+    assert sorted(en_cola(db)) == [1, 3]
+
+
+def test_en_reparacion_lo_toma_y_listo_lo_termina(db):
+    aparato_id = db.insert_aparato(*aparato(ESTADO_EN_COLA))
+    db.update_estado(aparato_id, ESTADO_EN_TRABAJO, usuario='Pedro')
+    assert en_cola(db) == []
+    assert trabajo(db, aparato_id) == (db.get_tecnico_id('Pedro'), None)
+    db.update_estado(aparato_id, ESTADO_LISTO)
+    assert trabajo(db, aparato_id)[1] is not None
+    assert db.get_trabajos_tecnico(db.get_tecnico_id('Pedro')) == []
+
+
+def test_tomar_siguiente_no_cambia_de_tecnico(db):
+    servicio = ServicioReparaciones(db)
+    primero = db.insert_aparato(*aparato(ESTADO_EN_COLA, 'SN1'))
+    segundo = db.insert_aparato(*aparato(ESTADO_EN_COLA, 'SN2'))
+    tomado = servicio.tomar_siguiente('Marta')
+    assert tomado.id in (primero, segundo)
+    assert tomado.estado == ESTADO_EN_TRABAJO
+    assert trabajo(db, tomado.id)[0] == db.get_tecnico_id('Marta')
+    assert en_cola(db) == [segundo if tomado.id == primero else primero]
+
+
+def test_importacion_encola_los_aprobados(db):
+    archivo = io.StringIO('tipo,marca,modelo,numero_serie,problema,estado,nombre_cliente,telefono_cliente\n'
+                          'TV,Sony,X1,SN1,No enciende,Aprobado,Ana,555\n'
+                          'Radio,LG,R2,SN2,Sin sonido,Recibido,Luis,556\n')
+    importadas, fallidas = importar_exportar.importar(db, 'aparatos', archivo, 'csv', errores=io.StringIO(),
+                                                      progreso=io.StringIO())
+    assert (importadas, fallidas) == (2, 0)
+    assert en_cola(db) == [1]
+
+
+def test_sincronizacion_encola_lo_aprobado_en_otra_sucursal(db, tmp_path):
+    otra = DatabaseManager(str(tmp_path / 'otra.db'))
+    try:
+        aparato_id = db.insert_aparato(*aparato('Revisado'))
+        paquete = str(tmp_path / 'alta.json.gz')
+        sincronizacion.exportar(db, paquete, sincronizacion.sucursal_de(otra))
+        sincronizacion.importar(otra, paquete)
+        assert en_cola(otra) == []
+
+        db.update_estado(aparato_id, ESTADO_EN_COLA)
+        paquete = str(tmp_path / 'aprobado.json.gz')
+        sincronizacion.exportar(db, paquete, sincronizacion.sucursal_de(otra))
+        sincronizacion.importar(otra, paquete)
+        assert len(en_cola(otra)) == 1
+    finally:
+        otra.close()
@@ -0,0 +1,25 @@
+from instrumentacion import Instrumentacion, conectar
+
+
+def test_cuenta_las_llamadas_sin_traza():
+    instrumentacion = Instrumentacion()
+    conn = conectar(instrumentacion, ':memory:')
+    conn.execute('CREATE TABLE t (x)')
+    conn.executemany('INSERT INTO t VALUES (?)', [(1,), (2,)])
+    assert conn.execute('SELECT COUNT(*) FROM t').fetchone() == (2,)
+    conn.close()
+    assert instrumentacion.llamadas == 3
+    # Las sentencias de SQLite solo se cuentan con la traza
+    assert instrumentacion.ejecutadas == 0
+    assert instrumentacion.resumen().startswith('SQL: 3 llamadas\n')
+
+
+def test_con_traza_cuenta_las_sentencias_de_sqlite():
+    instrumentacion = Instrumentacion(contar_sentencias=True)
+    conn = conectar(instrumentacion, ':memory:')
+    conn.execute('CREATE TABLE t (x)')
+    conn.executemany('INSERT INTO t VALUES (?)', [(1,), (2,)])
+    conn.close()
+    assert instrumentacion.llamadas == 2
+    assert instrumentacion.ejecutadas >= 3
+    assert 'sentencias ejecutadas por SQLite' in instrumentacion.resumen()
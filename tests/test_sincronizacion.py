@@ -0,0 +1,103 @@
+import time
+
+import pytest
+
+from database import DatabaseManager
+from sincronizacion import COLUMNAS, EXPRESIONES, UNIONES, exportar, importar, sucursal_de
+
+
+@pytest.fixture
+def sucursales(tmp_path):
+    a = DatabaseManager(str(tmp_path / 'sucursal_a.db'))
+    b = DatabaseManager(str(tmp_path / 'sucursal_b.db'))
+    yield a, b
+    a.close()
+    b.close()
+
+
+def intercambiar(origen, destino, ruta):
+    exportar(origen, str(ruta), sucursal_de(destino))
+    return importar(destino, str(ruta))
+
+
+def uid_de(db, tabla='aparatos'):
+    return "COALESCE(%s.uid, '%s-' || %s.id)" % (tabla, sucursal_de(db), tabla)
+
+
+def id_local(db, uid):
+    for (aparato_id,) in db.conn.execute('SELECT id FROM aparatos WHERE %s = ?' % uid_de(db), (uid,)):
+        return aparato_id
+    return None
+
+
+def foto(db):
+    # Filas por id global, y lo que cada base calcula por su cuenta:
+    # totales de los aparatos y trabajos abiertos de la cola
+    sucursal = sucursal_de(db)
+    resultado = {}
+    for tabla, columnas in COLUMNAS.items():
+        sql = 'SELECT COALESCE(t.uid, :sucursal || \'-\' || t.id), %s FROM %s t %s' % (
+            ', '.join(EXPRESIONES[tabla].get(c, 't.' + c) for c in columnas), tabla, UNIONES[tabla])
+        resultado[tabla] = set(db.conn.execute(sql, {'sucursal': sucursal}))
+    resultado['totales'] = set(db.conn.execute('''
+        SELECT %s, t.cantidad_diagnosticos, t.repuestos, t.mano_obra, t.impuestos, t.descuentos, t.total
+        FROM totales_aparatos t JOIN aparatos ON aparatos.id = t.aparato_id
+    ''' % uid_de(db)))
+    resultado['trabajos'] = set(db.conn.execute('''
+        SELECT %s, t.tecnico_id IS NULL FROM trabajos t JOIN aparatos ON aparatos.id = t.aparato_id
+        WHERE t.terminado IS NULL
+    ''' % uid_de(db)))
+    return resultado
+
+
+def huerfanos(db):
+    return db.conn.execute('''
+        SELECT COUNT(*) FROM totales_aparatos WHERE aparato_id NOT IN (SELECT id FROM aparatos)
+    ''').fetchone()[0]
+
+
+def test_cambios_de_los_dos_lados_convergen(sucursales, tmp_path):
+    a, b = sucursales
+    id_a, id_b = sucursal_de(a), sucursal_de(b)
+    a.insert_aparatos_many([('TV', 'Sony', 'X1', 'SN-A%d' % i, 'No enciende', 'Recibido', 'Ana', '555')
+                            for i in range(3)])
+    a.insert_diagnostico(1, 'Fuente', 50.0, [('repuesto', 'Capacitor', 2, 5.0), ('descuento', 'Cliente', 1, 4.0)])
+    a.insert_diagnostico(3, 'Placa', 80.0)
+    b.insert_aparato('Radio', 'LG', 'R2', 'SN-B1', 'Sin sonido', 'Aprobado', 'Luis', '556')
+
+    intercambiar(a, b, tmp_path / 'a_completo.json.gz')
+    intercambiar(b, a, tmp_path / 'b_completo.json.gz')
+    assert foto(a) == foto(b)
+    # El aparato de B tiene otro id local en A y el trabajo lo sigue
+    b_en_a = id_local(a, id_b + '-1')
+    assert b_en_a is not None and b_en_a != 1
+    assert (id_b + '-1', 1) in foto(a)['trabajos']
+
+    # Conflicto: los dos cambian el aparato 1 de A; gana el más reciente (B)
+    a.update_observaciones(1, 'Cambio en A')
+    time.sleep(0.01)
+    b.update_observaciones(id_local(b, id_a + '-1'), 'Cambio en B')
+    # Ediciones de cada lado sobre filas de la otra sucursal
+    a.insert_diagnostico(b_en_a, 'Parlante', 30.0, [('impuesto', 'IVA', 1, 3.6)])
+    b.update_estado(id_local(b, id_a + '-2'), 'Aprobado')
+    # Borrado en B de un aparato de A con su diagnóstico
+    borrado = id_local(b, id_a + '-3')
+    with b.transaction():
+        b.cursor.execute('DELETE FROM diagnosticos WHERE aparato_id = ?', (borrado,))
+        b.cursor.execute('DELETE FROM aparatos WHERE id = ?', (borrado,))
+
+    intercambiar(a, b, tmp_path / 'a_delta.json.gz')
+    intercambiar(b, a, tmp_path / 'b_delta.json.gz')
+    foto_a = foto(a)
+    assert foto_a == foto(b)
+    assert a.get_aparato(1)[9] == b.get_aparato(id_local(b, id_a + '-1'))[9] == 'Cambio en B'
+    assert id_local(a, id_a + '-3') is None
+    assert {uid for uid, _ in foto_a['trabajos']} == {id_a + '-2', id_b + '-1'}
+    totales_b = a.get_aparato_detalle(b_en_a)
+    assert (totales_b.cantidad_diagnosticos, totales_b.impuestos, totales_b.total) == (1, 3.6, 33.6)
+    assert huerfanos(a) == huerfanos(b) == 0
+
+    # Un segundo intercambio sin cambios nuevos no aplica nada
+    assert intercambiar(a, b, tmp_path / 'a_vacio.json.gz')['aplicados'] == 0
+    assert intercambiar(b, a, tmp_path / 'b_vacio.json.gz')['aplicados'] == 0
+    assert foto(a) == foto(b) == foto_a
@@ -0,0 +1,119 @@
+import pytest
+
+from adjuntos import DirectorioAdjuntos
+from mantenimiento import Mantenimiento
+
+
+def aparato(db, estado='Revisado', serie='SN1'):
+    return db.insert_aparato('TV', 'Sony', 'X1', serie, 'No enciende', estado, 'Ana', '555')
+
+
+def totales(db, aparato_id):
+    detalle = db.get_aparato_detalle(aparato_id)
+    return (detalle.cantidad_diagnosticos, detalle.repuestos, detalle.mano_obra, detalle.impuestos,
+            detalle.descuentos, detalle.total)
+
+
+def valores(db):
+    return dict(db.conn.execute('SELECT id, valor FROM diagnosticos'))
+
+
+def ingresos(db):
+    return db.conn.execute('SELECT COALESCE(SUM(diagnosticos), 0), COALESCE(SUM(total), 0) '
+                           'FROM ingresos_diarios').fetchone()
+
+
+def test_insert_diagnostico_con_lineas_de_cada_tipo(db):
+    aparato_id = aparato(db)
+    diagnostico_id = db.insert_diagnostico(aparato_id, 'Fuente quemada', 100.0, [
+        ('repuesto', 'Capacitor', 2, 40.0),
+        ('impuesto', 'IVA', 1, 12.0),
+        # El descuento resta aunque el precio venga con cualquier signo
+        ('descuento', 'Cliente frecuente', 1, 5.0),
+        ('descuento', 'Promoción', 1, -3.0),
+    ])
+    assert totales(db, aparato_id) == (1, 80.0, 100.0, 12.0, -8.0, 184.0)
+    assert valores(db) == {diagnostico_id: 184.0}
+    assert ingresos(db) == (1, 184.0)
+    assert [fila[5] for fila in db.get_lineas_aparato(aparato_id)] == [100.0, 80.0, 12.0, -5.0, -3.0]
+
+
+def test_insert_linea_va_al_ultimo_diagnostico(db):
+    aparato_id = aparato(db)
+    primero = db.insert_diagnostico(aparato_id, 'Revisión', 20.0)
+    segundo = db.insert_diagnostico(aparato_id, 'Reparación', 50.0)
+    db.insert_linea(aparato_id, 'repuesto', 'Pantalla', 1, 30.0)
+    db.insert_linea(aparato_id, 'descuento', 'Garantía', 1, 10.0, diagnostico_id=primero)
+    assert valores(db) == {primero: 10.0, segundo: 80.0}
+    assert totales(db, aparato_id) == (2, 30.0, 70.0, 0, -10.0, 90.0)
+    assert ingresos(db) == (2, 90.0)
+
+
+def test_insert_linea_sin_diagnostico(db):
+    aparato_id = aparato(db)
+    with pytest.raises(ValueError):
+        db.insert_linea(aparato_id, 'repuesto', 'Pantalla', 1, 30.0)
+    with pytest.raises(ValueError):
+        db.insert_diagnostico(aparato_id, 'Revisión', 0, [('regalo', 'Funda', 1, 1.0)])
+    # El diagnóstico con la línea inválida no quedó a medias
+    assert valores(db) == {}
+    assert db.get_aparato_detalle(aparato_id).cantidad_diagnosticos == 0
+
+
+def test_borrar_aparato_quita_sus_totales_e_ingresos(db):
+    queda, borrado = aparato(db, serie='SN1'), aparato(db, serie='SN2')
+    db.insert_diagnostico(queda, 'Revisión', 40.0)
+    db.insert_diagnostico(borrado, 'Revisión', 60.0, [('impuesto', 'IVA', 1, 6.0)])
+    with db.transaction():
+        db.cursor.execute('DELETE FROM diagnosticos WHERE aparato_id = ?', (borrado,))
+        db.cursor.execute('DELETE FROM aparatos WHERE id = ?', (borrado,))
+    assert db.conn.execute('SELECT aparato_id FROM totales_aparatos').fetchall() == [(queda,)]
+    assert db.conn.execute('SELECT COUNT(*) FROM lineas_diagnostico WHERE aparato_id = ?',
+                           (borrado,)).fetchone()[0] == 0
+    assert ingresos(db) == (1, 40.0)
+
+
+def test_archivar_mueve_los_totales_y_conserva_los_ingresos(db, tmp_path):
+    entregado, en_curso = aparato(db, serie='SN1'), aparato(db, serie='SN2')
+    db.insert_diagnostico(entregado, 'Revisión', 40.0, [('repuesto', 'Batería', 1, 25.0)])
+    db.insert_diagnostico(en_curso, 'Revisión', 15.0)
+    db.update_estado(entregado, 'Entregado')
+    mantenimiento = Mantenimiento(db.db_path, str(tmp_path / 'respaldos'), dias_archivo=0,
+                                  adjuntos=DirectorioAdjuntos(str(tmp_path / 'adjuntos')))
+    assert mantenimiento.ejecutar('archivar')['archivados'] == 1
+    mantenimiento.conn.close()
+    db.invalidar_detalle()
+    assert db.get_aparato_detalle(entregado) is None
+    assert db.conn.execute('SELECT aparato_id FROM totales_aparatos').fetchall() == [(en_curso,)]
+    assert totales(db, en_curso) == (1, 0, 15.0, 0, 0, 15.0)
+    assert ingresos(db) == (2, 80.0)
+
+
+def test_rebuild_coincide_con_lo_mantenido_por_los_triggers(db):
+    ids = [aparato(db, serie='SN%d' % i) for i in range(4)]
+    db.insert_diagnostico(ids[0], 'Fuente', 100.0, [('repuesto', 'Capacitor', 2, 7.5), ('descuento', 'Cliente', 1, 5.0)])
+    db.insert_diagnostico(ids[0], 'Placa', 0, [('impuesto', 'IVA', 1, 21.0)])
+    db.insert_diagnostico(ids[1], 'Pantalla', 250.0)
+    db.insert_linea(ids[1], 'mano_obra', 'Ajuste', 2, 12.5)
+    db.insert_diagnostico(ids[2], 'Revisión', 30.0)
+    with db.transaction():
+        db.cursor.execute('DELETE FROM diagnosticos WHERE aparato_id = ?', (ids[2],))
+    for i in range(6):
+        db.insert_diagnostico(aparato(db, serie='SNP%d' % i), 'Pantalla', 100.0 + i * 10)
+
+    tablas = ('precios_modelos', 'precios_cubetas', 'diagnosticos_modelos', 'estadisticas_estados')
+    antes = ({aparato_id: totales(db, aparato_id) for aparato_id in ids}, valores(db), ingresos(db),
+             {tabla: sorted(db.conn.execute('SELECT * FROM %s WHERE cantidad != 0' % tabla)
+                            if tabla != 'estadisticas_estados' else db.conn.execute('SELECT * FROM %s' % tabla))
+              for tabla in tablas})
+    # Se rompen los valores derivados a propósito
+    db.conn.execute('UPDATE totales_aparatos SET total = 0, repuestos = 0')
+    db.conn.execute('UPDATE diagnosticos SET valor = 0 WHERE id = 1')
+    db.rebuild_totales()
+    db.rebuild_precios()
+    db.rebuild_estadisticas_estados()
+    despues = ({aparato_id: totales(db, aparato_id) for aparato_id in ids}, valores(db), ingresos(db),
+               {tabla: sorted(db.conn.execute('SELECT * FROM %s WHERE cantidad != 0' % tabla)
+                              if tabla != 'estadisticas_estados' else db.conn.execute('SELECT * FROM %s' % tabla))
+                for tabla in tablas})
+    assert despues == antes
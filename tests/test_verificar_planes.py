@@ -0,0 +1,5 @@
+from benchmarks import verificar_planes
+
+
+def test_ninguna_consulta_recorre_una_tabla_completa():
+    assert verificar_planes.main() == 0